@@ -0,0 +1,155 @@
+"""
+Artifact store for large row columns (LEGAL_KB_ARTIFACT_FIELDS; off by default).
+A column value is serialized, compressed (zstd; gzip when zstandard is not installed) and
+uploaded to ARTIFACT_BUCKET under its sha256, so identical outputs are stored once. The column
+keeps a small reference instead of the value:
+  {"$artifact": {"bucket", "path", "sha256", "format", "encoding", "size", "stored_size"}, "summary": {...}}
+Text columns (docling_markdown) hold the same JSON behind ARTIFACT_PREFIX. Readers use
+load_artifact(), which passes inline values through unchanged. Until every reader of these
+columns does, leave LEGAL_KB_ARTIFACT_FIELDS empty.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import threading
+from functools import lru_cache
+from typing import Any
+
+from .config import ARTIFACT_BUCKET, ARTIFACT_FIELDS, ARTIFACT_ZSTD_LEVEL
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_KEY = "$artifact"
+ARTIFACT_PREFIX = "legal-kb-artifact:"
+# Columns that may hold references, and which of them are text
+ARTIFACT_COLUMNS = ("docling_json", "docling_markdown", "pageindex_tree")
+TEXT_COLUMNS = ("docling_markdown",)
+_EXTENSIONS = {"zstd": "zst", "gzip": "gz"}
+_GZIP_LEVEL = 6
+
+_uploaded: set[str] = set()
+_uploaded_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1)
+def _zstd() -> Any:
+    try:
+        import zstandard
+    except ImportError:
+        logger.info("zstandard is not installed; artifacts are gzip-compressed")
+        return None
+    return zstandard
+
+
+def _compress(data: bytes) -> tuple[bytes, str]:
+    zstd = _zstd()
+    if zstd is not None:
+        return zstd.ZstdCompressor(level=ARTIFACT_ZSTD_LEVEL).compress(data), "zstd"
+    return gzip.compress(data, compresslevel=_GZIP_LEVEL), "gzip"
+
+
+def _decompress(data: bytes, encoding: str) -> bytes:
+    if encoding == "gzip":
+        return gzip.decompress(data)
+    if encoding == "zstd":
+        zstd = _zstd()
+        if zstd is None:
+            raise RuntimeError("artifact is zstd-compressed; pip install zstandard to read it")
+        return zstd.ZstdDecompressor().decompress(data)
+    raise ValueError(f"unknown artifact encoding {encoding!r}")
+
+
+def _summary(value: Any) -> dict[str, int]:
+    """Sizes kept in the row: top-level collection lengths (Docling texts/tables/pages, ...) or text length."""
+    if isinstance(value, str):
+        return {"chars": len(value)}
+    if isinstance(value, dict):
+        return {k: len(v) for k, v in value.items() if isinstance(v, (list, dict))}
+    if isinstance(value, list):
+        return {"items": len(value)}
+    return {}
+
+
+def artifact_ref(value: Any) -> dict | None:
+    """The blob reference a column value holds, or None if the value is stored inline."""
+    if isinstance(value, str) and value.startswith(ARTIFACT_PREFIX):
+        try:
+            value = json.loads(value[len(ARTIFACT_PREFIX):])
+        except ValueError:
+            return None
+    if isinstance(value, dict) and isinstance(value.get(ARTIFACT_KEY), dict):
+        return value[ARTIFACT_KEY]
+    return None
+
+
+def _upload(supabase, path: str, data: bytes) -> None:
+    """Upload a blob unless it is already stored (same path = same content)."""
+    with _uploaded_lock:
+        if path in _uploaded:
+            return
+    try:
+        supabase.storage.from_(ARTIFACT_BUCKET).upload(
+            path, data, {"content-type": "application/octet-stream", "upsert": "false"}
+        )
+    except Exception as e:
+        if "duplicate" not in str(e).lower() and "already exists" not in str(e).lower():
+            raise
+    with _uploaded_lock:
+        _uploaded.add(path)
+
+
+def put_artifact(supabase, column: str, value: Any) -> Any:
+    """Store value as a blob; return what the column should hold (value itself if the upload fails)."""
+    is_text = column in TEXT_COLUMNS
+    raw = (value if is_text else json.dumps(value, separators=(",", ":"), ensure_ascii=False)).encode("utf-8")
+    digest = hashlib.sha256(raw).hexdigest()
+    data, encoding = _compress(raw)
+    path = f"{column}/{digest[:2]}/{digest}.{'txt' if is_text else 'json'}.{_EXTENSIONS[encoding]}"
+    try:
+        _upload(supabase, path, data)
+    except Exception as e:
+        logger.warning("Artifact upload of %s failed (%s); keeping it inline", column, e)
+        return value
+    ref = {
+        ARTIFACT_KEY: {
+            "bucket": ARTIFACT_BUCKET,
+            "path": path,
+            "sha256": digest,
+            "format": "text" if is_text else "json",
+            "encoding": encoding,
+            "size": len(raw),
+            "stored_size": len(data),
+        },
+        "summary": _summary(value),
+    }
+    return ARTIFACT_PREFIX + json.dumps(ref, separators=(",", ":")) if is_text else ref
+
+
+def store_artifacts(supabase, payload: dict[str, Any]) -> dict[str, Any]:
+    """payload with its ARTIFACT_FIELDS columns uploaded and replaced by references (None and references left as is)."""
+    fields = [
+        f for f in ARTIFACT_FIELDS
+        if f in ARTIFACT_COLUMNS and payload.get(f) is not None and artifact_ref(payload[f]) is None
+    ]
+    if not fields:
+        return payload
+    payload = dict(payload)
+    for field in fields:
+        if field in TEXT_COLUMNS and not isinstance(payload[field], str):
+            continue
+        payload[field] = put_artifact(supabase, field, payload[field])
+    return payload
+
+
+def load_artifact(supabase, value: Any) -> Any:
+    """A column's value: references are downloaded, checked against their sha256 and decoded."""
+    ref = artifact_ref(value)
+    if ref is None:
+        return value
+    data = supabase.storage.from_(ref["bucket"]).download(ref["path"])
+    raw = _decompress(data, ref.get("encoding", "zstd"))
+    if hashlib.sha256(raw).hexdigest() != ref["sha256"]:
+        raise ValueError(f"artifact {ref['bucket']}/{ref['path']} does not match its sha256")
+    return raw.decode("utf-8") if ref.get("format") == "text" else json.loads(raw)
+
@@ -0,0 +1,385 @@
+"""
+Bulk metadata extraction through the OpenAI Batch API (backfills and firm onboarding).
+Entries that already have Docling output (processing_status docling_complete, e.g. from a
+worker running with --defer-extraction) are turned into the same prompts the worker sends
+(extraction.extraction_prompts), submitted as batch input files, and the results are applied
+to legal_knowledge_base when the batch completes. Applied entries move to processing_status
+extraction_complete, get an extraction checkpoint, and have their job requeued, so a worker
+finishes the remaining stages without extracting again (with stage checkpoints on). Replies
+are also written to this host's LLM response cache.
+"""
+import io
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Iterator
+
+from .artifacts import load_artifact
+from .clients import get_batch_client
+from .config import (
+    BATCH_COMPLETION_WINDOW,
+    BATCH_MAX_BYTES,
+    BATCH_MAX_REQUESTS,
+    BATCH_POLL_INTERVAL,
+    ENRICH_WORKERS,
+    LLM_MODEL,
+    STAGE_CHECKPOINTS,
+)
+from .checkpoints import with_stage
+from .extraction import (
+    combine_extractions,
+    extraction_prompts,
+    extraction_request_options,
+    merge_extracted,
+    parse_json_reply,
+    repair_json_reply,
+)
+from .jobs import requeue_entry_jobs
+from .llm_cache import get_llm_cache
+from .stages import docling_sections, extracted_fields
+
+logger = logging.getLogger(__name__)
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+READY_STATUS = "docling_complete"
+DONE_STATUS = "extraction_complete"
+_TERMINAL_STATES = ("completed", "failed", "expired", "cancelled")
+_EXISTING_COLUMNS = (
+    "id, title, summary, document_type, jurisdiction, case_name, case_citation, court_name, "
+    "decision_date, statute_name, statute_number, practice_areas, keywords, key_points, legal_principles"
+)
+
+
+@dataclass
+class BatchInput:
+    """One batch input file: JSONL request lines and the prompt behind each custom_id."""
+
+    lines: list[str] = field(default_factory=list)
+    prompts: dict[str, str] = field(default_factory=dict)
+    size: int = 0
+
+
+def _cache_extra() -> str | None:
+    # Same LLM cache key as the worker's extraction requests
+    return "json_schema" if extraction_request_options() else None
+
+
+def custom_id(entry_id: str, part: int, parts: int) -> str:
+    return f"{entry_id}:{part}:{parts}"
+
+
+def parse_custom_id(value: str) -> tuple[str, int, int]:
+    entry_id, part, parts = value.rsplit(":", 2)
+    return entry_id, int(part), int(parts)
+
+
+def select_entries(supabase, limit: int = 0, page_size: int = 100) -> Iterator[dict]:
+    """
+    Yield entries ready for bulk extraction (Docling done, no extraction yet) in id order.
+    Only the section list of docling_json is fetched (for the prompt hint), not the whole document.
+    """
+    start = 0
+    returned = 0
+    while True:
+        r = (
+            supabase.table("legal_knowledge_base")
+            .select(
+                "id, docling_markdown, "
+                "docling_items:docling_json->items, docling_export_items:docling_json->export_format->items"
+            )
+            .eq("processing_status", READY_STATUS)
+            .not_.is_("docling_markdown", "null")
+            .order("id")
+            .range(start, start + page_size - 1)
+            .execute()
+        )
+        rows = r.data or []
+        for row in rows:
+            row["docling_markdown"] = load_artifact(supabase, row.get("docling_markdown"))
+            yield row
+            returned += 1
+            if limit and returned >= limit:
+                return
+        if len(rows) < page_size:
+            return
+        start += page_size
+
+
+def entry_prompts(row: dict) -> list[str]:
+    hint = docling_sections({
+        "items": row.get("docling_items"),
+        "export_format": {"items": row.get("docling_export_items")},
+    })
+    return extraction_prompts(row.get("docling_markdown") or "", docling_sections_hint=hint)
+
+
+def _request_line(cid: str, prompt: str) -> str:
+    return json.dumps({
+        "custom_id": cid,
+        "method": "POST",
+        "url": BATCH_ENDPOINT,
+        "body": {
+            "model": LLM_MODEL,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": 0,
+            **extraction_request_options(),
+        },
+    })
+
+
+def build_batch_inputs(
+    rows: Iterator[dict],
+    max_requests: int = BATCH_MAX_REQUESTS,
+    max_bytes: int = BATCH_MAX_BYTES,
+) -> tuple[list[BatchInput], dict[str, list[str]]]:
+    """
+    Split entries into batch input files within the per-batch limits (an entry's chunk prompts
+    always share a file). Entries whose every prompt is already in the LLM cache are returned
+    separately as {entry_id: [reply, ...]} and need no batch at all.
+    """
+    cache = get_llm_cache()
+    batches: list[BatchInput] = []
+    current = BatchInput()
+    cached_replies: dict[str, list[str]] = {}
+    for row in rows:
+        entry_id = str(row["id"])
+        prompts = entry_prompts(row)
+        if cache is not None:
+            hits = [cache.get(LLM_MODEL, 0, p, extra=_cache_extra()) for p in prompts]
+            if all(h is not None for h in hits):
+                cached_replies[entry_id] = hits
+                continue
+        lines = [_request_line(custom_id(entry_id, i, len(prompts)), p) for i, p in enumerate(prompts)]
+        size = sum(len(line.encode("utf-8")) + 1 for line in lines)
+        if current.lines and (
+            len(current.lines) + len(lines) > max_requests or current.size + size > max_bytes
+        ):
+            batches.append(current)
+            current = BatchInput()
+        current.lines.extend(lines)
+        current.size += size
+        for i, p in enumerate(prompts):
+            current.prompts[custom_id(entry_id, i, len(prompts))] = p
+    if current.lines:
+        batches.append(current)
+    return batches, cached_replies
+
+
+def submit_batch(batch_input: BatchInput, description: str = "legal_kb bulk extraction") -> str:
+    """Upload the input file and create the batch; return the batch id."""
+    client = get_batch_client()
+    data = ("\n".join(batch_input.lines) + "\n").encode("utf-8")
+    uploaded = client.files.create(file=("legal_kb_extraction.jsonl", io.BytesIO(data)), purpose="batch")
+    batch = client.batches.create(
+        input_file_id=uploaded.id,
+        endpoint=BATCH_ENDPOINT,
+        completion_window=BATCH_COMPLETION_WINDOW,
+        metadata={"description": description},
+    )
+    logger.info("Submitted batch %s (%d requests, %d bytes)", batch.id, len(batch_input.lines), len(data))
+    return batch.id
+
+
+def wait_for_batch(batch_id: str, poll_interval: float = BATCH_POLL_INTERVAL, timeout: float = 0) -> Any:
+    """Poll until the batch reaches a terminal state (or timeout seconds pass, 0 = no limit)."""
+    client = get_batch_client()
+    deadline = time.monotonic() + timeout if timeout else None
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        counts = getattr(batch, "request_counts", None)
+        logger.info(
+            "Batch %s: %s (%s/%s done, %s failed)",
+            batch_id,
+            batch.status,
+            getattr(counts, "completed", "?"),
+            getattr(counts, "total", "?"),
+            getattr(counts, "failed", "?"),
+        )
+        if batch.status in _TERMINAL_STATES:
+            return batch
+        if deadline is not None and time.monotonic() >= deadline:
+            raise TimeoutError(f"Batch {batch_id} still {batch.status} after {timeout}s")
+        time.sleep(poll_interval)
+
+
+def _read_jsonl(file_id: str | None) -> Iterator[dict]:
+    if not file_id:
+        return
+    text = get_batch_client().files.content(file_id).text
+    for line in text.splitlines():
+        if line.strip():
+            yield json.loads(line)
+
+
+def read_batch_results(batch: Any) -> tuple[dict[str, str], dict[str, str]]:
+    """Return ({custom_id: reply text}, {custom_id: error}) for a finished batch."""
+    replies: dict[str, str] = {}
+    errors: dict[str, str] = {}
+    for record in _read_jsonl(getattr(batch, "output_file_id", None)):
+        cid = record.get("custom_id")
+        response = record.get("response") or {}
+        body = response.get("body") or {}
+        if record.get("error") or response.get("status_code", 200) >= 400:
+            errors[cid] = json.dumps(record.get("error") or body.get("error") or body)[:500]
+            continue
+        try:
+            replies[cid] = body["choices"][0]["message"]["content"] or ""
+        except (KeyError, IndexError, TypeError):
+            errors[cid] = "malformed response body"
+    for record in _read_jsonl(getattr(batch, "error_file_id", None)):
+        errors[record.get("custom_id")] = json.dumps(record.get("error") or record.get("response"))[:500]
+    return replies, errors
+
+
+def read_batch_prompts(batch: Any) -> dict[str, str]:
+    """Prompts by custom_id from the batch's input file (used to seed the LLM cache on collect)."""
+    prompts = {}
+    for record in _read_jsonl(getattr(batch, "input_file_id", None)):
+        try:
+            prompts[record["custom_id"]] = record["body"]["messages"][-1]["content"]
+        except (KeyError, IndexError, TypeError):
+            continue
+    return prompts
+
+
+def group_replies(replies: dict[str, str]) -> tuple[dict[str, list[str]], list[str]]:
+    """Group replies by entry in part order; entries missing a part are returned as incomplete."""
+    parts_by_entry: dict[str, dict[int, str]] = {}
+    expected: dict[str, int] = {}
+    for cid, reply in replies.items():
+        entry_id, part, parts = parse_custom_id(cid)
+        parts_by_entry.setdefault(entry_id, {})[part] = reply
+        expected[entry_id] = parts
+    complete: dict[str, list[str]] = {}
+    incomplete: list[str] = []
+    for entry_id, parts in parts_by_entry.items():
+        if len(parts) == expected[entry_id]:
+            complete[entry_id] = [parts[i] for i in range(expected[entry_id])]
+        else:
+            incomplete.append(entry_id)
+    return complete, incomplete
+
+
+def seed_llm_cache(replies: dict[str, str], prompts: dict[str, str]) -> None:
+    cache = get_llm_cache()
+    if cache is None:
+        return
+    for cid, reply in replies.items():
+        prompt = prompts.get(cid)
+        if prompt:
+            try:
+                parse_json_reply(reply)
+            except json.JSONDecodeError:
+                continue
+            cache.put(LLM_MODEL, 0, prompt, reply, extra=_cache_extra())
+
+
+def apply_results(supabase, replies_by_entry: dict[str, list[str]], workers: int = ENRICH_WORKERS) -> tuple[int, int]:
+    """
+    Merge each entry's replies with its existing row (user-provided values win, as in the worker)
+    and update legal_knowledge_base. Existing rows are read in one request per 200 entries;
+    updates run concurrently. The extraction output is checkpointed and the entries' jobs are
+    requeued, so a worker finishes them resuming after extraction. Returns (applied, failed).
+    """
+    entry_ids = list(replies_by_entry)
+    columns = _EXISTING_COLUMNS + (", processing_checkpoints" if STAGE_CHECKPOINTS else "")
+    existing_rows: dict[str, dict] = {}
+    for i in range(0, len(entry_ids), 200):
+        r = supabase.table("legal_knowledge_base").select(columns).in_("id", entry_ids[i:i + 200]).execute()
+        for row in r.data or []:
+            existing_rows[str(row["id"])] = row
+
+    def apply_one(entry_id: str) -> bool:
+        parts = []
+        for reply in replies_by_entry[entry_id]:
+            try:
+                parts.append(parse_json_reply(reply))
+            except json.JSONDecodeError as e:
+                part = repair_json_reply(reply)
+                if part is None:
+                    logger.warning("Entry %s: unparseable extraction reply: %s", entry_id, e)
+                    return False
+                parts.append(part)
+        data = combine_extractions(parts)
+        existing = existing_rows.get(entry_id) or {}
+        payload = extracted_fields(existing, merge_extracted(data, existing))
+        payload["processing_status"] = DONE_STATUS
+        state = existing.get("processing_checkpoints")
+        if state and state.get("content_hash"):
+            payload["processing_checkpoints"] = with_stage(state, "extraction", data)
+        payload["updated_at"] = datetime.now(tz=timezone.utc).isoformat()
+        try:
+            supabase.table("legal_knowledge_base").update(payload).eq("id", entry_id).eq(
+                "processing_status", READY_STATUS
+            ).execute()
+        except Exception as e:
+            logger.warning("Entry %s: update failed: %s", entry_id, e)
+            return False
+        return True
+
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="batch-apply") as pool:
+        results = list(pool.map(apply_one, entry_ids))
+    applied_ids = [entry_id for entry_id, ok in zip(entry_ids, results) if ok]
+    if applied_ids:
+        requeue_applied(supabase, applied_ids)
+    return len(applied_ids), len(results) - len(applied_ids)
+
+
+def requeue_applied(supabase, entry_ids: list[str]) -> int:
+    """Requeue the jobs of extracted entries so a worker runs their remaining stages."""
+    try:
+        requeued = requeue_entry_jobs(supabase, entry_ids)
+    except Exception as e:
+        logger.warning("Requeueing %d extracted entries failed (retry with scripts.batch_extract requeue): %s", len(entry_ids), e)
+        return 0
+    if requeued < len(entry_ids):
+        logger.warning(
+            "%d of %d extracted entries had no completed job to requeue", len(entry_ids) - requeued, len(entry_ids)
+        )
+    return requeued
+
+
+def requeue_extracted(supabase, limit: int = 0, page_size: int = 200) -> int:
+    """Requeue the jobs of entries left extraction_complete (e.g. applied before jobs were requeued)."""
+    entry_ids: list[str] = []
+    start = 0
+    while True:
+        r = (
+            supabase.table("legal_knowledge_base")
+            .select("id")
+            .eq("processing_status", DONE_STATUS)
+            .order("id")
+            .range(start, start + page_size - 1)
+            .execute()
+        )
+        rows = r.data or []
+        entry_ids.extend(str(row["id"]) for row in rows)
+        if len(rows) < page_size or (limit and len(entry_ids) >= limit):
+            break
+        start += page_size
+    entry_ids = entry_ids[:limit] if limit else entry_ids
+    return requeue_applied(supabase, entry_ids) if entry_ids else 0
+
+
+def collect_batch(supabase, batch_id: str, poll_interval: float = BATCH_POLL_INTERVAL, timeout: float = 0) -> tuple[int, int]:
+    """Wait for batch_id, seed the LLM cache and apply its results. Returns (applied, failed)."""
+    batch = wait_for_batch(batch_id, poll_interval, timeout)
+    if batch.status != "completed":
+        logger.warning("Batch %s ended %s; applying whatever results it has", batch_id, batch.status)
+    replies, errors = read_batch_results(batch)
+    for cid, err in list(errors.items())[:20]:
+        logger.warning("Batch request %s failed: %s", cid, err)
+    seed_llm_cache(replies, read_batch_prompts(batch))
+    complete, incomplete = group_replies(replies)
+    failed_entries = {parse_custom_id(cid)[0] for cid in errors if cid} | set(incomplete)
+    for entry_id in failed_entries:
+        complete.pop(entry_id, None)
+    applied, failed = apply_results(supabase, complete)
+    logger.info(
+        "Batch %s: %d entries applied, %d failed to apply, %d with failed requests (left %s)",
+        batch_id, applied, failed, len(failed_entries), READY_STATUS,
+    )
+    return applied, failed + len(failed_entries)
@@ -0,0 +1,212 @@
+"""
+Content-addressed result cache for pipeline stages.
+Keys are sha256 of the downloaded file bytes plus a per-stage version tag (pipeline,
+model and option settings), so identical uploads across matters and across the KB and
+case-document queues reuse Docling output, PageIndex trees, extraction results and
+embeddings. Entries live in a local on-disk store with size-based (LRU) eviction and
+optionally in a shared Supabase table so replicas benefit from each other's work.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import Any
+
+from .config import (
+    DOCLING_DO_OCR,
+    DOCLING_DO_TABLE_STRUCTURE,
+    DOCLING_TABLE_MODE,
+    EMBEDDING_DIM,
+    EMBEDDING_MODEL,
+    ENABLE_RESULT_CACHE,
+    EXTRACTION_CHUNK_CHARS,
+    EXTRACTION_CHUNK_THRESHOLD,
+    EXTRACTION_MODE,
+    EXTRACTION_STRUCTURED_OUTPUT,
+    EXTRACTION_TOKEN_BUDGET,
+    LLM_MODEL,
+    MAX_MARKDOWN_FOR_EXTRACTION,
+    OPENAI_API_KEY,
+    PAGEINDEX_ADD_NODE_SUMMARY,
+    PIPELINE_NAME,
+    RESULT_CACHE_DIR,
+    RESULT_CACHE_MAX_BYTES,
+    RESULT_CACHE_SHARED_TABLE,
+    SUPABASE_SERVICE_ROLE_KEY,
+    SUPABASE_URL,
+)
+from .context import tokenizer_name
+
+logger = logging.getLogger(__name__)
+
+# Bump to invalidate every cached result (e.g. when a stage's output format changes)
+CACHE_FORMAT_VERSION = "1"
+
+_READ_CHUNK = 1024 * 1024
+_result_cache: Any = None
+
+
+def stage_version(stage: str) -> str:
+    """Version tag for a stage: everything besides the input bytes that changes its output."""
+    add_summary = PAGEINDEX_ADD_NODE_SUMMARY and bool(OPENAI_API_KEY)
+    versions = {
+        "docling": f"ocr={DOCLING_DO_OCR};tables={DOCLING_DO_TABLE_STRUCTURE};table_mode={DOCLING_TABLE_MODE}",
+        "tree": f"summary={add_summary};model={LLM_MODEL if add_summary else ''}",
+        "extraction": (
+            f"model={LLM_MODEL};max_chars={MAX_MARKDOWN_FOR_EXTRACTION};"
+            f"mode={EXTRACTION_MODE};chunk_threshold={EXTRACTION_CHUNK_THRESHOLD};"
+            f"chunk_chars={EXTRACTION_CHUNK_CHARS};"
+            f"token_budget={EXTRACTION_TOKEN_BUDGET};tokenizer={tokenizer_name()};"
+            f"structured={EXTRACTION_STRUCTURED_OUTPUT}"
+        ),
+        "embedding": f"model={EMBEDDING_MODEL};dim={EMBEDDING_DIM}",
+    }
+    return f"{PIPELINE_NAME}/v{CACHE_FORMAT_VERSION}/{stage}/{versions.get(stage, '')}"
+
+
+def file_sha256(file_path: str) -> str:
+    """sha256 of a file, read in chunks so large bundles are never fully in memory."""
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(_READ_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def text_sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    On-disk JSON store under root (one file per key, written atomically so several worker
+    processes can share the directory), evicting least recently used files once the store
+    exceeds max_bytes. When supabase and shared_table are set, misses fall through to the
+    shared table and writes are upserted there too.
+    """
+
+    def __init__(self, root: Path, max_bytes: int, supabase=None, shared_table: str | None = None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.supabase = supabase
+        self.shared_table = shared_table
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._approx_bytes = sum(p.stat().st_size for p in self.root.glob("*/*.json"))
+
+    @staticmethod
+    def key(content_hash: str, stage: str) -> str:
+        return hashlib.sha256(f"{content_hash}:{stage_version(stage)}".encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.json"
+
+    def get(self, content_hash: str, stage: str) -> Any | None:
+        key = self.key(content_hash, stage)
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                value = json.load(f)
+            os.utime(path)  # LRU: reads refresh mtime
+            logger.info("Result cache hit: %s %s", stage, content_hash[:12])
+            return value
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning("Result cache read failed for %s: %s", path, e)
+
+        value = self._get_shared(key)
+        if value is not None:
+            logger.info("Shared result cache hit: %s %s", stage, content_hash[:12])
+            self._write_local(key, value)
+        return value
+
+    def put(self, content_hash: str, stage: str, value: Any) -> None:
+        if value is None:
+            return
+        key = self.key(content_hash, stage)
+        self._write_local(key, value)
+        self._put_shared(key, stage, value)
+
+    def _write_local(self, key: str, value: Any) -> None:
+        path = self._path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile("w", dir=path.parent, delete=False, encoding="utf-8", suffix=".tmp") as f:
+                json.dump(value, f)
+                tmp_path = f.name
+            os.replace(tmp_path, path)
+            self._approx_bytes += path.stat().st_size
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning("Result cache write failed for %s: %s", path, e)
+            return
+        if self._approx_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self) -> None:
+        """Delete least recently used entries until the store is under 90% of max_bytes."""
+        files = []
+        for p in self.root.glob("*/*.json"):
+            try:
+                st = p.stat()
+            except FileNotFoundError:
+                continue
+            files.append((st.st_mtime, st.st_size, p))
+        total = sum(size for _, size, _ in files)
+        target = int(self.max_bytes * 0.9)
+        removed = 0
+        for _, size, p in sorted(files):
+            if total <= target:
+                break
+            p.unlink(missing_ok=True)
+            total -= size
+            removed += 1
+        self._approx_bytes = total
+        if removed:
+            logger.info("Result cache evicted %d entries (%d bytes remain)", removed, total)
+
+    def _get_shared(self, key: str) -> Any | None:
+        if self.supabase is None or not self.shared_table:
+            return None
+        try:
+            r = self.supabase.table(self.shared_table).select("value").eq("cache_key", key).limit(1).execute()
+            if r.data:
+                return r.data[0].get("value")
+        except Exception as e:
+            logger.warning("Shared result cache read failed: %s", e)
+        return None
+
+    def _put_shared(self, key: str, stage: str, value: Any) -> None:
+        if self.supabase is None or not self.shared_table:
+            return
+        try:
+            self.supabase.table(self.shared_table).upsert({
+                "cache_key": key,
+                "stage": stage,
+                "value": value,
+            }).execute()
+        except Exception as e:
+            logger.warning("Shared result cache write failed: %s", e)
+
+
+def get_result_cache() -> ResultCache | None:
+    """Lazy-init the process-wide result cache. Returns None if disabled or the directory is unusable."""
+    global _result_cache
+    if not ENABLE_RESULT_CACHE:
+        return None
+    if _result_cache is not None:
+        return _result_cache
+    supabase = None
+    if RESULT_CACHE_SHARED_TABLE and SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY:
+        try:
+            from supabase import create_client
+            supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+        except Exception as e:
+            logger.warning("Shared result cache disabled: %s", e)
+    try:
+        _result_cache = ResultCache(Path(RESULT_CACHE_DIR), RESULT_CACHE_MAX_BYTES, supabase, RESULT_CACHE_SHARED_TABLE)
+    except OSError as e:
+        logger.warning("Result cache init failed: %s", e)
+        return None
+    return _result_cache
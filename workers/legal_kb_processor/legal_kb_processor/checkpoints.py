@@ -0,0 +1,242 @@
+"""
+Stage checkpoints for resuming failed and requeued jobs.
+Each completed stage is recorded in the row's processing_checkpoints column with its version
+tag and completion time; its output goes to the usual row columns as soon as the stage is done
+(docling_markdown, pageindex_tree, cited_cases, ai_embedding, ...), or into the checkpoint
+itself when it has no column (extraction output). A retried job for the same file bytes reuses
+every stage whose version still matches and whose inputs were not redone after it, so a failure
+in extraction no longer costs another Docling run. Works across hosts, unlike the result cache.
+
+processing_checkpoints = {"content_hash": "<sha256>", "stages": {"<stage>": {"version", "at", "output"?}}}
+"""
+import json
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Any, Callable, Iterable, TypeVar
+
+from .artifacts import load_artifact, store_artifacts
+from .cache import stage_version
+from .config import (
+    EMBED_SECTIONS,
+    EMBEDDING_CHUNK_CHARS,
+    EMBEDDING_CHUNK_TABLE,
+    ENABLE_GRAPHITI,
+    ENABLE_VECTOR_FALLBACK,
+    GRAPHITI_PROVIDER,
+    OPENAI_API_KEY,
+)
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+STAGES = ("docling", "tree", "extraction", "citations", "embedding", "sections", "graphiti")
+# Stages whose output each stage consumes; redoing an input makes the stage stale
+STAGE_INPUTS = {
+    "tree": ("docling",),
+    "extraction": ("docling",),
+    "citations": ("docling",),
+    "embedding": ("extraction",),
+    "sections": ("tree",),
+    "graphiti": ("extraction", "citations"),
+}
+# Row columns holding each stage's output
+STAGE_COLUMNS = {
+    "docling": ("docling_markdown", "docling_json"),
+    "tree": ("pageindex_tree", "pageindex_metadata"),
+    "citations": ("cited_cases", "cited_statutes"),
+    "embedding": ("ai_embedding",),
+}
+
+
+def checkpoint_version(stage: str) -> str:
+    """Version tag recorded with a stage: the result cache's stage version plus what else changes its output."""
+    extra = {
+        "tree": "node_spans=1;flat_tree=1",
+        "citations": "parser=eyecite",
+        "embedding": f"enabled={ENABLE_VECTOR_FALLBACK and bool(OPENAI_API_KEY)}",
+        "sections": (
+            f"enabled={ENABLE_VECTOR_FALLBACK and EMBED_SECTIONS and bool(OPENAI_API_KEY)};"
+            f"chunk_chars={EMBEDDING_CHUNK_CHARS};table={EMBEDDING_CHUNK_TABLE}"
+        ),
+        "graphiti": f"enabled={ENABLE_GRAPHITI};provider={GRAPHITI_PROVIDER}",
+    }.get(stage)
+    version = stage_version(stage)
+    return f"{version};{extra}" if extra else version
+
+
+def checkpoint_entry(stage: str, output: Any = None) -> dict[str, Any]:
+    entry = {"version": checkpoint_version(stage), "at": datetime.now(tz=timezone.utc).isoformat()}
+    if output is not None:
+        entry["output"] = output
+    return entry
+
+
+def with_stage(state: dict | None, stage: str, output: Any = None) -> dict[str, Any]:
+    """A copy of a processing_checkpoints value with stage recorded as completed now."""
+    state = dict(state or {})
+    state["stages"] = {**(state.get("stages") or {}), stage: checkpoint_entry(stage, output)}
+    return state
+
+
+def _stage_columns(stage: str, value: Any) -> dict[str, Any]:
+    if stage == "docling":
+        return {"docling_markdown": value[0], "docling_json": value[1]}
+    if stage == "tree":
+        return {"pageindex_tree": value[0], "pageindex_metadata": value[1]}
+    if stage == "citations":
+        return {"cited_cases": value[0] or None, "cited_statutes": value[1] or None}
+    if stage == "embedding" and value is not None:
+        return {"ai_embedding": value}
+    return {}
+
+
+def _vector(value: Any) -> list[float] | None:
+    # PostgREST returns pgvector columns as their text form, "[0.1,0.2,...]"
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return None
+    return value
+
+
+class StageCheckpoints:
+    """
+    Checkpoint state of one row (legal_knowledge_base or documents) for one file. reusable holds
+    the stages whose recorded output can be used as is; run() reuses or computes and records.
+    Stages of one job record concurrently, so writes are serialized per row.
+    """
+
+    def __init__(
+        self,
+        supabase,
+        table: str,
+        row_id: str,
+        content_hash: str | None,
+        state: dict | None = None,
+        redo: Iterable[str] = (),
+    ):
+        self.supabase = supabase
+        self.table = table
+        self.row_id = row_id
+        state = state or {}
+        recorded_hash = state.get("content_hash")
+        self.content_hash = content_hash or recorded_hash
+        same_file = recorded_hash is not None and recorded_hash == self.content_hash
+        self.stages: dict[str, dict] = dict(state.get("stages") or {}) if same_file else {}
+        self.redo = set(redo)
+        self.reusable = {stage for stage in STAGES if self._current(stage)}
+        self.row: dict[str, Any] = {}
+        # Columns the row already holds for this run; the final update need not resend them
+        self.saved_columns: set[str] = {c for stage in self.reusable for c in STAGE_COLUMNS.get(stage, ())}
+        self._lock = threading.Lock()
+
+    def _current(self, stage: str) -> bool:
+        entry = self.stages.get(stage)
+        if stage in self.redo or entry is None or entry.get("version") != checkpoint_version(stage):
+            return False
+        return all(
+            self._current(dep) and self.stages[dep].get("at", "") <= entry.get("at", "")
+            for dep in STAGE_INPUTS.get(stage, ())
+        )
+
+    def restore(self, stage: str) -> Any:
+        """
+        A stage's recorded output (from the row columns loaded by load_checkpoints, or the
+        checkpoint); columns in the artifact store are downloaded.
+        """
+        row = self.row
+        if stage == "docling":
+            return (
+                load_artifact(self.supabase, row.get("docling_markdown")) or "",
+                load_artifact(self.supabase, row.get("docling_json")),
+            )
+        if stage == "tree":
+            return load_artifact(self.supabase, row.get("pageindex_tree")), row.get("pageindex_metadata") or {}
+        if stage == "citations":
+            return list(row.get("cited_cases") or []), list(row.get("cited_statutes") or [])
+        if stage == "embedding":
+            return _vector(row.get("ai_embedding"))
+        return (self.stages.get(stage) or {}).get("output")
+
+    def record(self, stage: str, value: Any) -> None:
+        """Write a completed stage's output columns and checkpoint. A failed write is logged, not raised."""
+        columns = store_artifacts(self.supabase, _stage_columns(stage, value))
+        entry = checkpoint_entry(stage, value if stage == "extraction" else None)
+        with self._lock:
+            stages = {**self.stages, stage: entry}
+            payload = {
+                **columns,
+                "processing_checkpoints": {"content_hash": self.content_hash, "stages": stages},
+                "updated_at": entry["at"],
+            }
+            if stage == "docling":
+                payload["processing_status"] = "docling_complete"
+            try:
+                self.supabase.table(self.table).update(payload).eq("id", self.row_id).execute()
+            except Exception as e:
+                logger.warning("Could not checkpoint %s for %s %s: %s", stage, self.table, self.row_id, e)
+                return
+            self.stages = stages
+            self.saved_columns.update(columns)
+
+    def run(self, stage: str, compute: Callable[[], T], keep: Callable[[T], bool] | None = None) -> T:
+        """compute() unless stage is reusable; a fresh result is recorded (only if keep(result), when given)."""
+        if stage in self.reusable:
+            logger.info("Reusing %s checkpoint for %s %s", stage, self.table, self.row_id)
+            return self.restore(stage)
+        value = compute()
+        if keep is None or keep(value):
+            self.record(stage, value)
+        return value
+
+    def unsaved(self, update_payload: dict[str, Any]) -> dict[str, Any]:
+        """update_payload without the columns already written by checkpoints."""
+        return {k: v for k, v in update_payload.items() if k not in self.saved_columns}
+
+
+def load_checkpoints(
+    supabase,
+    table: str,
+    row_id: str,
+    content_hash: str | None = None,
+    redo: Iterable[str] = (),
+    restore: Iterable[str] = (),
+) -> StageCheckpoints | None:
+    """
+    Checkpoint state of a row for the file with content_hash (None: whatever file was recorded).
+    Output columns of reusable stages, and of the stages in restore, are loaded too. Returns
+    None if the state cannot be read (e.g. the processing_checkpoints column is missing).
+    """
+    try:
+        r = supabase.table(table).select("processing_checkpoints").eq("id", row_id).limit(1).execute()
+        state = (r.data or [{}])[0].get("processing_checkpoints")
+        checkpoints = StageCheckpoints(supabase, table, row_id, content_hash, state, redo)
+        columns = sorted({c for stage in checkpoints.reusable | set(restore) for c in STAGE_COLUMNS.get(stage, ())})
+        if columns:
+            r = supabase.table(table).select(", ".join(columns)).eq("id", row_id).limit(1).execute()
+            checkpoints.row = (r.data or [{}])[0]
+    except Exception as e:
+        logger.warning("Could not load checkpoints for %s %s: %s", table, row_id, e)
+        return None
+    if checkpoints.reusable:
+        logger.info("%s %s: resuming with %s done", table, row_id, ", ".join(sorted(checkpoints.reusable)))
+    return checkpoints
+
+
+def run_stage(
+    checkpoints: StageCheckpoints | None,
+    stage: str,
+    compute: Callable[[], T],
+    keep: Callable[[T], bool] | None = None,
+) -> T:
+    """checkpoints.run(), or just compute() when checkpoints are off."""
+    if checkpoints is None:
+        return compute()
+    return checkpoints.run(stage, compute, keep)
+
+
+def needs_stage(checkpoints: StageCheckpoints | None, stage: str) -> bool:
+    return checkpoints is None or stage not in checkpoints.reusable
@@ -0,0 +1,202 @@
+"""
+Normalized citation -> KB entry index (CITATION_INDEX_TABLE).
+Each entry contributes its own citations (case_citation, statute_number; relation "is") and the
+citations parsed from its text (cited_cases, cited_statutes; relation "cites") in one normalized
+form, so "which entry is X" and "which entries cite X" are indexed lookups rather than scans or
+LLM calls. Jobs replace their entry's rows; rebuild_index() regenerates them from
+legal_knowledge_base. CitationIndex holds the same mapping in memory for bulk work.
+"""
+import logging
+import re
+import unicodedata
+from collections import defaultdict
+from typing import Any, Iterable, Iterator
+
+from .config import CITATION_INDEX_TABLE
+
+logger = logging.getLogger(__name__)
+
+IS = "is"
+CITES = "cites"
+_OWN_FIELDS = (("case_citation", "case"), ("statute_number", "statute"))
+_PUNCT_RE = re.compile(r"[^\w\s]")
+_SPACE_RE = re.compile(r"\s+")
+# "u s c" -> "usc" (abbreviations written with spaced periods)
+_SPACED_LETTERS_RE = re.compile(r"\b([a-z]) (?=[a-z]\b)")
+
+
+def normalize_citation(citation: str) -> str:
+    """
+    Canonical form for matching: case-folded, periods dropped ("U.S." == "US"), other punctuation
+    as spaces ("[2019] eKLR" == "2019 eKLR", "§ 1983" == "1983"), whitespace collapsed.
+    """
+    text = unicodedata.normalize("NFKC", citation or "").casefold().replace(".", "")
+    text = _SPACE_RE.sub(" ", _PUNCT_RE.sub(" ", text)).strip()
+    return _SPACED_LETTERS_RE.sub(r"\1", text)
+
+
+def entry_index_rows(
+    entry_id: str,
+    organization_id: str | None,
+    own: dict[str, Any],
+    cited_cases: Iterable[str],
+    cited_statutes: Iterable[str],
+) -> list[dict[str, Any]]:
+    """Index rows for one entry: own = its case_citation / statute_number values."""
+    rows: dict[tuple[str, str], dict[str, Any]] = {}
+
+    def add(raw: Any, kind: str, relation: str) -> None:
+        citation = normalize_citation(str(raw)) if raw else ""
+        if citation and (citation, relation) not in rows:
+            rows[(citation, relation)] = {
+                "citation": citation,
+                "entry_id": entry_id,
+                "organization_id": organization_id,
+                "relation": relation,
+                "kind": kind,
+                "raw": str(raw)[:500],
+            }
+
+    for field, kind in _OWN_FIELDS:
+        add(own.get(field), kind, IS)
+    for raw in cited_cases or ():
+        add(raw, "case", CITES)
+    for raw in cited_statutes or ():
+        add(raw, "statute", CITES)
+    return list(rows.values())
+
+
+class CitationIndex:
+    """In-memory citation index (normalized citation -> entry ids) built from index rows."""
+
+    def __init__(self):
+        self._entries: dict[str, dict[str, set[str]]] = {IS: defaultdict(set), CITES: defaultdict(set)}
+        self._raw: dict[str, str] = {}
+
+    def add_rows(self, rows: Iterable[dict[str, Any]]) -> None:
+        for row in rows:
+            self._entries[row["relation"]][row["citation"]].add(str(row["entry_id"]))
+            self._raw.setdefault(row["citation"], row.get("raw") or row["citation"])
+
+    def resolve(self, citation: str) -> set[str]:
+        """Entries whose own citation is citation."""
+        return set(self._entries[IS].get(normalize_citation(citation), ()))
+
+    def citing(self, citation: str) -> set[str]:
+        """Entries whose text cites citation."""
+        return set(self._entries[CITES].get(normalize_citation(citation), ()))
+
+    def edges(self) -> Iterator[tuple[str, str, str]]:
+        """(citing entry, cited entry, citation) for every citation that resolves to another entry."""
+        for citation, citing_ids in self._entries[CITES].items():
+            for cited_id in self._entries[IS].get(citation, ()):
+                for citing_id in citing_ids:
+                    if citing_id != cited_id:
+                        yield citing_id, cited_id, self._raw.get(citation, citation)
+
+    def __len__(self) -> int:
+        return sum(len(ids) for by_citation in self._entries.values() for ids in by_citation.values())
+
+
+def replace_entry_rows(supabase, entry_ids: list[str], rows: list[dict[str, Any]]) -> None:
+    """Replace the index rows of entry_ids with rows."""
+    for i in range(0, len(entry_ids), 200):
+        supabase.table(CITATION_INDEX_TABLE).delete().in_("entry_id", entry_ids[i:i + 200]).execute()
+    for i in range(0, len(rows), 500):
+        supabase.table(CITATION_INDEX_TABLE).insert(rows[i:i + 500]).execute()
+
+
+def resolve_citations(supabase, citations: Iterable[str], organization_id: str | None = None) -> dict[str, list[str]]:
+    """
+    Entry ids for each citation (keyed by the citation as given), in one query. With
+    organization_id, only that organization's entries and shared ones (no organization) match.
+    """
+    keys: dict[str, list[str]] = defaultdict(list)
+    for citation in citations:
+        if normalize_citation(citation):
+            keys[normalize_citation(citation)].append(citation)
+    resolved: dict[str, list[str]] = {}
+    if not keys or not CITATION_INDEX_TABLE:
+        return resolved
+    query = supabase.table(CITATION_INDEX_TABLE).select("citation, entry_id").eq("relation", IS).in_("citation", list(keys))
+    if organization_id:
+        query = query.or_(f"organization_id.is.null,organization_id.eq.{organization_id}")
+    for row in query.execute().data or []:
+        for citation in keys.get(row["citation"], ()):
+            resolved.setdefault(citation, []).append(str(row["entry_id"]))
+    return resolved
+
+
+def citing_entries(supabase, citation: str, organization_id: str | None = None) -> list[str]:
+    """Ids of entries whose text cites citation."""
+    key = normalize_citation(citation)
+    if not key or not CITATION_INDEX_TABLE:
+        return []
+    query = supabase.table(CITATION_INDEX_TABLE).select("entry_id").eq("relation", CITES).eq("citation", key)
+    if organization_id:
+        query = query.or_(f"organization_id.is.null,organization_id.eq.{organization_id}")
+    return [str(row["entry_id"]) for row in query.execute().data or []]
+
+
+def update_entry_index(
+    supabase,
+    entry_id: str,
+    organization_id: str | None,
+    own: dict[str, Any],
+    cited_cases: list[str],
+    cited_statutes: list[str],
+) -> list[tuple[str, str]]:
+    """
+    Replace one entry's index rows; return (cited entry id, citation) for the parsed citations
+    that resolve to other entries.
+    """
+    if not CITATION_INDEX_TABLE:
+        return []
+    rows = entry_index_rows(entry_id, organization_id, own, cited_cases, cited_statutes)
+    replace_entry_rows(supabase, [entry_id], rows)
+    resolved = resolve_citations(supabase, cited_cases + cited_statutes, organization_id)
+    return sorted({
+        (cited_id, citation)
+        for citation, cited_ids in resolved.items()
+        for cited_id in cited_ids
+        if cited_id != entry_id
+    })
+
+
+def scan_entries(supabase, page_size: int = 500) -> Iterator[list[dict]]:
+    """Pages of legal_knowledge_base rows with the columns the index is built from."""
+    start = 0
+    while True:
+        r = (
+            supabase.table("legal_knowledge_base")
+            .select("id, organization_id, case_citation, statute_number, cited_cases, cited_statutes")
+            .order("id")
+            .range(start, start + page_size - 1)
+            .execute()
+        )
+        rows = r.data or []
+        if rows:
+            yield rows
+        if len(rows) < page_size:
+            return
+        start += page_size
+
+
+def rebuild_index(supabase, write: bool = True, page_size: int = 500) -> CitationIndex:
+    """Regenerate every entry's index rows from legal_knowledge_base (page by page); return the index."""
+    index = CitationIndex()
+    entries = 0
+    for page in scan_entries(supabase, page_size):
+        rows = [
+            row
+            for entry in page
+            for row in entry_index_rows(
+                str(entry["id"]), entry.get("organization_id"), entry, entry.get("cited_cases"), entry.get("cited_statutes")
+            )
+        ]
+        index.add_rows(rows)
+        if write:
+            replace_entry_rows(supabase, [str(entry["id"]) for entry in page], rows)
+        entries += len(page)
+    logger.info("Citation index: %d entries, %d rows", entries, len(index))
+    return index
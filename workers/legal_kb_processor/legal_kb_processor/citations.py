@@ -1,47 +1,162 @@
 """
 Legal citation parsing using eyecite (pip-installed).
 Splits case citations and statute/law citations for cited_cases and cited_statutes.
+Long documents are parsed in overlapping chunks (split at paragraph breaks) across processes;
+each process builds its tokenizer once (hyperscan when installed), and a chunk that fails only
+loses its own citations.
 """
+import importlib.util
 import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from typing import Any, Iterable
 
 from eyecite import get_citations
 from eyecite.models import FullCaseCitation, FullLawCitation
+from eyecite.tokenizers import HyperscanTokenizer, default_tokenizer
+
+from .config import (
+    CITATION_CHUNK_CHARS,
+    CITATION_CHUNK_OVERLAP,
+    CITATION_TOKENIZER,
+    CITATION_WORKERS,
+    HYPERSCAN_CACHE_DIR,
+)
 
 logger = logging.getLogger(__name__)
 
+_citation_pool: ProcessPoolExecutor | None = None
 
-def parse_citations(plain_text: str) -> tuple[list[str], list[str]]:
+
+@lru_cache(maxsize=1)
+def _tokenizer() -> Any:
+    """This process's eyecite tokenizer, built (and for hyperscan, compiled) once."""
+    if CITATION_TOKENIZER in ("auto", "hyperscan") and importlib.util.find_spec("hyperscan") is not None:
+        tokenizer = HyperscanTokenizer(cache_dir=HYPERSCAN_CACHE_DIR)
+        try:
+            tokenizer.tokenize("1 U.S. 1")  # compiles the database, or loads it from the cache dir
+            return tokenizer
+        except Exception as e:
+            logger.warning("Hyperscan tokenizer unavailable (%s); using eyecite's default", e)
+    elif CITATION_TOKENIZER == "hyperscan":
+        logger.warning("hyperscan is not installed; using eyecite's default tokenizer")
+    return default_tokenizer
+
+
+def citation_chunks(
+    text: str,
+    chunk_chars: int = CITATION_CHUNK_CHARS,
+    overlap: int = CITATION_CHUNK_OVERLAP,
+) -> list[tuple[int, int, str]]:
     """
-    Parse legal citations from text using eyecite.
-    Returns (cited_cases, cited_statutes) as lists of citation strings.
-    Requires: pip install eyecite
+    Split text into (start, owned_end, chunk): chunks end at paragraph breaks where possible and
+    each overlaps the next by at least `overlap` chars. A chunk owns the citations starting before
+    owned_end (the next chunk's start), so one cut off at a chunk's end is taken, whole, from the next.
     """
+    if chunk_chars <= 0 or len(text) <= chunk_chars:
+        return [(0, len(text), text)]
+    overlap = max(0, min(overlap, chunk_chars // 2))
+    bounds: list[tuple[int, int]] = []
+    start = 0
+    while len(text) - start > chunk_chars:
+        limit = start + chunk_chars
+        cut = text.rfind("\n\n", start + overlap + 1, limit)
+        end = cut + 2 if cut != -1 else limit
+        bounds.append((start, end))
+        brk = text.rfind("\n\n", start + 1, end - overlap)
+        start = brk + 2 if brk != -1 else end - overlap
+    bounds.append((start, len(text)))
+    owned_ends = [s for s, _ in bounds[1:]] + [len(text)]
+    return [(s, owned_end, text[s:e]) for (s, e), owned_end in zip(bounds, owned_ends)]
+
+
+def _citation_start(citation: Any) -> int:
+    """Char offset of a citation in the parsed text (span(), or its token's start where span() is missing)."""
+    if hasattr(citation, "span"):
+        return citation.span()[0]
+    return citation.token.start
+
+
+def _citation_text(citation: Any) -> str:
+    """Normalized citation text; eyecite releases before corrected_citation() give the matched text."""
+    corrected = citation.corrected_citation() if hasattr(citation, "corrected_citation") else None
+    return corrected or citation.matched_text() or str(citation.token)
 
+
+def chunk_citations(start: int, owned_end: int, chunk: str) -> list[tuple[int, str, str]]:
+    """(offset in the document, "case" | "statute", citation) for the full citations a chunk owns."""
     try:
-        citations = get_citations(plain_text=plain_text)
+        citations = get_citations(plain_text=chunk, tokenizer=_tokenizer())
     except Exception as e:
-        logger.warning("eyecite get_citations failed: %s", e)
-        return [], []
-
-    cited_cases: list[str] = []
-    cited_statutes: list[str] = []
-    seen_case: set[str] = set()
-    seen_statute: set[str] = set()
+        logger.warning("eyecite get_citations failed on chars %d-%d: %s", start, start + len(chunk), e)
+        return []
 
+    found: list[tuple[int, str, str]] = []
     for c in citations:
+        if isinstance(c, FullCaseCitation):
+            kind = "case"
+        elif isinstance(c, FullLawCitation):
+            kind = "statute"
+        else:
+            continue
+        offset = start + _citation_start(c)
+        if offset >= owned_end:
+            continue
         try:
-            cite_str = c.corrected_citation() or c.matched_text() or str(getattr(c, "token", c))
-            if not cite_str or not cite_str.strip():
-                continue
-            if isinstance(c, FullCaseCitation):
-                if cite_str not in seen_case:
-                    seen_case.add(cite_str)
-                    cited_cases.append(cite_str)
-            elif isinstance(c, FullLawCitation):
-                if cite_str not in seen_statute:
-                    seen_statute.add(cite_str)
-                    cited_statutes.append(cite_str)
-        except Exception as e:
+            cite_str = _citation_text(c)
+        except (ValueError, TypeError, KeyError, IndexError) as e:
+            # A citation eyecite cannot render; API mismatches (AttributeError) are not swallowed
             logger.debug("Skipping citation: %s", e)
+            continue
+        if cite_str and cite_str.strip():
+            found.append((offset, kind, cite_str))
+    return found
+
 
+def collect_citations(results: Iterable[list[tuple[int, str, str]]]) -> tuple[list[str], list[str]]:
+    """Merge chunk results into (cited_cases, cited_statutes): document order, duplicates dropped."""
+    cited_cases: list[str] = []
+    cited_statutes: list[str] = []
+    seen: set[tuple[str, str]] = set()
+    for _, kind, cite_str in sorted(c for found in results for c in found):
+        if (kind, cite_str) in seen:
+            continue
+        seen.add((kind, cite_str))
+        (cited_cases if kind == "case" else cited_statutes).append(cite_str)
     return cited_cases, cited_statutes
+
+
+def _get_citation_pool() -> ProcessPoolExecutor:
+    """Process pool for chunked parsing; each child keeps its own tokenizer."""
+    global _citation_pool
+    if _citation_pool is None:
+        _citation_pool = ProcessPoolExecutor(
+            max_workers=CITATION_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _citation_pool
+
+
+def parse_citations(plain_text: str) -> tuple[list[str], list[str]]:
+    """
+    Parse legal citations from text using eyecite.
+    Returns (cited_cases, cited_statutes) as lists of citation strings.
+    Requires: pip install eyecite
+    """
+    global _citation_pool
+    chunks = citation_chunks(plain_text)
+    if len(chunks) == 1 or CITATION_WORKERS <= 1:
+        return collect_citations(chunk_citations(*chunk) for chunk in chunks)
+
+    futures = [_get_citation_pool().submit(chunk_citations, *chunk) for chunk in chunks]
+    results = []
+    for (start, _, chunk), future in zip(chunks, futures):
+        try:
+            results.append(future.result())
+        except Exception as e:
+            logger.warning("Citation chunk at chars %d-%d failed: %s", start, start + len(chunk), e)
+            if isinstance(e, BrokenProcessPool):
+                _citation_pool = None
+    return collect_citations(results)
@@ -0,0 +1,120 @@
+"""
+Process-wide event loop and pooled clients shared across jobs.
+One long-lived event loop runs in a daemon thread; sync code submits coroutines to it with
+run_sync instead of asyncio.run, so async clients (Graphiti/FalkorDB/Neo4j drivers, PageIndex)
+keep their connections on a loop that stays open. OpenAI and HTTP clients are built once per
+process and reuse their connection pools.
+"""
+import asyncio
+import atexit
+import logging
+import os
+import threading
+from typing import Any, Coroutine, TypeVar
+
+import httpx
+from openai import OpenAI
+
+from .config import BATCH_API_BASE_URL, DOWNLOAD_TIMEOUT, OPENAI_API_KEY
+from .rate_limiter import get_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_lock = threading.Lock()
+_loop: asyncio.AbstractEventLoop | None = None
+_loop_thread: threading.Thread | None = None
+_openai_client: OpenAI | None = None
+_batch_client: OpenAI | None = None
+_http_client: httpx.Client | None = None
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """Start (once) and return the worker's background event loop."""
+    global _loop, _loop_thread
+    with _lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            _loop_thread = threading.Thread(target=_loop.run_forever, name="legal-kb-event-loop", daemon=True)
+            _loop_thread.start()
+        return _loop
+
+
+def run_sync(coro: Coroutine[Any, Any, T], timeout: float | None = None) -> T:
+    """Run coro on the worker loop and block for its result (sync facade for existing callers)."""
+    loop = get_loop()
+    if threading.current_thread() is _loop_thread:
+        coro.close()
+        raise RuntimeError("run_sync called from the worker event loop thread; await the coroutine instead")
+    return asyncio.run_coroutine_threadsafe(coro, loop).result(timeout)
+
+
+def get_openai_client() -> OpenAI:
+    """Process-wide OpenAI client (thread-safe; one HTTP connection pool for all jobs)."""
+    global _openai_client
+    with _lock:
+        if _openai_client is None:
+            # With the shared rate limiter, 429s and transient errors are retried there (host-wide backoff);
+            # without one (off, or it failed to open) the SDK retries them
+            _openai_client = OpenAI(api_key=OPENAI_API_KEY, max_retries=0 if get_rate_limiter() is not None else 2)
+        return _openai_client
+
+
+def get_batch_client() -> OpenAI:
+    """OpenAI client for the Batch/Files APIs; LEGAL_KB_BATCH_BASE_URL points it at a stand-in endpoint."""
+    global _batch_client
+    with _lock:
+        if _batch_client is None:
+            _batch_client = OpenAI(api_key=OPENAI_API_KEY or "unused", base_url=BATCH_API_BASE_URL or None)
+        return _batch_client
+
+
+def get_http_client() -> httpx.Client:
+    """Process-wide HTTP client for Storage and callback requests."""
+    global _http_client
+    with _lock:
+        if _http_client is None:
+            _http_client = httpx.Client(timeout=DOWNLOAD_TIMEOUT, follow_redirects=True)
+        return _http_client
+
+
+def shutdown() -> None:
+    """Close pooled clients and stop the worker loop (registered with atexit)."""
+    global _loop, _openai_client, _batch_client, _http_client
+    from .graphiti_client import close_graphiti_client
+
+    if _loop is not None and not _loop.is_closed():
+        try:
+            run_sync(close_graphiti_client(), timeout=10)
+        except Exception as e:
+            logger.debug("Graphiti close failed: %s", e)
+        _loop.call_soon_threadsafe(_loop.stop)
+        if _loop_thread is not None:
+            _loop_thread.join(timeout=5)
+        _loop.close()
+        _loop = None
+    for client in (_openai_client, _batch_client, _http_client):
+        if client is not None:
+            try:
+                client.close()
+            except Exception:
+                pass
+    _openai_client = None
+    _batch_client = None
+    _http_client = None
+
+
+def _reset_after_fork() -> None:
+    """A forked child inherits the globals but not the loop thread or sockets; start fresh."""
+    global _lock, _loop, _loop_thread, _openai_client, _batch_client, _http_client
+    _lock = threading.Lock()
+    _loop = None
+    _loop_thread = None
+    _openai_client = None
+    _batch_client = None
+    _http_client = None
+
+
+atexit.register(shutdown)
+os.register_at_fork(after_in_child=_reset_after_fork)
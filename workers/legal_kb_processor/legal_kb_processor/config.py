@@ -1,5 +1,6 @@
 """Configuration from environment for the full Docling + PageIndex pipeline."""
 import os
+import tempfile
 from pathlib import Path
 
 # Supabase
@@ -9,6 +10,8 @@ SUPABASE_SERVICE_ROLE_KEY = os.environ.get("SUPABASE_SERVICE_ROLE_KEY", "").stri
 # Storage & pipeline
 LEGAL_KB_BUCKET = "legal-kb"
 PIPELINE_NAME = "docling_pageindex"
+CASE_DOC_PIPELINE = "docling_pageindex"
+CASE_DOC_BUCKET = "documents"
 
 # OpenAI (LLM metadata extraction, PageIndex summaries, embeddings)
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "").strip()
@@ -21,6 +24,22 @@ PAGEINDEX_ADD_NODE_SUMMARY = os.environ.get("PAGEINDEX_ADD_NODE_SUMMARY", "no").
 
 # LLM metadata extraction: max chars of markdown to send (to stay within context)
 MAX_MARKDOWN_FOR_EXTRACTION = int(os.environ.get("LEGAL_KB_MAX_MARKDOWN_EXTRACTION", "120000"))
+# single: one prompt (packed into the token budget below, or truncated at the max above); chunked:
+# per-section chunks extracted in parallel and merged; auto: single, except chunked above the chunk
+# threshold below (or the max chars when the threshold is 0)
+EXTRACTION_MODE = os.environ.get("LEGAL_KB_EXTRACTION_MODE", "auto").strip().lower()
+EXTRACTION_CHUNK_CHARS = int(os.environ.get("LEGAL_KB_EXTRACTION_CHUNK_CHARS", "24000"))
+EXTRACTION_CONCURRENCY = int(os.environ.get("LEGAL_KB_EXTRACTION_CONCURRENCY", "4"))
+# auto mode: documents over this many tokens are chunked rather than packed (~120k chars, where auto
+# always switched to chunks); chunking sends the whole document, so it costs more prompt tokens
+EXTRACTION_CHUNK_THRESHOLD = int(os.environ.get("LEGAL_KB_EXTRACTION_CHUNK_THRESHOLD", "30000"))
+# Single-prompt extraction: token budget for the document context; the highest-value sections (caption,
+# headnote, holding, orders) are packed first (auto mode chunks documents over the chunk threshold instead).
+# 0 = plain truncation at LEGAL_KB_MAX_MARKDOWN_EXTRACTION chars
+EXTRACTION_TOKEN_BUDGET = int(os.environ.get("LEGAL_KB_EXTRACTION_TOKEN_BUDGET", "16000"))
+# Structured outputs (strict json_schema from EXTRACTION_SCHEMA); falls back to plain JSON prompting
+# automatically if the model rejects response_format
+EXTRACTION_STRUCTURED_OUTPUT = os.environ.get("LEGAL_KB_EXTRACTION_STRUCTURED_OUTPUT", "yes").strip().lower() == "yes"
 
 # Optional: vector fallback (pgvector quick lookups, not primary retrieval)
 ENABLE_VECTOR_FALLBACK = os.environ.get("LEGAL_KB_ENABLE_VECTOR_FALLBACK", "no").strip().lower() == "yes"
@@ -43,6 +62,144 @@ PAGEINDEX_ROOT = REPO_ROOT / "pageIndex" / "PageIndex"
 # Logging
 LOG_LEVEL = os.environ.get("LEGAL_KB_LOG_LEVEL", "INFO").strip().upper()
 
+# Docling: one converter per worker process, reused across documents
+DOCLING_PRELOAD = os.environ.get("LEGAL_KB_DOCLING_PRELOAD", "no").strip().lower() == "yes"
+DOCLING_DO_OCR = os.environ.get("LEGAL_KB_DOCLING_DO_OCR", "yes").strip().lower() == "yes"
+DOCLING_DO_TABLE_STRUCTURE = os.environ.get("LEGAL_KB_DOCLING_DO_TABLE_STRUCTURE", "yes").strip().lower() == "yes"
+DOCLING_TABLE_MODE = os.environ.get("LEGAL_KB_DOCLING_TABLE_MODE", "accurate").strip().lower()
+DOCLING_NUM_THREADS = int(os.environ.get("LEGAL_KB_DOCLING_NUM_THREADS", "0"))  # 0 = Docling default
+# Large PDFs: convert page ranges in parallel processes and merge (0 threshold disables). The workers are
+# divided among --concurrency processes; --pipelined does not split (its pool converts documents in parallel)
+DOCLING_SPLIT_THRESHOLD_PAGES = int(os.environ.get("LEGAL_KB_DOCLING_SPLIT_THRESHOLD_PAGES", "200"))
+DOCLING_SPLIT_WORKERS = int(os.environ.get("LEGAL_KB_DOCLING_SPLIT_WORKERS", "4"))
+
+# Citations (eyecite): text longer than this is split at paragraph breaks into chunks that overlap by
+# CITATION_CHUNK_OVERLAP chars and are parsed in parallel processes (0 = one pass)
+CITATION_CHUNK_CHARS = int(os.environ.get("LEGAL_KB_CITATION_CHUNK_CHARS", "200000"))
+CITATION_CHUNK_OVERLAP = int(os.environ.get("LEGAL_KB_CITATION_CHUNK_OVERLAP", "2000"))
+CITATION_WORKERS = int(os.environ.get("LEGAL_KB_CITATION_WORKERS", "4"))
+# auto: hyperscan when installed (precompiled once, cached on disk), else eyecite's default tokenizer
+CITATION_TOKENIZER = os.environ.get("LEGAL_KB_CITATION_TOKENIZER", "auto").strip().lower()
+HYPERSCAN_CACHE_DIR = os.environ.get(
+    "LEGAL_KB_HYPERSCAN_CACHE_DIR", str(Path(tempfile.gettempdir()) / "legal_kb_hyperscan")
+)
+
+# Normalized citation -> entry index table (resolution and citing-entry lookups), e.g.
+# legal_kb_citation_index. Off (empty) by default: create the table first (README)
+CITATION_INDEX_TABLE = os.environ.get("LEGAL_KB_CITATION_INDEX_TABLE", "").strip()
+
+# Artifact store: these row columns (docling_json, docling_markdown, pageindex_tree) are written as
+# compressed, content-addressed blobs in ARTIFACT_BUCKET, the column keeping a reference. Off by default:
+# only set it once everything reading those columns goes through artifacts.load_artifact
+ARTIFACT_FIELDS = tuple(
+    f.strip() for f in os.environ.get("LEGAL_KB_ARTIFACT_FIELDS", "").split(",") if f.strip()
+)
+ARTIFACT_BUCKET = os.environ.get("LEGAL_KB_ARTIFACT_BUCKET", "legal-kb-artifacts").strip()
+# zstd level (artifacts are gzip-compressed when zstandard is not installed)
+ARTIFACT_ZSTD_LEVEL = int(os.environ.get("LEGAL_KB_ARTIFACT_ZSTD_LEVEL", "10"))
+
+# Content-addressed result cache (sha256 of file bytes + stage version)
+ENABLE_RESULT_CACHE = os.environ.get("LEGAL_KB_RESULT_CACHE", "yes").strip().lower() == "yes"
+RESULT_CACHE_DIR = os.environ.get(
+    "LEGAL_KB_RESULT_CACHE_DIR", str(Path(tempfile.gettempdir()) / "legal_kb_result_cache")
+).strip()
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("LEGAL_KB_RESULT_CACHE_MAX_MB", "2048")) * 1024 * 1024
+# Optional shared store across replicas: table (cache_key text primary key, stage text, value jsonb)
+RESULT_CACHE_SHARED_TABLE = os.environ.get("LEGAL_KB_RESULT_CACHE_SHARED_TABLE", "").strip()
+
+# Storage downloads: stream in chunks to the temp file (bounded memory), resuming on dropped connections
+STREAM_DOWNLOADS = os.environ.get("LEGAL_KB_STREAM_DOWNLOADS", "yes").strip().lower() == "yes"
+DOWNLOAD_CHUNK_BYTES = int(os.environ.get("LEGAL_KB_DOWNLOAD_CHUNK_KB", "1024")) * 1024
+DOWNLOAD_MAX_RESUMES = int(os.environ.get("LEGAL_KB_DOWNLOAD_MAX_RESUMES", "3"))
+DOWNLOAD_TIMEOUT = float(os.environ.get("LEGAL_KB_DOWNLOAD_TIMEOUT", "60"))
+
 # Retries
 DOCLING_MAX_RETRIES = int(os.environ.get("LEGAL_KB_DOCLING_MAX_RETRIES", "2"))
 LLM_MAX_RETRIES = int(os.environ.get("LEGAL_KB_LLM_MAX_RETRIES", "3"))
+
+# Job claiming / concurrency
+WORKER_CONCURRENCY = int(os.environ.get("LEGAL_KB_WORKER_CONCURRENCY", "1"))
+# Pipelined engine: max jobs claimed per round trip (never more than the download queue has room for);
+# the sequential worker claims one job at a time so queued work stays available to other workers
+CLAIM_BATCH_SIZE = int(os.environ.get("LEGAL_KB_CLAIM_BATCH_SIZE", "5"))
+# Idle polling: exponential backoff from min interval up to --interval when both queues are empty
+POLL_MIN_INTERVAL = float(os.environ.get("LEGAL_KB_POLL_MIN_INTERVAL", "1"))
+
+# Write Docling output to the row as soon as it exists (status docling_complete) so a failed job
+# keeps it; otherwise it is sent once, with the final update
+DOCLING_CHECKPOINT = os.environ.get("LEGAL_KB_DOCLING_CHECKPOINT", "no").strip().lower() == "yes"
+# Record every stage's output with its version in processing_checkpoints as it completes, so a
+# requeued job resumes from the last completed stage. Off by default: needs the processing_checkpoints
+# column on legal_knowledge_base and documents (README)
+STAGE_CHECKPOINTS = os.environ.get("LEGAL_KB_STAGE_CHECKPOINTS", "no").strip().lower() == "yes"
+# Bulk mode: KB jobs stop after Docling (entry left docling_complete) for scripts.batch_extract, which
+# applies the extraction and requeues the job; needs STAGE_CHECKPOINTS so the requeued job resumes
+DEFER_EXTRACTION = os.environ.get("LEGAL_KB_DEFER_EXTRACTION", "no").strip().lower() == "yes"
+# Pipelined engine: how often coalesced job status updates are flushed (seconds)
+STATUS_FLUSH_INTERVAL = float(os.environ.get("LEGAL_KB_STATUS_FLUSH_INTERVAL", "2"))
+
+# Threads for one job's post-Docling stages (tree, extraction, eyecite, embedding, Graphiti overlap)
+ENRICH_WORKERS = int(os.environ.get("LEGAL_KB_ENRICH_WORKERS", "4"))
+
+# Pipelined engine (--pipelined): bound of each inter-stage queue
+PIPELINE_QUEUE_SIZE = int(os.environ.get("LEGAL_KB_PIPELINE_QUEUE_SIZE", "4"))
+
+# Persistent LLM response cache (SQLite, keyed on model + temperature + prompt hash), shared by the
+# worker processes on a host: re-running a job re-uses extraction and PageIndex summary responses
+ENABLE_LLM_CACHE = os.environ.get("LEGAL_KB_LLM_CACHE", "yes").strip().lower() == "yes"
+LLM_CACHE_PATH = os.environ.get(
+    "LEGAL_KB_LLM_CACHE_PATH", str(Path(tempfile.gettempdir()) / "legal_kb_llm_cache.sqlite3")
+).strip()
+LLM_CACHE_MAX_BYTES = int(os.environ.get("LEGAL_KB_LLM_CACHE_MAX_MB", "512")) * 1024 * 1024
+LLM_CACHE_MAX_AGE = float(os.environ.get("LEGAL_KB_LLM_CACHE_MAX_AGE_DAYS", "30")) * 86400
+
+# Lexical prefilter: SQLite FTS5 (BM25) index over PageIndex node titles/summaries and each entry's
+# keywords and legal principles, per organization; every job updates its entry (shortlists entries
+# for LLM tree search). Off by default: the file is local to one host, so it only serves a search running
+# on the same host as every worker
+ENABLE_PREFILTER_INDEX = os.environ.get("LEGAL_KB_PREFILTER_INDEX", "no").strip().lower() == "yes"
+PREFILTER_INDEX_PATH = os.environ.get(
+    "LEGAL_KB_PREFILTER_INDEX_PATH", str(Path(tempfile.gettempdir()) / "legal_kb_prefilter.sqlite3")
+).strip()
+
+# Bulk extraction (scripts/batch_extract.py) through the OpenAI Batch API. Base URL may point at a
+# local stand-in endpoint; empty uses the OpenAI default
+BATCH_API_BASE_URL = os.environ.get("LEGAL_KB_BATCH_BASE_URL", "").strip()
+BATCH_COMPLETION_WINDOW = os.environ.get("LEGAL_KB_BATCH_COMPLETION_WINDOW", "24h").strip()
+BATCH_POLL_INTERVAL = float(os.environ.get("LEGAL_KB_BATCH_POLL_INTERVAL", "60"))
+# Per-batch limits (OpenAI: 50,000 requests and 200 MB input file)
+BATCH_MAX_REQUESTS = int(os.environ.get("LEGAL_KB_BATCH_MAX_REQUESTS", "50000"))
+BATCH_MAX_BYTES = int(os.environ.get("LEGAL_KB_BATCH_MAX_MB", "190")) * 1024 * 1024
+
+# Section-level embeddings (with vector fallback): one vector per markdown section / PageIndex node,
+# stored in a chunk table (entry_id, chunk_index, node_id, title, line_num, content, content_hash, embedding).
+# Off by default: jobs fail until the chunk table exists (README)
+EMBED_SECTIONS = os.environ.get("LEGAL_KB_EMBED_SECTIONS", "no").strip().lower() == "yes"
+EMBEDDING_CHUNK_TABLE = os.environ.get("LEGAL_KB_EMBEDDING_CHUNK_TABLE", "legal_kb_chunks").strip()
+EMBEDDING_CHUNK_CHARS = int(os.environ.get("LEGAL_KB_EMBEDDING_CHUNK_CHARS", "6000"))
+# Inputs per embeddings request, and a char budget per request (the API caps tokens per request)
+EMBEDDING_BATCH_SIZE = int(os.environ.get("LEGAL_KB_EMBEDDING_BATCH_SIZE", "256"))
+EMBEDDING_BATCH_MAX_CHARS = int(os.environ.get("LEGAL_KB_EMBEDDING_BATCH_MAX_CHARS", "400000"))
+
+# Host-wide OpenAI rate limiting: token bucket per model in SQLite, shared by worker processes.
+# LEGAL_KB_RATE_LIMITS overrides per model, e.g. "gpt-4o-mini=500:200000,text-embedding-3-small=3000:1000000"
+ENABLE_RATE_LIMITER = os.environ.get("LEGAL_KB_RATE_LIMITER", "yes").strip().lower() == "yes"
+RATE_LIMIT_PATH = os.environ.get(
+    "LEGAL_KB_RATE_LIMIT_PATH", str(Path(tempfile.gettempdir()) / "legal_kb_rate_limits.sqlite3")
+).strip()
+RATE_LIMIT_DEFAULT_RPM = int(os.environ.get("LEGAL_KB_RATE_LIMIT_RPM", "500"))
+RATE_LIMIT_DEFAULT_TPM = int(os.environ.get("LEGAL_KB_RATE_LIMIT_TPM", "200000"))
+
+
+def _parse_rate_limits(value: str) -> dict[str, tuple[int, int]]:
+    limits = {}
+    for item in value.split(","):
+        model, _, rpm_tpm = item.partition("=")
+        rpm, _, tpm = rpm_tpm.partition(":")
+        if model.strip() and rpm.strip() and tpm.strip():
+            limits[model.strip()] = (int(rpm), int(tpm))
+    return limits
+
+
+RATE_LIMITS = _parse_rate_limits(os.environ.get("LEGAL_KB_RATE_LIMITS", ""))
+RATE_LIMIT_MAX_429_RETRIES = int(os.environ.get("LEGAL_KB_RATE_LIMIT_MAX_RETRIES", "6"))
@@ -0,0 +1,134 @@
+"""
+Token-budgeted context for extraction prompts.
+Sections come from the markdown headings, which are Docling's title/section headers and the
+boundaries PageIndex builds its nodes from. They are ranked by how much they say about the
+metadata we extract (caption, headnote, holding, orders) and packed, highest value first, up
+to a token budget. Output keeps document order, and a one-line marker lists the titles of each
+omitted run, so the model still sees the outline. Tokens are counted with tiktoken when it is
+installed (PageIndex depends on it), otherwise approximated as chars / 4.
+"""
+import logging
+import re
+from functools import lru_cache
+from typing import Any
+
+from .config import LLM_MODEL
+from .sections import Section, split_sections
+
+logger = logging.getLogger(__name__)
+
+_CHARS_PER_TOKEN = 4
+# Sections this valuable are cut to fit the remaining budget instead of being dropped
+_TRUNCATE_MIN_SCORE = 70
+_MIN_PIECE_TOKENS = 200
+_MARKER_TITLES = 5
+
+# Caption: parties and court, matched on the heading and the start of the section body
+_CAPTION_RE = re.compile(
+    r"\b(v\.?|vs\.?|versus)\s|\bin the (supreme|high|court|tribunal)|\b(petition|appeal|case|cause|suit)\s+no\b", re.I
+)
+_CAPTION_SCORE = 100
+# (score, pattern on the heading), best match wins
+_SECTION_RANKS = (
+    (90, re.compile(r"\b(headnote|catchwords|synopsis|abstract|summary|held)\b", re.I)),
+    (85, re.compile(r"\b(orders?|disposition|relief|final orders|costs)\b", re.I)),
+    (80, re.compile(r"\b(holding|ruling|judg(e)?ment|decision|determination|analysis|findings|conclusions?|issues? for determination)\b", re.I)),
+    (70, re.compile(r"\b(short title|interpretation|commencement|application|purpose|arrangement of sections)\b", re.I)),
+)
+_DEFAULT_SCORE = 10
+
+
+@lru_cache(maxsize=1)
+def _encoding() -> Any:
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(LLM_MODEL)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        logger.warning("tiktoken unavailable (%s); approximating token counts", e)
+        return None
+
+
+def tokenizer_name() -> str:
+    enc = _encoding()
+    return enc.name if enc is not None else f"chars/{_CHARS_PER_TOKEN}"
+
+
+def count_tokens(text: str) -> int:
+    enc = _encoding()
+    if enc is None:
+        return (len(text) + _CHARS_PER_TOKEN - 1) // _CHARS_PER_TOKEN
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    enc = _encoding()
+    if enc is None:
+        return text[:max_tokens * _CHARS_PER_TOKEN]
+    tokens = enc.encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else enc.decode(tokens[:max_tokens])
+
+
+def section_score(section: Section, text: str, index: int, total: int) -> int:
+    """Rank a section: caption and headnote first, then orders and holdings; opening and closing sections get a bonus."""
+    if _CAPTION_RE.search(f"{section.title}\n{text[:300]}"):
+        score = _CAPTION_SCORE
+    else:
+        score = next((rank for rank, pattern in _SECTION_RANKS if pattern.search(section.title)), _DEFAULT_SCORE)
+    if index < 2:
+        score += 40  # caption / parties / coram
+    elif index >= total - 2:
+        score += 30  # final orders usually close the judgment
+    if section.level == 1:
+        score += 10  # Docling "title"
+    return score
+
+
+def _marker(sections: list[Section]) -> str:
+    titles = [s.title for s in sections if s.title]
+    shown = "; ".join(titles[:_MARKER_TITLES])
+    more = f" (+{len(titles) - _MARKER_TITLES} more)" if len(titles) > _MARKER_TITLES else ""
+    return f"[... {len(sections)} section(s) omitted{': ' + shown if shown else ''}{more} ...]"
+
+
+def pack_context(markdown: str, budget_tokens: int) -> str:
+    """
+    Highest-ranked sections of markdown that fit in budget_tokens, in document order; omitted
+    runs are replaced by a marker naming their headings. Markdown within budget is returned as is.
+    """
+    if count_tokens(markdown) <= budget_tokens:
+        return markdown
+    sections = [s for s in split_sections(markdown) if markdown[s.start:s.end].strip()]
+    texts = [markdown[s.start:s.end].strip() for s in sections]
+    costs = [count_tokens(t) for t in texts]
+    scores = [section_score(s, t, i, len(sections)) for i, (s, t) in enumerate(zip(sections, texts))]
+    order = sorted(range(len(sections)), key=lambda i: (-scores[i], i))
+    # Reserve room for omission markers (one per gap at most)
+    remaining = budget_tokens - min(budget_tokens // 10, 40 * (len(sections) // 2 + 1))
+    chosen: dict[int, str] = {}
+    for i in order:
+        if costs[i] <= remaining:
+            chosen[i] = texts[i]
+            remaining -= costs[i]
+        elif remaining >= _MIN_PIECE_TOKENS and (scores[i] >= _TRUNCATE_MIN_SCORE or not chosen):
+            chosen[i] = truncate_to_tokens(texts[i], remaining) + "\n[... section truncated ...]"
+            remaining = 0
+
+    parts: list[str] = []
+    gap: list[Section] = []
+    for i, section in enumerate(sections):
+        if i in chosen:
+            if gap:
+                parts.append(_marker(gap))
+                gap = []
+            parts.append(chosen[i])
+        else:
+            gap.append(section)
+    if gap:
+        parts.append(_marker(gap))
+    return "\n\n".join(parts)
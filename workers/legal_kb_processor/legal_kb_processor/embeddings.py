@@ -1,37 +1,74 @@
 """
 Optional embedding generation for pgvector (quick lookups only; primary retrieval is PageIndex).
+Inputs are deduplicated and sent many per request on the process-wide OpenAI client.
 """
 import logging
-from typing import Any
 
-from openai import OpenAI
-
-from .config import EMBEDDING_DIM, EMBEDDING_MODEL, OPENAI_API_KEY
+from .clients import get_openai_client
+from .config import (
+    EMBEDDING_BATCH_MAX_CHARS,
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_DIM,
+    EMBEDDING_MODEL,
+    OPENAI_API_KEY,
+)
+from .context import count_tokens
+from .rate_limiter import rate_limited_call
 
 logger = logging.getLogger(__name__)
 
 
+def _request_groups(texts: list[str]) -> list[list[str]]:
+    """Split texts into request-sized groups (EMBEDDING_BATCH_SIZE inputs, EMBEDDING_BATCH_MAX_CHARS chars)."""
+    groups: list[list[str]] = []
+    group: list[str] = []
+    chars = 0
+    for text in texts:
+        if group and (len(group) >= EMBEDDING_BATCH_SIZE or chars + len(text) > EMBEDDING_BATCH_MAX_CHARS):
+            groups.append(group)
+            group, chars = [], 0
+        group.append(text)
+        chars += len(text)
+    if group:
+        groups.append(group)
+    return groups
+
+
+def generate_embeddings(texts: list[str], max_chars: int = 8000) -> list[list[float] | None]:
+    """
+    Embedding vectors for texts (each truncated to max_chars), in input order. Identical texts
+    are embedded once; a failed request leaves None for its inputs rather than failing the rest.
+    """
+    if not OPENAI_API_KEY:
+        return [None] * len(texts)
+    prepared = [(t or "")[:max_chars].strip() for t in texts]
+    unique = list(dict.fromkeys(t for t in prepared if t))
+    vectors: dict[str, list[float]] = {}
+    client = get_openai_client()
+    for group in _request_groups(unique):
+        try:
+            r = rate_limited_call(
+                EMBEDDING_MODEL,
+                sum(count_tokens(t) for t in group),
+                lambda: client.embeddings.create(model=EMBEDDING_MODEL, input=group, dimensions=EMBEDDING_DIM),
+                usage_tokens=lambda r: r.usage.total_tokens,
+            )
+        except Exception as e:
+            logger.warning("Embedding request for %d inputs failed: %s", len(group), e)
+            continue
+        for item in r.data:
+            vec = item.embedding
+            if len(vec) != EMBEDDING_DIM:
+                logger.warning("Embedding dimension %s != %s", len(vec), EMBEDDING_DIM)
+            vectors[group[item.index]] = vec
+    return [vectors.get(t) if t else None for t in prepared]
+
+
 def generate_embedding(text: str, max_chars: int = 8000) -> list[float] | None:
     """
     Generate a single embedding vector for text (truncated to max_chars).
     Returns None if API key missing or error; dimension must match EMBEDDING_DIM (1536).
     """
-    if not OPENAI_API_KEY or not text:
-        return None
-    truncated = text[:max_chars].strip()
-    if not truncated:
-        return None
-    try:
-        client = OpenAI(api_key=OPENAI_API_KEY)
-        r = client.embeddings.create(
-            model=EMBEDDING_MODEL,
-            input=truncated,
-            dimensions=EMBEDDING_DIM,
-        )
-        vec = r.data[0].embedding
-        if len(vec) != EMBEDDING_DIM:
-            logger.warning("Embedding dimension %s != %s", len(vec), EMBEDDING_DIM)
-        return vec
-    except Exception as e:
-        logger.warning("Embedding generation failed: %s", e)
+    if not text:
         return None
+    return generate_embeddings([text], max_chars=max_chars)[0]
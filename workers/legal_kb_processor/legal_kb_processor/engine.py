@@ -0,0 +1,410 @@
+"""
+Stage-pipelined ingestion engine.
+Jobs flow download -> convert -> enrich -> write through bounded asyncio queues, so
+document N+1 converts while document N waits on the LLM. CPU-bound stages (Docling,
+eyecite) run in a process pool; I/O-bound stages (Supabase, OpenAI, Graphiti) run as
+asyncio tasks on worker threads. Queue bounds give backpressure: the feeder only
+claims new jobs when the download stage has room.
+"""
+import asyncio
+import logging
+import multiprocessing
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+
+from .checkpoints import StageCheckpoints, load_checkpoints, needs_stage, run_stage
+from .citations import chunk_citations, citation_chunks, collect_citations
+from .config import (
+    CASE_DOC_BUCKET,
+    DOCLING_CHECKPOINT,
+    DOCLING_MAX_RETRIES,
+    LEGAL_KB_BUCKET,
+    LOG_LEVEL,
+    STAGE_CHECKPOINTS,
+    STATUS_FLUSH_INTERVAL,
+)
+from .jobs import (
+    CASE_DOC_JOBS_TABLE,
+    KB_JOBS_TABLE,
+    ROW_TABLES,
+    StatusWriter,
+    poll_case_doc_jobs,
+    poll_jobs,
+)
+from .pipeline import limit_split_workers, warm_up_converter
+from .stages import (
+    add_entry_episode,
+    build_entry_update,
+    build_tree_async,
+    convert_document,
+    embed_entry,
+    embed_sections,
+    enrich_case_document,
+    extract_metadata,
+    fetch_document,
+    finish_row,
+    get_existing_entry,
+    index_entry_citations,
+    index_entry_nodes,
+    save_docling_checkpoint,
+    save_section_chunks,
+)
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+@dataclass
+class WorkItem:
+    """One claimed job moving through the stages; kind is 'kb' or 'case_document'."""
+
+    kind: str
+    job: dict
+    target_id: str
+    file_path: str | None = None
+    content_hash: str | None = None
+    markdown_text: str = ""
+    docling_json: Any = None
+    update_payload: dict = field(default_factory=dict)
+    checkpoints: StageCheckpoints | None = None
+
+    @property
+    def jobs_table(self) -> str:
+        return KB_JOBS_TABLE if self.kind == "kb" else CASE_DOC_JOBS_TABLE
+
+
+def _init_process(preload_docling: bool) -> None:
+    """Process-pool initializer: spawned children need their own logging config (and optionally warm Docling)."""
+    logging.basicConfig(
+        level=getattr(logging, LOG_LEVEL, logging.INFO),
+        format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
+        stream=sys.stderr,
+    )
+    # The pool already converts documents in parallel; a split pool per child would multiply Docling models
+    limit_split_workers(1)
+    if preload_docling:
+        warm_up_converter()
+
+
+class PipelinedEngine:
+    """
+    Runs claimed jobs through download/convert/enrich/write stages concurrently.
+    cpu_workers sizes the process pool (and the convert stage); io_workers is the number
+    of in-flight items per I/O stage; queue_size bounds each inter-stage queue.
+    """
+
+    def __init__(
+        self,
+        supabase,
+        cpu_workers: int,
+        io_workers: int,
+        queue_size: int,
+        batch_size: int,
+        preload_docling: bool = False,
+    ):
+        self.supabase = supabase
+        self.writer = StatusWriter(supabase)
+        self.preload_docling = preload_docling
+        self.cpu_workers = max(1, cpu_workers)
+        self.io_workers = max(1, io_workers)
+        self.queue_size = max(1, queue_size)
+        self.batch_size = max(1, batch_size)
+        self._pool: ProcessPoolExecutor | None = None
+
+    async def run(self, once: bool, drain: bool, interval: float, min_interval: float) -> None:
+        # spawn: the parent already runs threads (asyncio.to_thread, HTTP clients), which fork does not copy safely
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.cpu_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_process,
+            initargs=(self.preload_docling,),
+        )
+        q_download: asyncio.Queue = asyncio.Queue(self.queue_size)
+        q_convert: asyncio.Queue = asyncio.Queue(self.queue_size)
+        q_enrich: asyncio.Queue = asyncio.Queue(self.queue_size)
+        q_write: asyncio.Queue = asyncio.Queue(self.queue_size)
+        flusher = asyncio.ensure_future(self._flush_statuses())
+        try:
+            await asyncio.gather(
+                self._feed(q_download, once, drain, interval, min_interval),
+                self._stage("download", self._download, q_download, q_convert, self.io_workers),
+                self._stage("convert", self._convert, q_convert, q_enrich, self.cpu_workers),
+                self._stage("enrich", self._enrich, q_enrich, q_write, self.io_workers),
+                self._stage("write", self._write, q_write, None, self.io_workers),
+            )
+        finally:
+            flusher.cancel()
+            await asyncio.gather(flusher, return_exceptions=True)
+            await asyncio.to_thread(self.writer.flush)
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    async def _flush_statuses(self) -> None:
+        """Write coalesced job status transitions every STATUS_FLUSH_INTERVAL seconds."""
+        while True:
+            await asyncio.sleep(STATUS_FLUSH_INTERVAL)
+            if self.writer.pending():
+                await asyncio.to_thread(self.writer.flush)
+
+    async def _feed(self, out_q: asyncio.Queue, once: bool, drain: bool, interval: float, min_interval: float) -> None:
+        """
+        Claim jobs while the download queue has room; back off when both queues are empty or a
+        poll fails (the failed poll is logged and retried).
+        """
+        delay = min_interval
+        try:
+            while True:
+                # --once runs a single job
+                limit = 1 if once else min(self.batch_size, max(1, self.queue_size - out_q.qsize()))
+                try:
+                    jobs = await asyncio.to_thread(poll_jobs, self.supabase, limit)
+                    items = [WorkItem("kb", job, job["entry_id"]) for job in jobs]
+                    if not items:
+                        cjobs = await asyncio.to_thread(poll_case_doc_jobs, self.supabase, limit)
+                        items = [WorkItem("case_document", job, job["document_id"]) for job in cjobs]
+                except Exception as e:
+                    # A transient Supabase error must not tear down the pool under jobs still in flight
+                    logger.exception("Polling failed: %s", e)
+                    if once:
+                        return
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, interval)
+                    continue
+                if items:
+                    delay = min_interval
+                    for item in items:
+                        await out_q.put(item)
+                    if once:
+                        return
+                    continue
+                if once or drain:
+                    logger.info("Queues drained; waiting for in-flight jobs")
+                    return
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, interval)
+        finally:
+            await out_q.put(_DONE)
+
+    async def _stage(
+        self,
+        name: str,
+        fn: Callable[[WorkItem], Awaitable[None]],
+        in_q: asyncio.Queue,
+        out_q: asyncio.Queue | None,
+        workers: int,
+    ) -> None:
+        """Run fn over items from in_q with `workers` concurrent tasks; forward successes to out_q."""
+
+        async def worker() -> None:
+            while True:
+                item = await in_q.get()
+                if item is _DONE:
+                    # Let sibling workers see the sentinel too
+                    await in_q.put(_DONE)
+                    return
+                try:
+                    await fn(item)
+                except Exception as e:
+                    await self._fail(item, name, e)
+                    continue
+                if out_q is not None:
+                    await out_q.put(item)
+
+        await asyncio.gather(*(worker() for _ in range(workers)))
+        if out_q is not None:
+            await out_q.put(_DONE)
+
+    async def _download(self, item: WorkItem) -> None:
+        default_bucket = LEGAL_KB_BUCKET if item.kind == "kb" else CASE_DOC_BUCKET
+        bucket = item.job.get("storage_bucket") or default_bucket
+        item.file_path, item.content_hash = await asyncio.to_thread(
+            fetch_document, self.supabase, bucket, item.job["storage_path"]
+        )
+        if STAGE_CHECKPOINTS:
+            item.checkpoints = await asyncio.to_thread(
+                load_checkpoints, self.supabase, ROW_TABLES[item.jobs_table], item.target_id, item.content_hash
+            )
+
+    async def _convert(self, item: WorkItem) -> None:
+        if not needs_stage(item.checkpoints, "docling"):
+            self._cleanup(item)
+            item.markdown_text, item.docling_json = item.checkpoints.restore("docling")
+            return
+        loop = asyncio.get_running_loop()
+        max_retries = DOCLING_MAX_RETRIES if item.kind == "kb" else 0
+        try:
+            item.markdown_text, item.docling_json = await loop.run_in_executor(
+                self._pool, convert_document, item.file_path, max_retries, item.content_hash
+            )
+        finally:
+            self._cleanup(item)
+        if item.checkpoints is not None:
+            await asyncio.to_thread(item.checkpoints.record, "docling", (item.markdown_text, item.docling_json))
+        elif DOCLING_CHECKPOINT:
+            await asyncio.to_thread(
+                save_docling_checkpoint,
+                self.supabase,
+                ROW_TABLES[item.jobs_table],
+                item.target_id,
+                item.markdown_text,
+                item.docling_json,
+            )
+
+    async def _enrich(self, item: WorkItem) -> None:
+        if item.kind == "case_document":
+            item.update_payload = await asyncio.to_thread(
+                enrich_case_document,
+                item.job,
+                item.target_id,
+                item.markdown_text,
+                item.content_hash,
+                item.checkpoints,
+                item.docling_json,
+            )
+            return
+
+        # Same dependency graph (and checkpoints) as stages.enrich_entry, with eyecite in the process pool
+        loop = asyncio.get_running_loop()
+        checkpoints = item.checkpoints
+
+        async def citations_stage() -> tuple[list[str], list[str]]:
+            if not needs_stage(checkpoints, "citations"):
+                return checkpoints.restore("citations")
+            # Chunks go straight to the engine's process pool (no nested pool per document)
+            chunks = citation_chunks(item.markdown_text)
+            results = await asyncio.gather(
+                *(loop.run_in_executor(self._pool, chunk_citations, *chunk) for chunk in chunks),
+                return_exceptions=True,
+            )
+            for (start, _, chunk), result in zip(chunks, results):
+                if isinstance(result, BaseException):
+                    logger.warning("Citation chunk at chars %d-%d failed: %s", start, start + len(chunk), result)
+            citations = collect_citations(r for r in results if not isinstance(r, BaseException))
+            if checkpoints is not None:
+                await asyncio.to_thread(checkpoints.record, "citations", citations)
+            return citations
+
+        async def tree_stage() -> tuple[dict, dict]:
+            if not needs_stage(checkpoints, "tree"):
+                return checkpoints.restore("tree")
+            # PageIndex runs on this loop (its node summaries are awaited alongside the other stages)
+            tree = await build_tree_async(item.markdown_text, item.content_hash, item.docling_json)
+            if checkpoints is not None:
+                await asyncio.to_thread(checkpoints.record, "tree", tree)
+            return tree
+
+        tree_task = asyncio.ensure_future(tree_stage())
+        citations_task = asyncio.ensure_future(citations_stage())
+        tasks = [tree_task, citations_task]
+        if needs_stage(checkpoints, "sections"):
+            sections_task = asyncio.ensure_future(asyncio.to_thread(embed_sections, item.markdown_text))
+            tasks.append(sections_task)
+        try:
+            existing = await asyncio.to_thread(get_existing_entry, self.supabase, item.target_id) or {}
+            existing.update(item.job.get("payload") or {})
+            extracted = await asyncio.to_thread(
+                extract_metadata, item.markdown_text, item.docling_json, existing, item.content_hash, checkpoints
+            )
+            embedding_task = asyncio.ensure_future(asyncio.to_thread(
+                run_stage,
+                checkpoints,
+                "embedding",
+                lambda: embed_entry(item.markdown_text, extracted),
+                lambda vector: vector is not None,
+            ))
+            tasks.append(embedding_task)
+            cited_cases, cited_statutes = await citations_task
+            episode_task = asyncio.ensure_future(asyncio.to_thread(
+                run_stage,
+                checkpoints,
+                "graphiti",
+                lambda: add_entry_episode(item.target_id, existing, extracted, cited_cases + cited_statutes),
+                bool,
+            ))
+            tasks.append(episode_task)
+            index_task = asyncio.ensure_future(asyncio.to_thread(
+                index_entry_citations,
+                self.supabase,
+                item.target_id,
+                item.job.get("organization_id"),
+                existing,
+                extracted,
+                cited_cases,
+                cited_statutes,
+            ))
+            tasks.append(index_task)
+            tree_result, pageindex_metadata = await tree_task
+            await asyncio.to_thread(
+                index_entry_nodes, item.target_id, item.job.get("organization_id"), existing, extracted, tree_result
+            )
+            if needs_stage(checkpoints, "sections"):
+                await asyncio.to_thread(
+                    save_section_chunks, self.supabase, item.target_id, await sections_task, tree_result
+                )
+                if checkpoints is not None:
+                    await asyncio.to_thread(checkpoints.record, "sections", None)
+            ai_embedding = await embedding_task
+            await episode_task
+            await index_task
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        item.update_payload = build_entry_update(
+            item.markdown_text,
+            tree_result,
+            pageindex_metadata,
+            existing,
+            extracted,
+            cited_cases,
+            cited_statutes,
+            ai_embedding,
+        )
+
+    async def _write(self, item: WorkItem) -> None:
+        await asyncio.to_thread(
+            finish_row,
+            self.supabase,
+            ROW_TABLES[item.jobs_table],
+            item.target_id,
+            item.update_payload,
+            item.markdown_text,
+            item.docling_json,
+            DOCLING_CHECKPOINT,
+            item.checkpoints,
+        )
+        self.writer.complete(item.jobs_table, item.job["id"])
+        logger.info("Completed %s job %s (%s)", item.kind, item.job["id"], item.target_id)
+
+    async def _fail(self, item: WorkItem, stage: str, error: Exception) -> None:
+        self._cleanup(item)
+        logger.error("%s job %s failed in %s stage: %s", item.kind, item.job["id"], stage, error, exc_info=error)
+        self.writer.fail(item.jobs_table, item.job["id"], item.target_id, f"{stage}: {error}")
+
+    @staticmethod
+    def _cleanup(item: WorkItem) -> None:
+        if item.file_path:
+            Path(item.file_path).unlink(missing_ok=True)
+            item.file_path = None
+
+
+def run_pipelined(
+    supabase,
+    once: bool,
+    drain: bool,
+    interval: float,
+    min_interval: float,
+    batch_size: int,
+    cpu_workers: int,
+    io_workers: int,
+    queue_size: int,
+    preload_docling: bool = False,
+) -> None:
+    """Blocking entry point for main(): run the pipelined engine until drained (or forever)."""
+    engine = PipelinedEngine(supabase, cpu_workers, io_workers, queue_size, batch_size, preload_docling)
+    asyncio.run(engine.run(once, drain, interval, min_interval))
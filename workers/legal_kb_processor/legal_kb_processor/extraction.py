@@ -5,11 +5,27 @@ Fills title, summary, key_points, legal_principles, case/statute fields, practic
 import json
 import logging
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any
 
-from openai import OpenAI
-
-from .config import LLM_MAX_RETRIES, LLM_MODEL, MAX_MARKDOWN_FOR_EXTRACTION, OPENAI_API_KEY
+from .clients import get_openai_client
+from .config import (
+    EXTRACTION_CHUNK_CHARS,
+    EXTRACTION_CONCURRENCY,
+    EXTRACTION_CHUNK_THRESHOLD,
+    EXTRACTION_MODE,
+    EXTRACTION_STRUCTURED_OUTPUT,
+    EXTRACTION_TOKEN_BUDGET,
+    LLM_MAX_RETRIES,
+    LLM_MODEL,
+    MAX_MARKDOWN_FOR_EXTRACTION,
+)
+from .context import count_tokens, pack_context
+from .llm_cache import get_llm_cache
+from .rate_limiter import rate_limited_call
+from .sections import chunk_markdown
+from .telemetry import CallTrace
 
 logger = logging.getLogger(__name__)
 
@@ -43,36 +59,24 @@ def _truncate_markdown(markdown: str, max_chars: int) -> str:
     return markdown[:max_chars] + "\n\n[... truncated for context ...]"
 
 
-def extract_legal_metadata(
-    markdown: str,
-    existing: dict[str, Any] | None = None,
-    docling_sections_hint: list[dict] | None = None,
-) -> dict[str, Any]:
-    """
-    Use LLM to extract legal metadata from markdown.
-    Only sets fields that are empty in existing (so user-provided values are preserved).
-    """
+def merge_extracted(data: dict[str, Any], existing: dict[str, Any] | None = None) -> dict[str, Any]:
+    """Keep extracted schema fields that are non-empty and empty in existing (user-provided values win)."""
     existing = existing or {}
-    hint = ""
-    if docling_sections_hint:
-        try:
-            titles = [s.get("title") or s.get("heading") for s in docling_sections_hint[:30] if isinstance(s, dict)]
-            hint = "Document section headings (from structure): " + ", ".join(filter(None, titles))
-        except Exception:
-            pass
+    out = {}
+    for key in EXTRACTION_SCHEMA.get("properties", {}):
+        if key not in data:
+            continue
+        val = data[key]
+        existing_val = existing.get(key)
+        if existing_val is not None and existing_val != "" and (not isinstance(existing_val, list) or len(existing_val) > 0):
+            continue
+        if val is None or val == "" or (isinstance(val, list) and len(val) == 0):
+            continue
+        out[key] = val
+    return out
 
-    text = _truncate_markdown(markdown, MAX_MARKDOWN_FOR_EXTRACTION)
-
-    prompt = f"""Extract legal metadata from the following document text. Return valid JSON only.
-
-{hint}
 
-Document text:
----
-{text}
----
-
-Rules:
+_RULES = """Rules:
 - Infer document_type (case_law, statute, regulation, legal_article, template) from content.
 - Infer jurisdiction (country or region) from content.
 - For case law: extract case_name, case_citation, court_name, decision_date (YYYY-MM-DD).
@@ -83,40 +87,384 @@ Rules:
 - Use null for missing fields. Use empty array [] for missing lists.
 - Return only a single JSON object, no markdown fences."""
 
-    client = OpenAI(api_key=OPENAI_API_KEY)
-    last_error = None
+_PART_RULES = """
+- This is only part of a longer document: report what this part states and use null for anything it does not.
+- key_points and legal_principles: only those found in this part (use [] if none)."""
+
+# Chunked mode: list fields are unioned across chunks, other fields reconciled by vote
+_LIST_FIELDS = ("key_points", "legal_principles", "practice_areas", "keywords")
+# Fields taken from the earliest chunk that has them rather than by vote (free text differs per chunk)
+_FIRST_WINS_FIELDS = ("summary",)
+# Reserved against the tokens/min quota per request until the real usage is known
+_COMPLETION_TOKENS_ESTIMATE = 1000
+# Cap on the section-headings hint (it is repeated in every chunk prompt)
+_HINT_MAX_TOKENS = 150
+
+
+def _sections_hint(docling_sections_hint: list[dict] | None) -> str:
+    if not docling_sections_hint:
+        return ""
+    try:
+        titles = [s.get("title") or s.get("heading") for s in docling_sections_hint[:30] if isinstance(s, dict)]
+        hint = "Document section headings (from structure): "
+        kept = []
+        for title in filter(None, titles):
+            if count_tokens(hint + ", ".join(kept + [title])) > _HINT_MAX_TOKENS:
+                break
+            kept.append(title)
+        return hint + ", ".join(kept) if kept else ""
+    except Exception:
+        return ""
+
+
+def _build_prompt(text: str, hint: str, part: tuple[int, int] | None = None) -> str:
+    intro = "Extract legal metadata from the following document text. Return valid JSON only."
+    rules = _RULES
+    if part is not None:
+        intro = (
+            f"Extract legal metadata from part {part[0]} of {part[1]} of a document. Return valid JSON only."
+        )
+        rules += _PART_RULES
+    return f"""{intro}
+
+{hint}
+
+Document text:
+---
+{text}
+---
+
+{rules}"""
+
+
+def strict_schema(schema: dict[str, Any] = EXTRACTION_SCHEMA) -> dict[str, Any]:
+    """
+    schema in the form strict structured outputs accept: every property required, scalar
+    properties nullable (the model returns null for fields the document does not state).
+    """
+    properties = {}
+    for key, spec in schema["properties"].items():
+        spec = dict(spec)
+        if spec.get("type") != "array":
+            spec["type"] = [spec["type"], "null"]
+            if "enum" in spec:
+                spec["enum"] = [*spec["enum"], None]
+        properties[key] = spec
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False,
+    }
+
+
+_STRICT_SCHEMA = strict_schema()
+_structured_unsupported = False
+
+
+def extraction_request_options() -> dict[str, Any]:
+    """Extra chat.completions parameters for extraction requests (also used by bulk extraction)."""
+    if not EXTRACTION_STRUCTURED_OUTPUT or _structured_unsupported:
+        return {}
+    return {
+        "response_format": {
+            "type": "json_schema",
+            "json_schema": {"name": "legal_metadata", "strict": True, "schema": _STRICT_SCHEMA},
+        }
+    }
+
+
+def parse_json_reply(raw: str) -> dict[str, Any]:
+    """Parse the JSON object in an extraction reply (markdown fences allowed)."""
+    raw = raw.strip()
+    # Strip markdown code block if present
+    if raw.startswith("```"):
+        raw = re.sub(r"^```(?:json)?\s*", "", raw)
+        raw = re.sub(r"\s*```\s*$", "", raw)
+    data = json.loads(raw)
+    if not isinstance(data, dict):
+        raise json.JSONDecodeError("Expected a JSON object", raw, 0)
+    return data
+
+
+def _close_truncated(text: str) -> str:
+    """Close strings, arrays and objects left open by output that was cut off."""
+    stack: list[str] = []
+    in_string = escaped = False
+    for ch in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]" and stack:
+            stack.pop()
+    if in_string:
+        text += '"'
+    text = re.sub(r"[,:]\s*$", "", text.rstrip())
+    if stack and stack[-1] == "}":
+        # A key left without its value
+        text = re.sub(r'([{,])\s*"[^"]*"\s*$', r"\1", text)
+    text = re.sub(r",\s*$", "", text)
+    return text + "".join(reversed(stack))
+
+
+def repair_json_reply(raw: str) -> dict[str, Any] | None:
+    """
+    Best-effort local fix for near-valid JSON: prose or fences around the object, trailing
+    commas, output cut off mid-object. Returns None when the reply cannot be salvaged.
+    """
+    text = raw.strip()
+    start = text.find("{")
+    if start < 0:
+        return None
+    text = text[start:]
+    end = text.rfind("}")
+    candidates = [text[:end + 1], text] if end >= 0 else [text]
+    for candidate in candidates:
+        candidate = re.sub(r",\s*([}\]])", r"\1", candidate)
+        for attempt in (candidate, _close_truncated(candidate)):
+            try:
+                data = json.loads(attempt)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(data, dict):
+                return {k: v for k, v in data.items() if k in EXTRACTION_SCHEMA["properties"]}
+    return None
+
+
+def _repair_prompt(raw: str) -> str:
+    return f"""The text below was meant to be a single JSON object with these keys: {", ".join(EXTRACTION_SCHEMA["properties"])}.
+Fix it into valid JSON with the same content. Use null for missing fields and [] for missing lists.
+Return only the JSON object.
+
+---
+{raw[:20000]}
+---"""
+
+
+class _Refusal(RuntimeError):
+    pass
+
+
+def _chat(prompt: str, options: dict[str, Any]) -> tuple[str, Any]:
+    """One chat completion at temperature 0; returns (content, usage). Raises on refusal."""
+    client = get_openai_client()
+    response = rate_limited_call(
+        LLM_MODEL,
+        count_tokens(prompt) + _COMPLETION_TOKENS_ESTIMATE,
+        lambda: client.chat.completions.create(
+            model=LLM_MODEL,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0,
+            **options,
+        ),
+        usage_tokens=lambda r: r.usage.total_tokens,
+    )
+    message = response.choices[0].message
+    refusal = getattr(message, "refusal", None)
+    if refusal:
+        raise _Refusal(refusal)
+    return message.content or "", getattr(response, "usage", None)
+
+
+def _complete_json(prompt: str) -> dict[str, Any]:
+    """
+    Send prompt to the LLM and parse a JSON object from the reply. Structured outputs constrain
+    the reply to EXTRACTION_SCHEMA; a reply that still does not parse is repaired locally, then
+    with a short repair request (the reply, not the document), and only the remaining failures
+    and API errors resend the prompt (up to LLM_MAX_RETRIES requests). Replies that parse are kept
+    in the LLM response cache, so the same prompt is only sent once. Attempts are traced in telemetry.
+    """
+    global _structured_unsupported
+    options = extraction_request_options()
+    cache = get_llm_cache()
+    cache_extra = "json_schema" if options else None
+    if cache is not None:
+        cached = cache.get(LLM_MODEL, 0, prompt, extra=cache_extra)
+        if cached is not None:
+            try:
+                return parse_json_reply(cached)
+            except json.JSONDecodeError:
+                pass
+
+    trace = CallTrace("extraction", LLM_MODEL)
+    last_error: Exception | None = None
     for attempt in range(LLM_MAX_RETRIES):
+        started = time.perf_counter()
         try:
-            response = client.chat.completions.create(
-                model=LLM_MODEL,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0,
-            )
-            raw = (response.choices[0].message.content or "").strip()
-            # Strip markdown code block if present
-            if raw.startswith("```"):
-                raw = re.sub(r"^```(?:json)?\s*", "", raw)
-                raw = re.sub(r"\s*```\s*$", "", raw)
-            data = json.loads(raw)
-
-            # Merge: only set keys that are empty in existing
-            out = {}
-            for key in EXTRACTION_SCHEMA.get("properties", {}):
-                if key not in data:
-                    continue
-                val = data[key]
-                existing_val = existing.get(key)
-                if existing_val is not None and existing_val != "" and (not isinstance(existing_val, list) or len(existing_val) > 0):
-                    continue
-                if val is None or val == "" or (isinstance(val, list) and len(val) == 0):
-                    continue
-                out[key] = val
-            return out
-        except json.JSONDecodeError as e:
-            last_error = e
-            logger.warning("LLM extraction JSON parse attempt %s: %s", attempt + 1, e)
+            raw, usage = _chat(prompt, options)
+        except _Refusal as e:
+            trace.record("request", "refused", started)
+            trace.finish("refused")
+            raise RuntimeError(f"Legal metadata extraction refused: {e}") from e
         except Exception as e:
+            if options and "response_format" in str(e):
+                # Model or endpoint without structured outputs: fall back to plain JSON prompting
+                logger.warning("Structured outputs unsupported for %s; using plain JSON mode: %s", LLM_MODEL, e)
+                _structured_unsupported = True
+                options, cache_extra = {}, None
+            trace.record("request", "api_error", started)
             last_error = e
             logger.warning("LLM extraction attempt %s: %s", attempt + 1, e)
+            continue
+
+        try:
+            data = parse_json_reply(raw)
+            trace.record("request", "ok", started, usage)
+        except json.JSONDecodeError as e:
+            last_error = e
+            data = repair_json_reply(raw)
+            trace.record("request", "repaired" if data is not None else "parse_error", started, usage)
+            if data is None:
+                data = _repair_with_llm(raw, trace)
+            if data is None:
+                logger.warning("LLM extraction JSON parse attempt %s: %s", attempt + 1, e)
+                continue
+            raw = json.dumps(data)
+        if cache is not None:
+            cache.put(LLM_MODEL, 0, prompt, raw, extra=cache_extra)
+        trace.finish("ok")
+        return data
 
+    trace.finish("failed")
     raise RuntimeError(f"Legal metadata extraction failed after {LLM_MAX_RETRIES} attempts: {last_error}")
+
+
+def _repair_with_llm(raw: str, trace: CallTrace) -> dict[str, Any] | None:
+    """Ask the model to fix its own reply (small prompt, no document text)."""
+    started = time.perf_counter()
+    try:
+        fixed, usage = _chat(_repair_prompt(raw), extraction_request_options())
+    except Exception as e:
+        trace.record("repair", "api_error", started)
+        logger.warning("LLM extraction repair request failed: %s", e)
+        return None
+    try:
+        data = parse_json_reply(fixed)
+    except json.JSONDecodeError:
+        data = repair_json_reply(fixed)
+    trace.record("repair", "ok" if data is not None else "parse_error", started, usage)
+    return data
+
+
+def _is_empty(value: Any) -> bool:
+    return value is None or (isinstance(value, str) and not value.strip()) or (isinstance(value, list) and not value)
+
+
+def _normalize(value: str) -> str:
+    return " ".join(re.sub(r"[^\w\s]", " ", value.casefold()).split())
+
+
+def merge_partial_metadata(parts: list[dict[str, Any]]) -> dict[str, Any]:
+    """
+    Deterministically merge per-chunk extraction results (in document order): list fields are
+    unioned in order of first appearance, deduplicated case- and punctuation-insensitively;
+    summary comes from the earliest chunk that has one; every other scalar takes the value most
+    chunks agree on, ties going to the earliest chunk.
+    """
+    merged: dict[str, Any] = {}
+    for key in EXTRACTION_SCHEMA["properties"]:
+        values = [p.get(key) for p in parts if isinstance(p, dict) and not _is_empty(p.get(key))]
+        if key in _LIST_FIELDS:
+            items: list[str] = []
+            seen: set[str] = set()
+            for value in values:
+                for item in value if isinstance(value, list) else [value]:
+                    if not isinstance(item, str) or not item.strip():
+                        continue
+                    norm = _normalize(item)
+                    if norm and norm not in seen:
+                        seen.add(norm)
+                        items.append(item.strip())
+            merged[key] = items
+        elif not values:
+            merged[key] = None
+        elif key in _FIRST_WINS_FIELDS:
+            merged[key] = values[0]
+        else:
+            counts: dict[str, int] = {}
+            first: dict[str, Any] = {}
+            for value in values:
+                norm = _normalize(str(value))
+                counts[norm] = counts.get(norm, 0) + 1
+                first.setdefault(norm, value)
+            # max() keeps the first maximal key, and dicts preserve first-seen (document) order
+            merged[key] = first[max(counts, key=counts.__getitem__)]
+    return merged
+
+
+def _chunked(markdown: str) -> bool:
+    """
+    Whether markdown is extracted in chunks. auto packs (or truncates) into one prompt, and only
+    chunks documents over EXTRACTION_CHUNK_THRESHOLD tokens (MAX_MARKDOWN_FOR_EXTRACTION chars
+    when the threshold is 0).
+    """
+    if EXTRACTION_MODE != "auto":
+        return EXTRACTION_MODE == "chunked"
+    if EXTRACTION_CHUNK_THRESHOLD > 0:
+        return count_tokens(markdown) > EXTRACTION_CHUNK_THRESHOLD
+    return len(markdown) > MAX_MARKDOWN_FOR_EXTRACTION
+
+
+def extraction_prompts(markdown: str, docling_sections_hint: list[dict] | None = None) -> list[str]:
+    """
+    Prompts for one document: in chunked mode (auto: over EXTRACTION_CHUNK_THRESHOLD tokens) one
+    per section chunk of about EXTRACTION_CHUNK_CHARS, otherwise a single prompt (the
+    highest-value sections packed into EXTRACTION_TOKEN_BUDGET tokens, or markdown truncated at
+    MAX_MARKDOWN_FOR_EXTRACTION when the budget is 0). Replies are combined with
+    combine_extractions. Shared by the worker and bulk (Batch API) extraction.
+    """
+    hint = _sections_hint(docling_sections_hint)
+    if _chunked(markdown):
+        chunks = chunk_markdown(markdown, EXTRACTION_CHUNK_CHARS)
+        if len(chunks) > 1:
+            return [_build_prompt(chunk, hint, (i + 1, len(chunks))) for i, chunk in enumerate(chunks)]
+        return [_build_prompt(markdown, hint)]
+    if EXTRACTION_TOKEN_BUDGET > 0:
+        # Packed context keeps the headings (and names omitted ones), so no separate hint
+        return [_build_prompt(pack_context(markdown, EXTRACTION_TOKEN_BUDGET), "")]
+    return [_build_prompt(_truncate_markdown(markdown, MAX_MARKDOWN_FOR_EXTRACTION), hint)]
+
+
+def combine_extractions(parts: list[dict[str, Any]]) -> dict[str, Any]:
+    """Combine parsed replies to extraction_prompts (in prompt order) into one raw extraction result."""
+    return parts[0] if len(parts) == 1 else merge_partial_metadata(parts)
+
+
+def request_legal_metadata(
+    markdown: str,
+    docling_sections_hint: list[dict] | None = None,
+) -> dict[str, Any]:
+    """
+    Ask the LLM for legal metadata from markdown; return the raw parsed JSON object.
+    Independent of the existing row, so the result can be cached per document content.
+    Chunked prompts (map-reduce over section chunks) run with at most EXTRACTION_CONCURRENCY
+    concurrent requests, so latency follows chunk size rather than document size.
+    """
+    prompts = extraction_prompts(markdown, docling_sections_hint)
+    if len(prompts) == 1:
+        return _complete_json(prompts[0])
+    logger.info("Extracting metadata from %d chunks (%d chars)", len(prompts), len(markdown))
+    with ThreadPoolExecutor(max_workers=max(1, EXTRACTION_CONCURRENCY), thread_name_prefix="extract") as pool:
+        parts = list(pool.map(_complete_json, prompts))
+    return combine_extractions(parts)
+
+
+def extract_legal_metadata(
+    markdown: str,
+    existing: dict[str, Any] | None = None,
+    docling_sections_hint: list[dict] | None = None,
+) -> dict[str, Any]:
+    """
+    Use LLM to extract legal metadata from markdown.
+    Only sets fields that are empty in existing (so user-provided values are preserved).
+    """
+    data = request_legal_metadata(markdown, docling_sections_hint=docling_sections_hint)
+    return merge_extracted(data, existing)
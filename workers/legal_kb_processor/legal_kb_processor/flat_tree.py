@@ -0,0 +1,150 @@
+"""
+Flattened PageIndex tree, stored in pageindex_metadata["flat_tree"].
+Nodes are laid out in preorder as parallel arrays (node_id, parent, depth, first_child,
+next_sibling, subtree_end, title, line, page range, tokens), so a node is an index, its
+subtree is the range [i, subtree_end[i]), and parent/child steps are array lookups. FlatTree
+loads the arrays for retrieval without walking the nested structure dicts.
+"""
+from typing import Any, Iterator
+
+FLAT_TREE_VERSION = 1
+_ARRAYS = (
+    "node_id",
+    "parent",
+    "depth",
+    "first_child",
+    "next_sibling",
+    "subtree_end",
+    "title",
+    "line",
+    "page_start",
+    "page_end",
+    "tokens",
+)
+
+
+def flatten_tree(tree: Any, spans: dict[str, dict[str, Any]] | None = None) -> dict[str, Any]:
+    """
+    Parallel arrays for tree's nodes in preorder (parent, first_child, next_sibling are indexes,
+    -1 for none); page range and tokens come from node spans, when given.
+    """
+    structure = tree.get("structure", tree) if isinstance(tree, dict) else tree
+    roots = structure if isinstance(structure, list) else [structure] if isinstance(structure, dict) else []
+    spans = spans or {}
+    flat: dict[str, list] = {name: [] for name in _ARRAYS}
+    last_child: list[int] = []
+    last_root = -1
+    # (node, parent index, depth); reversed so nodes come off the stack in document order
+    stack = [(node, -1, 0) for node in reversed(roots) if isinstance(node, dict)]
+    while stack:
+        node, parent, depth = stack.pop()
+        i = len(flat["node_id"])
+        node_id = node.get("node_id")
+        span = spans.get(str(node_id)) or {}
+        flat["node_id"].append(node_id)
+        flat["parent"].append(parent)
+        flat["depth"].append(depth)
+        flat["first_child"].append(-1)
+        flat["next_sibling"].append(-1)
+        flat["subtree_end"].append(i + 1)
+        flat["title"].append(node.get("title"))
+        flat["line"].append(node.get("line_num"))
+        flat["page_start"].append(span.get("page_start"))
+        flat["page_end"].append(span.get("page_end"))
+        flat["tokens"].append(span.get("tokens"))
+        last_child.append(-1)
+        if parent >= 0:
+            if last_child[parent] < 0:
+                flat["first_child"][parent] = i
+            else:
+                flat["next_sibling"][last_child[parent]] = i
+            last_child[parent] = i
+        else:
+            # Top-level nodes are siblings too
+            if last_root >= 0:
+                flat["next_sibling"][last_root] = i
+            last_root = i
+        children = [child for child in node.get("nodes") or [] if isinstance(child, dict)]
+        stack.extend((child, i, depth + 1) for child in reversed(children))
+    # A subtree ends where the next node outside it starts
+    for i in range(len(flat["node_id"]) - 1, -1, -1):
+        child = flat["first_child"][i]
+        while child >= 0:
+            flat["subtree_end"][i] = max(flat["subtree_end"][i], flat["subtree_end"][child])
+            child = flat["next_sibling"][child]
+    return {"version": FLAT_TREE_VERSION, **flat}
+
+
+class FlatTree:
+    """Navigation over a flattened tree: node i is an index into the parallel arrays."""
+
+    def __init__(self, flat: dict[str, Any]):
+        if flat.get("version") != FLAT_TREE_VERSION:
+            raise ValueError(f"unsupported flat tree version {flat.get('version')!r}")
+        self.flat = flat
+        self.node_id: list = flat["node_id"]
+        self.parent: list[int] = flat["parent"]
+        self.depth: list[int] = flat["depth"]
+        self.first_child: list[int] = flat["first_child"]
+        self.next_sibling: list[int] = flat["next_sibling"]
+        self.subtree_end: list[int] = flat["subtree_end"]
+        self.title: list = flat["title"]
+        self.tokens: list = flat["tokens"]
+        self._index: dict[str, int] | None = None
+
+    @classmethod
+    def from_metadata(cls, pageindex_metadata: dict | None) -> "FlatTree | None":
+        """The flat tree stored in pageindex_metadata, or None for trees processed before it existed."""
+        flat = (pageindex_metadata or {}).get("flat_tree")
+        return cls(flat) if isinstance(flat, dict) else None
+
+    @classmethod
+    def from_tree(cls, tree: Any, spans: dict[str, dict[str, Any]] | None = None) -> "FlatTree":
+        return cls(flatten_tree(tree, spans))
+
+    def __len__(self) -> int:
+        return len(self.node_id)
+
+    def index(self, node_id: str) -> int:
+        """Index of a node id (KeyError if absent)."""
+        if self._index is None:
+            self._index = {str(nid): i for i, nid in enumerate(self.node_id) if nid is not None}
+        return self._index[str(node_id)]
+
+    def children(self, i: int) -> Iterator[int]:
+        child = self.first_child[i]
+        while child >= 0:
+            yield child
+            child = self.next_sibling[child]
+
+    def roots(self) -> Iterator[int]:
+        """Top-level nodes."""
+        i = 0 if self.node_id else -1
+        while i >= 0:
+            yield i
+            i = self.next_sibling[i]
+
+    def ancestors(self, i: int) -> Iterator[int]:
+        """Parent, grandparent, ... up to the root."""
+        i = self.parent[i]
+        while i >= 0:
+            yield i
+            i = self.parent[i]
+
+    def subtree(self, i: int) -> range:
+        """Indexes of node i and its descendants (contiguous in preorder)."""
+        return range(i, self.subtree_end[i])
+
+    def is_leaf(self, i: int) -> bool:
+        return self.first_child[i] < 0
+
+    def subtree_tokens(self, i: int) -> int:
+        return sum(t or 0 for t in self.tokens[i:self.subtree_end[i]])
+
+    def node(self, i: int) -> dict[str, Any]:
+        """Node i's fields as a dict."""
+        return {name: self.flat[name][i] for name in _ARRAYS}
+
+    def max_depth(self) -> int:
+        """Levels in the tree (0 if empty)."""
+        return max(self.depth) + 1 if self.depth else 0
@@ -1,16 +1,23 @@
 """
 Optional Graphiti client for adding Legal KB entries as episodes (topic-case graph).
-Requires ENABLE_GRAPHITI and FalkorDB or Neo4j configuration.
+Requires ENABLE_GRAPHITI and FalkorDB or Neo4j configuration. The client is cached per
+process (built once under a lock, as enrich threads ask for it concurrently) and only used on
+the worker event loop (clients.run_sync), so its driver connections stay bound to a live loop
+across jobs.
+Resolved citations between entries are written as CITES edges directly (no LLM extraction).
 Uses pip-installed graphiti-core (e.g. pip install graphiti-core[falkordb]).
 
 For add_episode/search API details and local codebase reference, see:
   docs/GRAPHITI_CONSUMPTION.md (and graphiti/examples/quickstart/quickstart_falkordb.py).
 """
-import asyncio
 import logging
+import os
+import threading
+import uuid
 from datetime import datetime, timezone
 from typing import Any
 
+from .clients import run_sync
 from .config import (
     ENABLE_GRAPHITI,
     GRAPHITI_DATABASE,
@@ -24,6 +31,7 @@ from .config import (
 
 logger = logging.getLogger(__name__)
 _graphiti_client: Any = None
+_graphiti_lock = threading.Lock()
 
 
 def get_graphiti_client():
@@ -31,33 +39,43 @@ def get_graphiti_client():
     global _graphiti_client
     if not ENABLE_GRAPHITI:
         return None
-    if _graphiti_client is not None:
-        return _graphiti_client
-    try:
-        from graphiti_core import Graphiti
-        if GRAPHITI_PROVIDER == "falkordb":
-            from graphiti_core.driver.falkordb_driver import FalkorDriver
-            driver = FalkorDriver(
-                host=GRAPHITI_FALKORDB_HOST,
-                port=GRAPHITI_FALKORDB_PORT,
-                database=GRAPHITI_DATABASE or "lex_nexus_graph",
-            )
-        elif GRAPHITI_PROVIDER == "neo4j" and GRAPHITI_NEO4J_URI:
-            from graphiti_core.driver.neo4j_driver import Neo4jDriver
-            driver = Neo4jDriver(
-                uri=GRAPHITI_NEO4J_URI,
-                user=GRAPHITI_NEO4J_USER,
-                password=GRAPHITI_NEO4J_PASSWORD,
-                database=GRAPHITI_DATABASE or "neo4j",
-            )
-        else:
-            logger.warning("Graphiti enabled but provider/Neo4j config missing")
+    with _graphiti_lock:
+        if _graphiti_client is not None:
+            return _graphiti_client
+        try:
+            from graphiti_core import Graphiti
+            if GRAPHITI_PROVIDER == "falkordb":
+                from graphiti_core.driver.falkordb_driver import FalkorDriver
+                driver = FalkorDriver(
+                    host=GRAPHITI_FALKORDB_HOST,
+                    port=GRAPHITI_FALKORDB_PORT,
+                    database=GRAPHITI_DATABASE or "lex_nexus_graph",
+                )
+            elif GRAPHITI_PROVIDER == "neo4j" and GRAPHITI_NEO4J_URI:
+                from graphiti_core.driver.neo4j_driver import Neo4jDriver
+                driver = Neo4jDriver(
+                    uri=GRAPHITI_NEO4J_URI,
+                    user=GRAPHITI_NEO4J_USER,
+                    password=GRAPHITI_NEO4J_PASSWORD,
+                    database=GRAPHITI_DATABASE or "neo4j",
+                )
+            else:
+                logger.warning("Graphiti enabled but provider/Neo4j config missing")
+                return None
+            _graphiti_client = Graphiti(graph_driver=driver)
+            return _graphiti_client
+        except Exception as e:
+            logger.warning("Graphiti client init failed: %s", e)
             return None
-        _graphiti_client = Graphiti(graph_driver=driver)
-        return _graphiti_client
-    except Exception as e:
-        logger.warning("Graphiti client init failed: %s", e)
-        return None
+
+
+async def close_graphiti_client() -> None:
+    """Close the cached client's driver (on the worker loop its connections belong to)."""
+    global _graphiti_client
+    with _graphiti_lock:
+        client, _graphiti_client = _graphiti_client, None
+    if client is not None:
+        await client.close()
 
 
 def add_episode_sync(
@@ -89,7 +107,7 @@ def add_episode_sync(
         except Exception:
             pass
     try:
-        asyncio.run(
+        run_sync(
             client.add_episode(
                 name=f"legal_kb_entry_{entry_id}",
                 episode_body=episode_body,
@@ -102,3 +120,99 @@ def add_episode_sync(
     except Exception as e:
         logger.warning("Graphiti add_episode failed: %s", e)
         return False
+
+
+def add_case_document_episode_sync(document_id: str, case_id: str, markdown_text: str) -> bool:
+    """
+    Add a case document as a Graphiti episode (sync wrapper around async add_episode).
+    Returns True if episode was added, False if Graphiti disabled or failed.
+    """
+    client = get_graphiti_client()
+    if client is None:
+        return False
+    episode_body = (
+        f"Case document document_id={document_id} case_id={case_id}. "
+        f"Content summary (first 500 chars): {markdown_text[:500]}"
+    )
+    try:
+        run_sync(
+            client.add_episode(
+                name=f"case_document_{document_id}",
+                episode_body=episode_body,
+                source_description="Case document",
+                reference_time=datetime.now(timezone.utc),
+                group_id=GRAPHITI_DATABASE or None,
+            )
+        )
+        return True
+    except Exception as e:
+        logger.warning("Graphiti case document episode failed: %s", e)
+        return False
+
+
+def _entry_node_uuid(entry_id: str) -> str:
+    # Deterministic, so saving an entry's node or edge again updates it instead of duplicating it
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"legal_kb_entry:{entry_id}"))
+
+
+async def _add_citation_edges(client, entry_id: str, cited: list[tuple[str, str]]) -> None:
+    from graphiti_core.edges import EntityEdge
+    from graphiti_core.helpers import get_default_group_id
+    from graphiti_core.nodes import EntityNode
+
+    group_id = GRAPHITI_DATABASE or get_default_group_id(client.driver.provider)
+    now = datetime.now(timezone.utc)
+    nodes: dict[str, Any] = {}
+    for node_entry_id in [entry_id] + [cited_id for cited_id, _ in cited]:
+        if node_entry_id in nodes:
+            continue
+        node = EntityNode(
+            uuid=_entry_node_uuid(node_entry_id),
+            name=f"legal_kb_entry_{node_entry_id}",
+            group_id=group_id,
+            labels=["LegalDocument"],
+            created_at=now,
+        )
+        await node.generate_name_embedding(client.embedder)
+        await node.save(client.driver)
+        nodes[node_entry_id] = node
+    for cited_id, citation in cited:
+        edge = EntityEdge(
+            uuid=str(uuid.uuid5(uuid.NAMESPACE_URL, f"legal_kb_cites:{entry_id}:{cited_id}")),
+            group_id=group_id,
+            source_node_uuid=nodes[entry_id].uuid,
+            target_node_uuid=nodes[cited_id].uuid,
+            created_at=now,
+            name="CITES",
+            fact=f"legal_kb_entry_{entry_id} cites legal_kb_entry_{cited_id} ({citation})",
+        )
+        await edge.generate_embedding(client.embedder)
+        await edge.save(client.driver)
+
+
+def add_citation_edges_sync(entry_id: str, cited: list[tuple[str, str]]) -> bool:
+    """
+    Add CITES edges from a Legal KB entry to the entries its citations resolve to
+    (cited = [(cited entry id, citation)]). Nodes and edges are saved directly with
+    deterministic uuids, so re-adding them is idempotent.
+    Returns True if edges were added, False if Graphiti disabled, nothing to add, or failed.
+    """
+    client = get_graphiti_client()
+    if client is None or not cited:
+        return False
+    try:
+        run_sync(_add_citation_edges(client, entry_id, cited))
+        return True
+    except Exception as e:
+        logger.warning("Graphiti citation edges failed: %s", e)
+        return False
+
+
+def _reset_after_fork() -> None:
+    """A forked child must not reuse the parent's driver (or a lock held at fork time)."""
+    global _graphiti_client, _graphiti_lock
+    _graphiti_lock = threading.Lock()
+    _graphiti_client = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,199 @@
+"""
+Job queue helpers for legal_kb_processing_jobs and case_document_processing_jobs.
+Claims are race-free: a queued row is only taken by the worker whose conditional
+update (status = 'queued' -> 'processing') actually matched it, so replicas and
+concurrent worker processes never process the same document twice.
+"""
+import logging
+from datetime import datetime, timezone
+import threading
+from collections import defaultdict
+from itertools import groupby
+
+from .config import CASE_DOC_PIPELINE, PIPELINE_NAME
+
+logger = logging.getLogger(__name__)
+
+KB_JOBS_TABLE = "legal_kb_processing_jobs"
+CASE_DOC_JOBS_TABLE = "case_document_processing_jobs"
+# Row each job processes: its entry (KB) or document (case documents)
+ROW_TABLES = {KB_JOBS_TABLE: "legal_knowledge_base", CASE_DOC_JOBS_TABLE: "documents"}
+
+KB_JOB_COLUMNS = "id, entry_id, organization_id, storage_bucket, storage_path, attempts, payload"
+CASE_DOC_JOB_COLUMNS = "id, document_id, case_id, organization_id, storage_bucket, storage_path, attempts"
+
+# Re-read the queue this many times when every candidate was taken by another worker
+_CLAIM_ROUNDS = 3
+
+
+def claim_jobs(supabase, table: str, columns: str, pipeline: str, limit: int = 1) -> list[dict]:
+    """
+    Atomically claim up to limit of the oldest queued jobs in table for pipeline.
+    Candidates are flipped to 'processing' with one update per distinct attempts
+    value, conditional on status = 'queued'; only rows the update actually matched
+    are returned, so rows won by another worker are skipped. Usually a claim costs
+    two round trips regardless of limit.
+    """
+    limit = max(1, limit)
+    for _ in range(_CLAIM_ROUNDS):
+        r = (
+            supabase.table(table)
+            .select(columns)
+            .eq("status", "queued")
+            .eq("pipeline", pipeline)
+            .order("created_at", desc=False)
+            .limit(limit)
+            .execute()
+        )
+        candidates = r.data or []
+        if not candidates:
+            return []
+
+        now = datetime.now(tz=timezone.utc).isoformat()
+        by_id = {job["id"]: job for job in candidates}
+        claimed: list[dict] = []
+        ordered = sorted(candidates, key=lambda j: j.get("attempts") or 0)
+        for attempts, group in groupby(ordered, key=lambda j: j.get("attempts") or 0):
+            ids = [job["id"] for job in group]
+            u = (
+                supabase.table(table)
+                .update({"status": "processing", "attempts": attempts + 1, "updated_at": now})
+                .in_("id", ids)
+                .eq("status", "queued")
+                .execute()
+            )
+            claimed.extend(by_id[row["id"]] for row in (u.data or []) if row.get("id") in by_id)
+
+        if claimed:
+            # Keep queue (created_at) order for processing
+            won = {job["id"] for job in claimed}
+            return [job for job in candidates if job["id"] in won]
+        logger.debug("All %d candidates in %s claimed by other workers; re-reading queue", len(candidates), table)
+    return []
+
+
+def claim_job(supabase, table: str, columns: str, pipeline: str) -> dict | None:
+    """Atomically claim the oldest queued job in table for pipeline; None if the queue is empty."""
+    jobs = claim_jobs(supabase, table, columns, pipeline, limit=1)
+    return jobs[0] if jobs else None
+
+
+def poll_jobs(supabase, limit: int = 1) -> list[dict]:
+    """Atomically claim up to limit queued KB jobs; mark their entries as processing in one update."""
+    jobs = claim_jobs(supabase, KB_JOBS_TABLE, KB_JOB_COLUMNS, PIPELINE_NAME, limit=limit)
+    if not jobs:
+        return []
+
+    supabase.table("legal_knowledge_base").update({
+        "processing_status": "processing",
+    }).in_("id", [job["entry_id"] for job in jobs]).execute()
+
+    return jobs
+
+
+def poll_case_doc_jobs(supabase, limit: int = 1) -> list[dict]:
+    """Atomically claim up to limit queued case document jobs; mark their documents as processing."""
+    jobs = claim_jobs(supabase, CASE_DOC_JOBS_TABLE, CASE_DOC_JOB_COLUMNS, CASE_DOC_PIPELINE, limit=limit)
+    if not jobs:
+        return []
+    supabase.table("documents").update({
+        "processing_status": "processing",
+        "updated_at": datetime.now(tz=timezone.utc).isoformat(),
+    }).in_("id", [job["document_id"] for job in jobs]).execute()
+    return jobs
+
+
+def requeue_entry_jobs(supabase, entry_ids: list[str]) -> int:
+    """
+    Queue the latest completed KB job of each entry again (e.g. after bulk extraction), so a
+    worker finishes the entry, resuming from its checkpoints. Returns the number requeued.
+    """
+    requeued = 0
+    for i in range(0, len(entry_ids), 200):
+        r = (
+            supabase.table(KB_JOBS_TABLE)
+            .select("id, entry_id")
+            .in_("entry_id", entry_ids[i:i + 200])
+            .eq("pipeline", PIPELINE_NAME)
+            .eq("status", "completed")
+            .order("created_at", desc=True)
+            .execute()
+        )
+        latest: dict[str, str] = {}
+        for job in r.data or []:
+            latest.setdefault(job["entry_id"], job["id"])
+        if not latest:
+            continue
+        u = (
+            supabase.table(KB_JOBS_TABLE)
+            .update({"status": "queued", "updated_at": datetime.now(tz=timezone.utc).isoformat()})
+            .in_("id", list(latest.values()))
+            .eq("status", "completed")
+            .execute()
+        )
+        requeued += len(u.data or [])
+    return requeued
+
+
+class StatusWriter:
+    """
+    Coalesces job status transitions into batched updates across concurrently processed jobs.
+    complete()/fail() only queue the transition; flush() writes every queued completion for a
+    jobs table in one update and marks every failed entry/document row in one update per table.
+    Failed jobs carry their own last_error, so each is still one update. Thread-safe.
+    """
+
+    def __init__(self, supabase):
+        self.supabase = supabase
+        self._lock = threading.Lock()
+        self._completed: dict[str, list[str]] = defaultdict(list)
+        self._failed: dict[str, list[tuple[str, str, str]]] = defaultdict(list)
+
+    def complete(self, jobs_table: str, job_id: str) -> None:
+        with self._lock:
+            self._completed[jobs_table].append(job_id)
+
+    def fail(self, jobs_table: str, job_id: str, row_id: str, err_msg: str) -> None:
+        """Queue a failed job; its legal_knowledge_base entry or documents row is marked failed too."""
+        with self._lock:
+            self._failed[jobs_table].append((job_id, row_id, err_msg[:5000]))
+
+    def pending(self) -> int:
+        with self._lock:
+            return sum(len(v) for v in self._completed.values()) + sum(len(v) for v in self._failed.values())
+
+    def flush(self) -> None:
+        with self._lock:
+            completed, self._completed = self._completed, defaultdict(list)
+            failed, self._failed = self._failed, defaultdict(list)
+        now = datetime.now(tz=timezone.utc).isoformat()
+
+        for table, job_ids in completed.items():
+            try:
+                self.supabase.table(table).update({
+                    "status": "completed",
+                    "processed_at": now,
+                    "updated_at": now,
+                }).in_("id", job_ids).execute()
+            except Exception as e:
+                logger.error("Could not mark %s jobs completed (%s): %s", table, ", ".join(job_ids), e)
+
+        for table, failures in failed.items():
+            for job_id, _, err_msg in failures:
+                try:
+                    self.supabase.table(table).update({
+                        "status": "failed",
+                        "last_error": err_msg,
+                        "processed_at": now,
+                        "updated_at": now,
+                    }).eq("id", job_id).execute()
+                except Exception as e:
+                    logger.error("Could not mark %s job %s failed: %s", table, job_id, e)
+            row_ids = [row_id for _, row_id, _ in failures]
+            try:
+                self.supabase.table(ROW_TABLES[table]).update({
+                    "processing_status": "failed",
+                    "updated_at": now,
+                }).in_("id", row_ids).execute()
+            except Exception as e:
+                logger.error("Could not mark %s rows failed (%s): %s", ROW_TABLES[table], ", ".join(row_ids), e)
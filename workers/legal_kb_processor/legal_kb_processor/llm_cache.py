@@ -0,0 +1,180 @@
+"""
+Persistent LLM response cache.
+Responses are stored in a local SQLite file keyed on (model, temperature, prompt hash), so
+re-running a failed job, a retry or a backfill sends no prompt to OpenAI twice. The file is
+shared by the worker processes on a host (WAL mode); entries older than the max age are
+dropped, and least recently used entries are evicted once the store exceeds its size limit.
+"""
+import atexit
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any
+
+from .config import ENABLE_LLM_CACHE, LLM_CACHE_MAX_AGE, LLM_CACHE_MAX_BYTES, LLM_CACHE_PATH
+
+logger = logging.getLogger(__name__)
+
+_llm_cache: Any = None
+_llm_cache_pid: int | None = None
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_responses (
+    cache_key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    temperature REAL NOT NULL,
+    response TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS llm_responses_accessed_at ON llm_responses (accessed_at);
+"""
+
+
+def prompt_key(model: str, temperature: float, prompt: str, extra: Any = None) -> str:
+    """Cache key: model, temperature, sha256 of the prompt and any other request options (extra)."""
+    prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    material = json.dumps([model, float(temperature), prompt_hash, extra], sort_keys=True, default=str)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """
+    SQLite store of LLM response text. get/put are thread-safe; hits and misses are counted
+    per process (stats()). Expired rows are removed on read and during eviction.
+    """
+
+    def __init__(self, path: Path, max_bytes: int, max_age: float):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(path), timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._approx_bytes = self._total_bytes()
+
+    def _total_bytes(self) -> int:
+        return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_responses").fetchone()[0]
+
+    def get(self, model: str, temperature: float, prompt: str, extra: Any = None) -> str | None:
+        key = prompt_key(model, temperature, prompt, extra)
+        now = time.time()
+        with self._lock:
+            try:
+                row = self._conn.execute(
+                    "SELECT response, created_at FROM llm_responses WHERE cache_key = ?", (key,)
+                ).fetchone()
+                if row is not None and self.max_age and now - row[1] > self.max_age:
+                    self._conn.execute("DELETE FROM llm_responses WHERE cache_key = ?", (key,))
+                    row = None
+                if row is None:
+                    self.misses += 1
+                    return None
+                self._conn.execute("UPDATE llm_responses SET accessed_at = ? WHERE cache_key = ?", (now, key))
+            except sqlite3.Error as e:
+                logger.warning("LLM cache read failed: %s", e)
+                self.misses += 1
+                return None
+            self.hits += 1
+        logger.debug("LLM cache hit (%s, %s)", model, key[:12])
+        return row[0]
+
+    def put(self, model: str, temperature: float, prompt: str, response: str, extra: Any = None) -> None:
+        if not response:
+            return
+        key = prompt_key(model, temperature, prompt, extra)
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO llm_responses "
+                    "(cache_key, model, temperature, response, size, created_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, model, float(temperature), response, size, now, now),
+                )
+            except sqlite3.Error as e:
+                logger.warning("LLM cache write failed: %s", e)
+                return
+            self._approx_bytes += size
+            if self._approx_bytes > self.max_bytes:
+                self._evict_locked()
+
+    def evict(self) -> None:
+        """Drop expired entries, then least recently used ones until under 90% of max_bytes."""
+        with self._lock:
+            self._evict_locked()
+
+    def _evict_locked(self) -> None:
+        try:
+            if self.max_age:
+                self._conn.execute("DELETE FROM llm_responses WHERE created_at < ?", (time.time() - self.max_age,))
+            total = self._total_bytes()
+            target = int(self.max_bytes * 0.9)
+            removed = 0
+            while total > target:
+                rows = self._conn.execute(
+                    "SELECT cache_key, size FROM llm_responses ORDER BY accessed_at LIMIT 500"
+                ).fetchall()
+                if not rows:
+                    break
+                batch = []
+                for key, size in rows:
+                    if total <= target:
+                        break
+                    batch.append((key,))
+                    total -= size
+                self._conn.executemany("DELETE FROM llm_responses WHERE cache_key = ?", batch)
+                removed += len(batch)
+            self._approx_bytes = total
+        except sqlite3.Error as e:
+            logger.warning("LLM cache eviction failed: %s", e)
+            return
+        if removed:
+            logger.info("LLM cache evicted %d entries (%d bytes remain)", removed, total)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM llm_responses").fetchone()[0]
+            return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": self._total_bytes()}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def _log_stats() -> None:
+    cache = _llm_cache
+    if cache is not None and _llm_cache_pid == os.getpid() and (cache.hits or cache.misses):
+        logger.info("LLM cache: %d hits, %d misses", cache.hits, cache.misses)
+
+
+def get_llm_cache() -> LLMCache | None:
+    """Lazy-init the process-wide LLM cache (reopened after fork). Returns None if disabled or unusable."""
+    global _llm_cache, _llm_cache_pid
+    if not ENABLE_LLM_CACHE:
+        return None
+    if _llm_cache is not None and _llm_cache_pid == os.getpid():
+        return _llm_cache
+    try:
+        _llm_cache = LLMCache(Path(LLM_CACHE_PATH), LLM_CACHE_MAX_BYTES, LLM_CACHE_MAX_AGE)
+    except (OSError, sqlite3.Error) as e:
+        logger.warning("LLM cache init failed: %s", e)
+        _llm_cache = None
+        return None
+    _llm_cache_pid = os.getpid()
+    return _llm_cache
+
+
+atexit.register(_log_stats)
@@ -4,35 +4,42 @@ citation parsing, optional embedding, and optional Graphiti episode.
 Also processes case documents (Phase 4) via case_document_processing_jobs.
 """
 import argparse
-import asyncio
 import logging
+import multiprocessing
 import sys
-import tempfile
 import time
 from datetime import datetime, timezone
 from pathlib import Path
 
 from supabase import create_client
 
-from .citations import parse_citations
 from .config import (
-    DOCLING_MAX_RETRIES,
-    ENABLE_GRAPHITI,
-    ENABLE_VECTOR_FALLBACK,
-    GRAPHITI_DATABASE,
+    CASE_DOC_BUCKET,
+    CLAIM_BATCH_SIZE,
+    DOCLING_CHECKPOINT,
+    DOCLING_PRELOAD,
+    DOCLING_SPLIT_WORKERS,
+    DEFER_EXTRACTION,
     LEGAL_KB_BUCKET,
     LOG_LEVEL,
-    MAX_TEXT_FOR_EMBEDDING,
-    OPENAI_API_KEY,
-    PAGEINDEX_ADD_NODE_SUMMARY,
-    PIPELINE_NAME,
+    PIPELINE_QUEUE_SIZE,
+    POLL_MIN_INTERVAL,
+    STAGE_CHECKPOINTS,
     SUPABASE_SERVICE_ROLE_KEY,
     SUPABASE_URL,
+    WORKER_CONCURRENCY,
+)
+from .checkpoints import load_checkpoints, needs_stage, run_stage
+from .jobs import CASE_DOC_JOBS_TABLE, KB_JOBS_TABLE, StatusWriter, poll_case_doc_jobs, poll_jobs
+from .pipeline import limit_split_workers, warm_up_converter
+from .stages import (
+    convert_document,
+    enrich_case_document,
+    enrich_entry,
+    fetch_document,
+    finish_row,
+    save_docling_checkpoint,
 )
-from .embeddings import generate_embedding
-from .extraction import extract_legal_metadata
-from .graphiti_client import add_episode_sync
-from .pipeline import run_docling, run_pageindex_from_markdown, tree_depth_and_count
 
 logging.basicConfig(
     level=getattr(logging, LOG_LEVEL, logging.INFO),
@@ -49,336 +56,292 @@ def get_supabase():
     return create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
 
 
-def poll_one_job(supabase):
-    """Fetch one queued job; mark as processing and return (job, entry_id)."""
-    r = (
-        supabase.table("legal_kb_processing_jobs")
-        .select("id, entry_id, organization_id, storage_bucket, storage_path, attempts, payload")
-        .eq("status", "queued")
-        .eq("pipeline", PIPELINE_NAME)
-        .order("created_at", desc=False)
-        .limit(1)
-        .execute()
-    )
-    if not r.data or len(r.data) == 0:
-        return None, None
-
-    job = r.data[0]
-    job_id = job["id"]
-    entry_id = job["entry_id"]
-
-    supabase.table("legal_kb_processing_jobs").update({
-        "status": "processing",
-        "attempts": job.get("attempts", 0) + 1,
-        "updated_at": datetime.now(tz=timezone.utc).isoformat(),
-    }).eq("id", job_id).execute()
-
-    supabase.table("legal_knowledge_base").update({
-        "processing_status": "processing",
-    }).eq("id", entry_id).execute()
-
-    return job, entry_id
-
-
-def download_file(supabase, bucket: str, path: str) -> bytes:
-    return supabase.storage.from_(bucket).download(path)
-
-
-def _get_existing_entry(supabase, entry_id: str) -> dict | None:
-    r = supabase.table("legal_knowledge_base").select(
-        "title, summary, document_type, jurisdiction, case_name, case_citation, court_name, "
-        "decision_date, statute_name, statute_number, practice_areas, keywords, key_points, legal_principles"
-    ).eq("id", entry_id).single().execute()
-    if r.data:
-        return r.data
-    return None
-
-
-def process_job(supabase, job: dict, entry_id: str) -> None:
+def process_job(
+    supabase,
+    job: dict,
+    entry_id: str,
+    writer: StatusWriter | None = None,
+    defer_extraction: bool = False,
+) -> None:
+    """
+    Run the full pipeline for one KB job. Job status transitions go through writer so a batch
+    of jobs is completed in one update; without a writer they are written before returning.
+    With defer_extraction the job stops after Docling unless the entry already has an extraction
+    checkpoint (bulk extraction requeues it once extracted).
+    """
+    own_writer = writer is None
+    writer = writer or StatusWriter(supabase)
     bucket = job.get("storage_bucket") or LEGAL_KB_BUCKET
-    path = job["storage_path"]
     job_id = job["id"]
-    payload = job.get("payload") or {}
-
-    with tempfile.NamedTemporaryFile(delete=False, suffix=Path(path).suffix or ".pdf") as f:
-        f.write(download_file(supabase, bucket, path))
-        file_path = f.name
+    file_path = None
 
     try:
-        # --- 1) Docling (with retries) ---
-        last_docling_error = None
-        for attempt in range(DOCLING_MAX_RETRIES + 1):
-            try:
-                markdown_text, docling_json = run_docling(file_path)
-                break
-            except Exception as e:
-                last_docling_error = e
-                logger.warning("Docling attempt %s failed: %s", attempt + 1, e)
-                if attempt < DOCLING_MAX_RETRIES:
-                    time.sleep(2)
-        else:
-            raise RuntimeError(f"Docling failed after {DOCLING_MAX_RETRIES + 1} attempts: {last_docling_error}")
-
-        supabase.table("legal_knowledge_base").update({
-            "docling_markdown": markdown_text,
-            "docling_json": docling_json,
-            "processing_status": "docling_complete",
-            "updated_at": datetime.now(tz=timezone.utc).isoformat(),
-        }).eq("id", entry_id).execute()
-
-        # --- 2) PageIndex tree ---
-        add_summary = PAGEINDEX_ADD_NODE_SUMMARY and bool(OPENAI_API_KEY)
-        tree_result = run_pageindex_from_markdown(markdown_text, add_summary=add_summary)
-        depth, count = tree_depth_and_count(tree_result)
-        pageindex_metadata = {
-            "tree_depth": depth,
-            "node_count": count,
-            "generated_at": datetime.now(tz=timezone.utc).isoformat(),
-        }
-
-        # --- 3) Existing row + LLM metadata extraction ---
-        existing = _get_existing_entry(supabase, entry_id) or {}
-        existing.update(payload)
-        docling_sections = None
-        if isinstance(docling_json, dict):
-            docling_sections = docling_json.get("export_format", {}).get("items") or docling_json.get("items")
-        extracted = extract_legal_metadata(
-            markdown_text,
-            existing=existing,
-            docling_sections_hint=docling_sections if isinstance(docling_sections, list) else None,
+        file_path, content_hash = fetch_document(supabase, bucket, job["storage_path"])
+        checkpoints = None
+        if STAGE_CHECKPOINTS:
+            checkpoints = load_checkpoints(supabase, "legal_knowledge_base", entry_id, content_hash)
+
+        # --- 1) Docling (with retries; skipped on a content-hash cache hit or a checkpoint) ---
+        markdown_text, docling_json = run_stage(
+            checkpoints, "docling", lambda: convert_document(file_path, content_hash=content_hash)
         )
+        if (DOCLING_CHECKPOINT or defer_extraction) and checkpoints is None:
+            save_docling_checkpoint(supabase, "legal_knowledge_base", entry_id, markdown_text, docling_json)
+
+        if defer_extraction and needs_stage(checkpoints, "extraction"):
+            # Left docling_complete for scripts.batch_extract, which requeues this job once extracted
+            supabase.table("legal_knowledge_base").update({
+                "processing_status": "docling_complete",
+                "updated_at": datetime.now(tz=timezone.utc).isoformat(),
+            }).eq("id", entry_id).execute()
+            writer.complete(KB_JOBS_TABLE, job_id)
+            logger.info("Job %s entry %s: Docling done; extraction deferred to bulk extraction", job_id, entry_id)
+            return
 
-        # --- 4) Citation parsing (eyecite from local repo) ---
-        cited_cases, cited_statutes = parse_citations(markdown_text)
-
-        # --- 5) Optional embedding ---
-        ai_embedding = None
-        if ENABLE_VECTOR_FALLBACK and OPENAI_API_KEY:
-            text_for_embedding = (extracted.get("summary") or markdown_text)[:MAX_TEXT_FOR_EMBEDDING]
-            ai_embedding = generate_embedding(text_for_embedding, max_chars=MAX_TEXT_FOR_EMBEDDING)
-
-        # --- 6) Optional Graphiti episode ---
-        add_episode_sync(
-            entry_id=entry_id,
-            document_type=extracted.get("document_type") or existing.get("document_type") or "legal_article",
-            jurisdiction=extracted.get("jurisdiction") or existing.get("jurisdiction") or "",
-            summary=extracted.get("summary"),
-            case_name=extracted.get("case_name") or existing.get("case_name"),
-            citations=cited_cases + cited_statutes,
-            decision_date=extracted.get("decision_date") or (str(existing.get("decision_date")) if existing.get("decision_date") else None),
-        )
+        # --- 2-6) PageIndex tree, LLM metadata, citations, optional embedding + Graphiti ---
+        update_payload = enrich_entry(supabase, job, entry_id, markdown_text, docling_json, content_hash, checkpoints)
 
         # --- 7) Final DB update ---
-        update_payload = {
-            "pageindex_tree": tree_result,
-            "pageindex_metadata": pageindex_metadata,
-            "processing_status": "completed",
-            "processing_pipeline": PIPELINE_NAME,
-            "ai_processed": True,
-            "full_text": markdown_text[:50000],
-            "cited_cases": cited_cases if cited_cases else None,
-            "cited_statutes": cited_statutes if cited_statutes else None,
-            "updated_at": datetime.now(tz=timezone.utc).isoformat(),
-        }
-        if extracted.get("title") and not (existing.get("title") or "").strip():
-            update_payload["title"] = extracted["title"]
-        if extracted.get("summary") is not None:
-            update_payload["summary"] = extracted["summary"]
-        if extracted.get("document_type") is not None and not (existing.get("document_type") or "").strip():
-            update_payload["document_type"] = extracted["document_type"]
-        if extracted.get("jurisdiction") is not None and not (existing.get("jurisdiction") or "").strip():
-            update_payload["jurisdiction"] = extracted["jurisdiction"]
-        if extracted.get("key_points") is not None:
-            update_payload["key_points"] = extracted["key_points"]
-        if extracted.get("legal_principles") is not None:
-            update_payload["legal_principles"] = extracted["legal_principles"]
-        if extracted.get("practice_areas") is not None:
-            update_payload["practice_areas"] = extracted["practice_areas"]
-        if extracted.get("keywords") is not None:
-            update_payload["keywords"] = extracted["keywords"]
-        if extracted.get("case_name") is not None:
-            update_payload["case_name"] = extracted["case_name"]
-        if extracted.get("case_citation") is not None:
-            update_payload["case_citation"] = extracted["case_citation"]
-        if extracted.get("court_name") is not None:
-            update_payload["court_name"] = extracted["court_name"]
-        if extracted.get("decision_date") is not None:
-            update_payload["decision_date"] = extracted["decision_date"]
-        if extracted.get("statute_name") is not None:
-            update_payload["statute_name"] = extracted["statute_name"]
-        if extracted.get("statute_number") is not None:
-            update_payload["statute_number"] = extracted["statute_number"]
-        if extracted.get("enactment_date") is not None:
-            update_payload["enactment_date"] = extracted["enactment_date"]
-        if extracted.get("effective_date") is not None:
-            update_payload["effective_date"] = extracted["effective_date"]
-        if ai_embedding is not None:
-            update_payload["ai_embedding"] = ai_embedding
-
-        supabase.table("legal_knowledge_base").update(update_payload).eq("id", entry_id).execute()
-
-        supabase.table("legal_kb_processing_jobs").update({
-            "status": "completed",
-            "processed_at": datetime.now(tz=timezone.utc).isoformat(),
-            "updated_at": datetime.now(tz=timezone.utc).isoformat(),
-        }).eq("id", job_id).execute()
+        finish_row(
+            supabase,
+            "legal_knowledge_base",
+            entry_id,
+            update_payload,
+            markdown_text,
+            docling_json,
+            DOCLING_CHECKPOINT,
+            checkpoints,
+        )
+        writer.complete(KB_JOBS_TABLE, job_id)
 
         logger.info("Completed job %s entry %s", job_id, entry_id)
     except Exception as e:
         err_msg = str(e)
         logger.exception("Job %s failed: %s", job_id, err_msg)
-        supabase.table("legal_kb_processing_jobs").update({
-            "status": "failed",
-            "last_error": err_msg[:5000],
-            "processed_at": datetime.now(tz=timezone.utc).isoformat(),
-            "updated_at": datetime.now(tz=timezone.utc).isoformat(),
-        }).eq("id", job_id).execute()
-        supabase.table("legal_knowledge_base").update({
-            "processing_status": "failed",
-        }).eq("id", entry_id).execute()
+        writer.fail(KB_JOBS_TABLE, job_id, entry_id, err_msg)
     finally:
-        Path(file_path).unlink(missing_ok=True)
+        if file_path:
+            Path(file_path).unlink(missing_ok=True)
+        if own_writer:
+            writer.flush()
 
 
 # --- Case document pipeline (Phase 4) ---
 
-CASE_DOC_PIPELINE = "docling_pageindex"
-
 
-def poll_one_case_doc_job(supabase):
-    """Fetch one queued case document job; mark as processing; return (job, document_id)."""
-    r = (
-        supabase.table("case_document_processing_jobs")
-        .select("id, document_id, case_id, organization_id, storage_bucket, storage_path, attempts")
-        .eq("status", "queued")
-        .eq("pipeline", CASE_DOC_PIPELINE)
-        .order("created_at", desc=False)
-        .limit(1)
-        .execute()
-    )
-    if not r.data or len(r.data) == 0:
-        return None, None
-    job = r.data[0]
-    job_id = job["id"]
-    document_id = job["document_id"]
-    supabase.table("case_document_processing_jobs").update({
-        "status": "processing",
-        "attempts": job.get("attempts", 0) + 1,
-        "updated_at": datetime.now(tz=timezone.utc).isoformat(),
-    }).eq("id", job_id).execute()
-    supabase.table("documents").update({
-        "processing_status": "processing",
-        "updated_at": datetime.now(tz=timezone.utc).isoformat(),
-    }).eq("id", document_id).execute()
-    return job, document_id
-
-
-def process_case_document_job(supabase, job: dict, document_id: str) -> None:
+def process_case_document_job(supabase, job: dict, document_id: str, writer: StatusWriter | None = None) -> None:
     """Run Docling + PageIndex on a case document; update documents row."""
-    bucket = job.get("storage_bucket") or "documents"
-    path = job["storage_path"]
+    own_writer = writer is None
+    writer = writer or StatusWriter(supabase)
+    bucket = job.get("storage_bucket") or CASE_DOC_BUCKET
     job_id = job["id"]
-    case_id = job.get("case_id")
-
-    with tempfile.NamedTemporaryFile(delete=False, suffix=Path(path).suffix or ".pdf") as f:
-        f.write(download_file(supabase, bucket, path))
-        file_path = f.name
+    file_path = None
 
     try:
-        markdown_text, docling_json = run_docling(file_path)
-        supabase.table("documents").update({
-            "docling_markdown": markdown_text,
-            "docling_json": docling_json,
-            "processing_status": "docling_complete",
-            "updated_at": datetime.now(tz=timezone.utc).isoformat(),
-        }).eq("id", document_id).execute()
-
-        add_summary = PAGEINDEX_ADD_NODE_SUMMARY and bool(OPENAI_API_KEY)
-        tree_result = run_pageindex_from_markdown(markdown_text, add_summary=add_summary)
-        depth, count = tree_depth_and_count(tree_result)
-        pageindex_metadata = {
-            "tree_depth": depth,
-            "node_count": count,
-            "generated_at": datetime.now(tz=timezone.utc).isoformat(),
-        }
-
-        supabase.table("documents").update({
-            "pageindex_tree": tree_result,
-            "pageindex_metadata": pageindex_metadata,
-            "processing_status": "completed",
-            "processing_pipeline": CASE_DOC_PIPELINE,
-            "ai_processed": True,
-            "updated_at": datetime.now(tz=timezone.utc).isoformat(),
-        }).eq("id", document_id).execute()
-
-        if case_id and ENABLE_GRAPHITI:
-            try:
-                from .graphiti_client import get_graphiti_client
-                client = get_graphiti_client()
-                if client:
-                    episode_body = (
-                        f"Case document document_id={document_id} case_id={case_id}. "
-                        f"Content summary (first 500 chars): {markdown_text[:500]}"
-                    )
-                    asyncio.run(
-                        client.add_episode(
-                            name=f"case_document_{document_id}",
-                            episode_body=episode_body,
-                            source_description="Case document",
-                            reference_time=datetime.now(timezone.utc),
-                            group_id=GRAPHITI_DATABASE or None,
-                        )
-                    )
-            except Exception as e:
-                logger.warning("Graphiti case document episode failed: %s", e)
-
-        supabase.table("case_document_processing_jobs").update({
-            "status": "completed",
-            "processed_at": datetime.now(tz=timezone.utc).isoformat(),
-            "updated_at": datetime.now(tz=timezone.utc).isoformat(),
-        }).eq("id", job_id).execute()
+        file_path, content_hash = fetch_document(supabase, bucket, job["storage_path"])
+        checkpoints = load_checkpoints(supabase, "documents", document_id, content_hash) if STAGE_CHECKPOINTS else None
+        markdown_text, docling_json = run_stage(
+            checkpoints, "docling", lambda: convert_document(file_path, max_retries=0, content_hash=content_hash)
+        )
+        if DOCLING_CHECKPOINT and checkpoints is None:
+            save_docling_checkpoint(supabase, "documents", document_id, markdown_text, docling_json)
+
+        update_payload = enrich_case_document(job, document_id, markdown_text, content_hash, checkpoints, docling_json)
+        finish_row(
+            supabase, "documents", document_id, update_payload, markdown_text, docling_json, DOCLING_CHECKPOINT, checkpoints
+        )
+
+        writer.complete(CASE_DOC_JOBS_TABLE, job_id)
         logger.info("Case document job %s document %s completed", job_id, document_id)
     except Exception as e:
         err_msg = str(e)
         logger.exception("Case document job %s failed: %s", job_id, err_msg)
-        supabase.table("case_document_processing_jobs").update({
-            "status": "failed",
-            "last_error": err_msg[:5000],
-            "processed_at": datetime.now(tz=timezone.utc).isoformat(),
-            "updated_at": datetime.now(tz=timezone.utc).isoformat(),
-        }).eq("id", job_id).execute()
-        supabase.table("documents").update({
-            "processing_status": "failed",
-            "updated_at": datetime.now(tz=timezone.utc).isoformat(),
-        }).eq("id", document_id).execute()
+        writer.fail(CASE_DOC_JOBS_TABLE, job_id, document_id, err_msg)
     finally:
-        Path(file_path).unlink(missing_ok=True)
+        if file_path:
+            Path(file_path).unlink(missing_ok=True)
+        if own_writer:
+            writer.flush()
+
+
+def run_worker(
+    once: bool,
+    interval: float,
+    drain: bool,
+    min_interval: float,
+    preload_docling: bool = False,
+    docling_split_workers: int = DOCLING_SPLIT_WORKERS,
+    defer_extraction: bool = False,
+) -> None:
+    """
+    Poll both queues in this process; each worker process owns its own Supabase client
+    and Docling converter (optionally warmed up before the first job).
+    Jobs are claimed one at a time, so queued work stays available to the other worker
+    processes and replicas. With defer_extraction, KB jobs stop after Docling (bulk mode).
+    While jobs keep coming the loop claims the next one
+    immediately; only when both queues are empty (or a poll fails) does it sleep,
+    backing off exponentially from min_interval to interval. Large PDFs are split across at
+    most docling_split_workers processes.
+    """
+    supabase = get_supabase()
+    limit_split_workers(docling_split_workers)
+    if preload_docling:
+        warm_up_converter()
+
+    writer = StatusWriter(supabase)
+
+    def do_one_cycle() -> bool:
+        try:
+            jobs = poll_jobs(supabase, limit=1)
+            if jobs:
+                process_job(supabase, jobs[0], jobs[0]["entry_id"], writer, defer_extraction)
+                return True
+            cjobs = poll_case_doc_jobs(supabase, limit=1)
+            if cjobs:
+                process_case_document_job(supabase, cjobs[0], cjobs[0]["document_id"], writer)
+                return True
+            return False
+        finally:
+            writer.flush()
+
+    delay = min_interval
+    while True:
+        try:
+            worked = do_one_cycle()
+        except Exception as e:
+            # A failed poll (e.g. a transient Supabase error) is retried; jobs record their own failures
+            logger.exception("Polling failed: %s", e)
+            if once:
+                return
+            time.sleep(delay)
+            delay = min(delay * 2, interval)
+            continue
+        if once:
+            return
+        if worked:
+            delay = min_interval
+            continue
+        if drain:
+            logger.info("Queues drained; exiting")
+            return
+        time.sleep(delay)
+        delay = min(delay * 2, interval)
 
 
 def main():
     parser = argparse.ArgumentParser(description="Legal KB + case document processor (Docling + PageIndex)")
     parser.add_argument("--once", action="store_true", help="Process one job (either queue) and exit")
-    parser.add_argument("--interval", type=int, default=60, help="Poll interval in seconds (default 60)")
+    parser.add_argument("--drain", action="store_true", help="Process jobs until both queues are empty, then exit")
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=60,
+        help="Maximum idle poll interval in seconds when both queues are empty (default 60)",
+    )
+    parser.add_argument(
+        "--min-interval",
+        type=float,
+        default=POLL_MIN_INTERVAL,
+        help="First idle poll interval; doubles up to --interval (default LEGAL_KB_POLL_MIN_INTERVAL or 1)",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=CLAIM_BATCH_SIZE,
+        help="With --pipelined: max jobs claimed per round trip, bounded by free download-queue room "
+        "(default LEGAL_KB_CLAIM_BATCH_SIZE or 5); other workers claim one job at a time",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=WORKER_CONCURRENCY,
+        help="Worker processes running jobs in parallel (default LEGAL_KB_WORKER_CONCURRENCY or 1); "
+        "with --pipelined, the size of the Docling/eyecite process pool",
+    )
+    parser.add_argument(
+        "--pipelined",
+        action="store_true",
+        help="Run stages concurrently across jobs (CPU stages in a process pool, I/O stages async)",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=PIPELINE_QUEUE_SIZE,
+        help="With --pipelined: bound of each inter-stage queue (default LEGAL_KB_PIPELINE_QUEUE_SIZE or 4)",
+    )
+    parser.add_argument(
+        "--preload-docling",
+        action=argparse.BooleanOptionalAction,
+        default=DOCLING_PRELOAD,
+        help="Load Docling models at worker startup instead of on the first document (default LEGAL_KB_DOCLING_PRELOAD)",
+    )
+    parser.add_argument(
+        "--defer-extraction",
+        action=argparse.BooleanOptionalAction,
+        default=DEFER_EXTRACTION,
+        help="Bulk mode: stop KB jobs after Docling; scripts.batch_extract extracts and requeues them "
+        "(default LEGAL_KB_DEFER_EXTRACTION)",
+    )
     args = parser.parse_args()
 
-    supabase = get_supabase()
-
-    def do_one_cycle():
-        job, entry_id = poll_one_job(supabase)
-        if job and entry_id:
-            process_job(supabase, job, entry_id)
-            return
-        cjob, doc_id = poll_one_case_doc_job(supabase)
-        if cjob and doc_id:
-            process_case_document_job(supabase, cjob, doc_id)
+    if args.defer_extraction:
+        if args.pipelined:
+            parser.error("--defer-extraction runs with the sequential worker, not --pipelined")
+        if not STAGE_CHECKPOINTS:
+            logger.error("--defer-extraction needs LEGAL_KB_STAGE_CHECKPOINTS=yes so requeued jobs resume")
+            sys.exit(1)
+
+    if args.pipelined:
+        from .engine import run_pipelined
+
+        cpu_workers = max(1, args.concurrency)
+        run_pipelined(
+            get_supabase(),
+            once=args.once,
+            drain=args.drain,
+            interval=args.interval,
+            min_interval=min(args.min_interval, args.interval),
+            batch_size=args.batch_size,
+            cpu_workers=cpu_workers,
+            io_workers=max(2, cpu_workers * 2),
+            queue_size=args.queue_size,
+            preload_docling=args.preload_docling,
+        )
+        return
 
-    if args.once:
-        do_one_cycle()
+    worker_args = (
+        args.once,
+        args.interval,
+        args.drain,
+        min(args.min_interval, args.interval),
+        args.preload_docling,
+        # Worker processes share the split conversion processes, so Docling model copies stay bounded
+        max(1, DOCLING_SPLIT_WORKERS // max(1, args.concurrency)),
+        args.defer_extraction,
+    )
+    if args.concurrency <= 1:
+        run_worker(*worker_args)
         return
 
-    while True:
-        do_one_cycle()
-        time.sleep(args.interval)
+    procs = [
+        multiprocessing.Process(
+            target=run_worker,
+            args=worker_args,
+            name=f"legal-kb-worker-{i}",
+        )
+        for i in range(args.concurrency)
+    ]
+    for p in procs:
+        p.start()
+    logger.info("Started %d worker processes", len(procs))
+    try:
+        for p in procs:
+            p.join()
+    except KeyboardInterrupt:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.join()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,169 @@
+"""
+Where each PageIndex node sits in docling_markdown.
+Trees are built without node text, so ingest records every node's span instead: char and
+UTF-8 byte offsets (own text: heading up to the next node; subtree: through its last
+descendant), the Docling page range and token counts. They are stored in
+pageindex_metadata["node_spans"] keyed by node_id, so a node's section is a slice of the
+markdown and retrieval can budget tokens without tokenizing again.
+"""
+import re
+from typing import Any, Iterator
+
+from .context import count_tokens
+
+_HEADER_LABELS = ("section_header", "title")
+_NON_WORD_RE = re.compile(r"\W+")
+# Docling headers skipped before a node's heading is assumed missing from the JSON
+_MATCH_LOOKAHEAD = 5
+
+
+def _preorder(structure: Any) -> Iterator[tuple[dict, list[dict]]]:
+    """(node, its children) in document order."""
+    nodes = structure if isinstance(structure, list) else [structure] if isinstance(structure, dict) else []
+    for node in nodes:
+        if not isinstance(node, dict):
+            continue
+        children = node.get("nodes") or []
+        yield node, children
+        yield from _preorder(children)
+
+
+def _line_offsets(markdown: str) -> list[int]:
+    """Char offset of each line, split on "\\n" as PageIndex numbers them (index 0 is line 1)."""
+    offsets = [0]
+    for line in markdown.split("\n")[:-1]:
+        offsets.append(offsets[-1] + len(line) + 1)
+    return offsets
+
+
+def _byte_offsets(markdown: str, char_offsets: set[int]) -> dict[int, int]:
+    """UTF-8 byte offset of each char offset, in one pass."""
+    byte_offsets: dict[int, int] = {}
+    prev_char = prev_byte = 0
+    for offset in sorted(char_offsets):
+        prev_byte += len(markdown[prev_char:offset].encode("utf-8"))
+        prev_char = offset
+        byte_offsets[offset] = prev_byte
+    return byte_offsets
+
+
+def _normalize_title(title: Any) -> str:
+    return _NON_WORD_RE.sub(" ", str(title or "").replace("\\", "")).strip().casefold()
+
+
+def _docling_items(docling_json: dict) -> Iterator[dict]:
+    """Docling text/table/picture items in reading order (body tree; the texts list without one)."""
+    body = docling_json.get("body")
+    if not isinstance(body, dict):
+        yield from (item for item in docling_json.get("texts") or [] if isinstance(item, dict))
+        return
+
+    def resolve(ref: str) -> dict | None:
+        parts = ref.lstrip("#/").split("/")
+        if len(parts) != 2 or not parts[1].isdigit():
+            return None
+        items = docling_json.get(parts[0]) or []
+        index = int(parts[1])
+        return items[index] if index < len(items) and isinstance(items[index], dict) else None
+
+    seen: set[str] = set()
+    stack = list(reversed(body.get("children") or []))
+    while stack:
+        child = stack.pop()
+        ref = child.get("$ref") if isinstance(child, dict) else None
+        if not isinstance(ref, str) or ref in seen:
+            continue
+        seen.add(ref)
+        item = resolve(ref)
+        if item is None:
+            continue
+        yield item
+        stack.extend(reversed(item.get("children") or []))
+
+
+def _page_ranges(docling_json: Any, nodes: list[dict]) -> list[tuple[int, int] | None]:
+    """
+    Page range of each node's own text (nodes in document order): Docling items are walked in
+    reading order, section headers matched to node titles in turn, and every item's pages
+    credited to the node it falls under.
+    """
+    ranges: list[tuple[int, int] | None] = [None] * len(nodes)
+    if not isinstance(docling_json, dict) or not nodes:
+        return ranges
+    titles = [_normalize_title(node.get("title")) for node in nodes]
+    current = -1
+    for item in _docling_items(docling_json):
+        if item.get("label") in _HEADER_LABELS:
+            text = _normalize_title(item.get("text"))
+            for i in range(current + 1, min(current + 1 + _MATCH_LOOKAHEAD, len(nodes))):
+                if titles[i] == text:
+                    current = i
+                    break
+        if current < 0:
+            continue
+        pages = [p["page_no"] for p in item.get("prov") or [] if isinstance(p, dict) and isinstance(p.get("page_no"), int)]
+        if pages:
+            low, high = ranges[current] or (min(pages), max(pages))
+            ranges[current] = (min(low, *pages), max(high, *pages))
+    return ranges
+
+
+def node_spans(markdown: str, tree: Any, docling_json: Any = None) -> dict[str, dict[str, Any]]:
+    """
+    node_id -> {line, char_start, char_end, subtree_char_end, byte_start, byte_end,
+    subtree_byte_end, page_start, page_end, subtree_page_end, tokens, subtree_tokens}. Nodes
+    without node_id or line_num are skipped; pages are None without Docling JSON (or when a
+    node's heading is not found in it).
+    """
+    structure = tree.get("structure", tree) if isinstance(tree, dict) else tree
+    line_offsets = _line_offsets(markdown)
+    placed: list[tuple[dict, list[dict]]] = [
+        (node, children)
+        for node, children in _preorder(structure)
+        if node.get("node_id") is not None and isinstance(node.get("line_num"), int)
+        and 1 <= node["line_num"] <= len(line_offsets)
+    ]
+    placed.sort(key=lambda pair: pair[0]["line_num"])
+    if not placed:
+        return {}
+
+    starts = [line_offsets[node["line_num"] - 1] for node, _ in placed]
+    ends = starts[1:] + [len(markdown)]
+    index_of = {id(node): i for i, (node, _) in enumerate(placed)}
+    tokens = [count_tokens(markdown[start:end]) for start, end in zip(starts, ends)]
+    pages = _page_ranges(docling_json, [node for node, _ in placed])
+
+    def last_descendant(i: int) -> int:
+        children = [index_of[id(child)] for child in placed[i][1] if id(child) in index_of]
+        return last_descendant(max(children)) if children else i
+
+    subtree_ends = [last_descendant(i) for i in range(len(placed))]
+    byte_offsets = _byte_offsets(markdown, set(starts) | set(ends))
+    spans: dict[str, dict[str, Any]] = {}
+    for i, (node, _) in enumerate(placed):
+        last = subtree_ends[i]
+        page_range = pages[i]
+        subtree_pages = [p[1] for p in pages[i:last + 1] if p is not None]
+        spans[str(node["node_id"])] = {
+            "line": node["line_num"],
+            "char_start": starts[i],
+            "char_end": ends[i],
+            "subtree_char_end": ends[last],
+            "byte_start": byte_offsets[starts[i]],
+            "byte_end": byte_offsets[ends[i]],
+            "subtree_byte_end": byte_offsets[ends[last]],
+            "page_start": page_range[0] if page_range else None,
+            "page_end": page_range[1] if page_range else None,
+            "subtree_page_end": max(subtree_pages) if subtree_pages else None,
+            "tokens": tokens[i],
+            "subtree_tokens": sum(tokens[i:last + 1]),
+        }
+    return spans
+
+
+def node_text(markdown: str, spans: dict[str, dict[str, Any]], node_id: str, subtree: bool = True) -> str | None:
+    """A node's section of the markdown (with its descendants unless subtree=False), or None if unknown."""
+    span = spans.get(str(node_id))
+    if span is None:
+        return None
+    return markdown[span["char_start"]:span["subtree_char_end"] if subtree else span["char_end"]]
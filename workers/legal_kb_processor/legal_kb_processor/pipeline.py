@@ -3,13 +3,56 @@ Docling + PageIndex pipeline: convert document to markdown/JSON, then build Page
 Docling is pip-installed; PageIndex is used from local repo at PAGEINDEX_ROOT.
 """
 import asyncio
+import inspect
+import logging
+import math
+import multiprocessing
 import sys
 import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
 from pathlib import Path
 
-from docling.document_converter import DocumentConverter
+from docling.datamodel.base_models import DocumentStream, InputFormat
+from docling.datamodel.pipeline_options import AcceleratorOptions, PdfPipelineOptions, TableFormerMode
+from docling.document_converter import DocumentConverter, PdfFormatOption
 
-from .config import PAGEINDEX_ROOT
+from .clients import get_openai_client, run_sync
+from .config import (
+    DOCLING_DO_OCR,
+    DOCLING_DO_TABLE_STRUCTURE,
+    DOCLING_NUM_THREADS,
+    DOCLING_SPLIT_THRESHOLD_PAGES,
+    DOCLING_SPLIT_WORKERS,
+    DOCLING_TABLE_MODE,
+    LLM_MODEL,
+    PAGEINDEX_ROOT,
+)
+from .context import count_tokens
+from .llm_cache import get_llm_cache
+from .rate_limiter import rate_limited_call_async
+
+logger = logging.getLogger(__name__)
+_converter: DocumentConverter | None = None
+_split_pool: ProcessPoolExecutor | None = None
+# Page ranges (and processes) per split conversion in this process; see limit_split_workers
+_split_workers = DOCLING_SPLIT_WORKERS
+# Prompt overhead + summary length reserved per node summary request
+_SUMMARY_TOKENS_ESTIMATE = 300
+# md_to_tree's steps, called directly so trees are built from a string
+_MD_TREE_STEPS = (
+    "extract_nodes_from_markdown",
+    "extract_node_text_content",
+    "build_tree_from_nodes",
+    "write_node_id",
+    "format_structure",
+    "generate_summaries_for_structure_md",
+)
+_NODE_FIELDS = ["title", "node_id", "line_num", "summary", "prefix_summary", "nodes"]
+_NODE_FIELDS_WITH_TEXT = ["title", "node_id", "line_num", "summary", "prefix_summary", "text", "nodes"]
+# Nodes shorter than this (tokens) are their own summary; PageIndex's get_node_summary default
+_SUMMARY_TOKEN_THRESHOLD = 200
 
 
 def _add_pageindex_path() -> None:
@@ -18,12 +61,184 @@ def _add_pageindex_path() -> None:
         sys.path.insert(0, str(PAGEINDEX_ROOT))
 
 
+def _pdf_pipeline_options() -> PdfPipelineOptions:
+    """PDF pipeline options from LEGAL_KB_DOCLING_* config."""
+    options = PdfPipelineOptions()
+    options.do_ocr = DOCLING_DO_OCR
+    options.do_table_structure = DOCLING_DO_TABLE_STRUCTURE
+    options.table_structure_options.mode = (
+        TableFormerMode.FAST if DOCLING_TABLE_MODE == "fast" else TableFormerMode.ACCURATE
+    )
+    if DOCLING_NUM_THREADS > 0:
+        options.accelerator_options = AcceleratorOptions(num_threads=DOCLING_NUM_THREADS)
+    return options
+
+
+def get_converter() -> DocumentConverter:
+    """
+    Lazy-init the process-wide Docling converter. Layout/table models load once per
+    worker process and are reused for every document (and every retry).
+    """
+    global _converter
+    if _converter is None:
+        _converter = DocumentConverter(
+            format_options={InputFormat.PDF: PdfFormatOption(pipeline_options=_pdf_pipeline_options())}
+        )
+    return _converter
+
+
+def _blank_pdf() -> DocumentStream:
+    """A one-page blank PDF (via pypdfium2, a Docling dependency) to warm up the converter with."""
+    import pypdfium2 as pdfium
+
+    pdf = pdfium.PdfDocument.new()
+    try:
+        pdf.new_page(612, 792)
+        buffer = BytesIO()
+        pdf.save(buffer)
+    finally:
+        pdf.close()
+    buffer.seek(0)
+    return DocumentStream(name="warm-up.pdf", stream=buffer)
+
+
+def warm_up_converter() -> None:
+    """Build the converter and load the PDF pipeline models now rather than on the first document."""
+    started = time.monotonic()
+    converter = get_converter()
+    try:
+        if hasattr(converter, "initialize_pipeline"):
+            converter.initialize_pipeline(InputFormat.PDF)
+        else:
+            # Older docling 2.x releases load the models on the first conversion
+            converter.convert(_blank_pdf())
+    except Exception as e:
+        logger.warning("Docling warm-up failed (models load on the first document): %s", e)
+        return
+    logger.info("Docling converter warmed up in %.1fs", time.monotonic() - started)
+
+
+def pdf_page_count(file_path: str) -> int:
+    """Page count of a PDF via pypdfium2 (a Docling dependency); 0 if not a readable PDF."""
+    if Path(file_path).suffix.lower() != ".pdf":
+        return 0
+    try:
+        import pypdfium2 as pdfium
+
+        pdf = pdfium.PdfDocument(file_path)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+    except Exception as e:
+        logger.debug("Could not count pages of %s: %s", file_path, e)
+        return 0
+
+
+def limit_split_workers(workers: int) -> None:
+    """
+    Cap the processes this process uses for a split conversion (1 disables splitting). Worker
+    processes that already convert documents in parallel call it, so Docling model copies do
+    not multiply with --concurrency.
+    """
+    global _split_workers
+    _split_workers = max(1, min(_split_workers, workers))
+
+
+def _can_split() -> str | None:
+    """Why this docling cannot convert page ranges and merge them, or None if it can."""
+    try:
+        from docling_core.types.doc import DoclingDocument
+    except ImportError:
+        return "docling-core is not importable"
+    if not hasattr(DoclingDocument, "concatenate"):
+        return "docling-core has no DoclingDocument.concatenate"
+    if "page_range" not in inspect.signature(DocumentConverter.convert).parameters:
+        return "DocumentConverter.convert takes no page_range"
+    return None
+
+
+def _convert_page_range(file_path: str, start: int, end: int) -> dict:
+    """Split-pool task: convert pages start..end (1-based, inclusive); return the document dict."""
+    result = get_converter().convert(file_path, page_range=(start, end))
+    return result.document.export_to_dict()
+
+
+def _get_split_pool() -> ProcessPoolExecutor:
+    """Process pool for page-range conversion; each child keeps its own warm converter."""
+    global _split_pool
+    if _split_pool is None:
+        _split_pool = ProcessPoolExecutor(
+            max_workers=_split_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _split_pool
+
+
+def page_ranges(page_count: int, parts: int) -> list[tuple[int, int]]:
+    """Split 1..page_count into at most `parts` contiguous, inclusive page ranges."""
+    size = max(1, math.ceil(page_count / max(1, parts)))
+    return [(start, min(start + size - 1, page_count)) for start in range(1, page_count + 1, size)]
+
+
+def _page_numbers(doc) -> set[int]:
+    """Page numbers a Docling document's pages and item provenance refer to."""
+    pages = set(doc.pages)
+    for item, _ in doc.iterate_items():
+        pages.update(prov.page_no for prov in getattr(item, "prov", None) or [])
+    return pages
+
+
+def run_docling_split(file_path: str, page_count: int) -> tuple[str, dict] | None:
+    """
+    Convert a large PDF as page ranges in parallel processes, then merge into one document.
+    Markdown is exported once from the merged document, so headings match a single pass.
+    PageIndex node page spans rely on the original page numbers, so each range must keep them
+    and the merge must not renumber; returns None (convert in one pass) if either does.
+    """
+    from docling_core.types.doc import DoclingDocument
+
+    ranges = page_ranges(page_count, _split_workers)
+    started = time.monotonic()
+    pool = _get_split_pool()
+    futures = [pool.submit(_convert_page_range, file_path, start, end) for start, end in ranges]
+    parts = [DoclingDocument.model_validate(f.result()) for f in futures]
+    part_pages = [_page_numbers(part) for part in parts]
+    for (start, end), pages in zip(ranges, part_pages):
+        if not pages <= set(range(start, end + 1)):
+            logger.warning("Docling renumbered pages %d-%d of a page_range conversion", start, end)
+            return None
+    doc = DoclingDocument.concatenate(parts)
+    if _page_numbers(doc) != set().union(*part_pages):
+        logger.warning("DoclingDocument.concatenate did not keep the original page numbers")
+        return None
+    logger.info(
+        "Docling converted %d pages as %d parallel ranges in %.1fs",
+        page_count, len(ranges), time.monotonic() - started,
+    )
+    return doc.export_to_markdown(), doc.export_to_dict()
+
+
 def run_docling(file_path: str) -> tuple[str, dict]:
     """
     Run Docling on a file; return (markdown_text, structured_dict).
+    PDFs with at least DOCLING_SPLIT_THRESHOLD_PAGES pages are converted as parallel page ranges
+    when this docling supports it (and page numbers survive the merge); otherwise in one pass.
     Requires: pip install docling
     """
-    converter = DocumentConverter()
+    if DOCLING_SPLIT_THRESHOLD_PAGES > 0 and _split_workers > 1:
+        page_count = pdf_page_count(file_path)
+        if page_count >= DOCLING_SPLIT_THRESHOLD_PAGES:
+            unsupported = _can_split()
+            if unsupported:
+                logger.warning("%s; converting %d pages in one pass", unsupported, page_count)
+            else:
+                split = run_docling_split(file_path, page_count)
+                if split is not None:
+                    return split
+                logger.warning("Converting %d pages in one pass instead", page_count)
+
+    converter = get_converter()
     result = converter.convert(file_path)
     doc = result.document
     markdown_text = doc.export_to_markdown()
@@ -31,57 +246,149 @@ def run_docling(file_path: str) -> tuple[str, dict]:
     return markdown_text, structured
 
 
-def run_pageindex_from_markdown(markdown_text: str, add_summary: bool = False) -> dict:
+async def _pageindex_chat(model, prompt, api_key=None):
+    """
+    Stand-in for PageIndex's ChatGPT_API_async in node summaries: one request on the pooled client.
+    PageIndex's own loop retries every error, so a 429 would never reach the rate limiter.
+    """
+    response = await asyncio.to_thread(
+        get_openai_client().chat.completions.create,
+        model=model,
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0,
+    )
+    return response.choices[0].message.content
+
+
+def _wrap_node_summaries(page_index_md) -> None:
     """
-    Build PageIndex tree from markdown string.
-    Uses pageindex.page_index_md.md_to_tree (async); runs in event loop.
+    Route PageIndex node summaries through the LLM response cache and the shared rate limiter,
+    so a 429 backs the model off and is retried (wraps generate_node_summary once).
     """
+    original = getattr(page_index_md, "generate_node_summary", None)
+    if original is None or getattr(original, "_llm_wrapped", False):
+        return
+    if "ChatGPT_API_async" in getattr(original, "__globals__", {}):
+        original.__globals__["ChatGPT_API_async"] = _pageindex_chat
+
+    async def generate_node_summary(node, *args, **kwargs):
+        cache = get_llm_cache()
+        prompt = (node.get("text") or "") if isinstance(node, dict) else ""
+        # The model pageindex_tree passes PageIndex, so cache keys and rate-limit buckets follow it
+        model = kwargs.get("model") or (args[0] if args else None) or LLM_MODEL
+        if cache is not None and prompt:
+            cached = cache.get(model, 0, prompt, extra="pageindex_node_summary")
+            if cached is not None:
+                return cached
+        summary = await rate_limited_call_async(
+            model, count_tokens(prompt) + _SUMMARY_TOKENS_ESTIMATE, lambda: original(node, *args, **kwargs)
+        )
+        if cache is not None and prompt and isinstance(summary, str):
+            cache.put(model, 0, prompt, summary, extra="pageindex_node_summary")
+        return summary
+
+    generate_node_summary._llm_wrapped = True
+    page_index_md.generate_node_summary = generate_node_summary
+
+
+def _page_index_md(add_summary: bool):
+    """pageindex.page_index_md, with node summaries wrapped when they are generated."""
     _add_pageindex_path()
-    from pageindex.page_index_md import md_to_tree
-
-    with tempfile.NamedTemporaryFile(
-        mode="w",
-        suffix=".md",
-        delete=False,
-        encoding="utf-8",
-    ) as f:
+    from pageindex import page_index_md
+
+    if add_summary:
+        _wrap_node_summaries(page_index_md)
+    return page_index_md
+
+
+def _md_to_tree_default(page_index_md, name: str):
+    """Default of one of md_to_tree's keyword arguments (None if it has no such argument)."""
+    param = inspect.signature(page_index_md.md_to_tree).parameters.get(name)
+    return None if param is None or param.default is inspect.Parameter.empty else param.default
+
+
+def _summary_token_threshold(page_index_md) -> int:
+    # md_to_tree defaults it to None, which get_node_summary cannot compare against
+    return _md_to_tree_default(page_index_md, "summary_token_threshold") or _SUMMARY_TOKEN_THRESHOLD
+
+
+async def _md_to_tree_via_file(page_index_md, markdown_text: str, add_summary: bool, model: str) -> dict:
+    """md_to_tree through a temp file, for PageIndex versions without the step helpers."""
+    with tempfile.NamedTemporaryFile(mode="w", suffix=".md", delete=False, encoding="utf-8") as f:
         f.write(markdown_text)
         md_path = f.name
-
     try:
-        tree_result = asyncio.run(
-            md_to_tree(
-                md_path,
-                if_thinning=False,
-                if_add_node_summary="yes" if add_summary else "no",
-                if_add_doc_description="no",
-                if_add_node_text="no",
-                if_add_node_id="yes",
-            )
+        return await page_index_md.md_to_tree(
+            md_path,
+            if_thinning=False,
+            if_add_node_summary="yes" if add_summary else "no",
+            summary_token_threshold=_summary_token_threshold(page_index_md),
+            model=model,
+            if_add_doc_description="no",
+            if_add_node_text="no",
+            if_add_node_id="yes",
         )
-        return tree_result
     finally:
         Path(md_path).unlink(missing_ok=True)
 
 
-def tree_depth_and_count(tree: dict) -> tuple[int, int]:
-    """Compute depth and node count of PageIndex tree (structure list)."""
-    structure = tree.get("structure", tree) if isinstance(tree, dict) else tree
-    if not structure:
-        return 0, 0
-
-    def visit(nodes: list, depth: int) -> tuple[int, int]:
-        if not nodes:
-            return depth, 0
-        count = 0
-        max_d = depth
-        for node in nodes:
-            count += 1
-            children = node.get("nodes") or []
-            sub_d, sub_c = visit(children, depth + 1)
-            count += sub_c
-            max_d = max(max_d, sub_d)
-        return max_d, count
-
-    max_depth, total = visit(structure if isinstance(structure, list) else [structure], 1)
-    return max_depth, total
+async def pageindex_tree(
+    markdown_text: str,
+    add_summary: bool = False,
+    doc_name: str = "document",
+    model: str = LLM_MODEL,
+) -> dict:
+    """
+    Build PageIndex tree from markdown string on the running event loop.
+    Runs md_to_tree's steps on the string (no thinning, node ids, no node text or doc
+    description); falls back to md_to_tree on a temp file if this PageIndex lacks them.
+    Node summaries are generated with model.
+    """
+    page_index_md = _page_index_md(add_summary)
+    if not all(hasattr(page_index_md, name) for name in _MD_TREE_STEPS):
+        return await _md_to_tree_via_file(page_index_md, markdown_text, add_summary, model)
+
+    node_list, markdown_lines = page_index_md.extract_nodes_from_markdown(markdown_text)
+    nodes = page_index_md.extract_node_text_content(node_list, markdown_lines)
+    structure = page_index_md.build_tree_from_nodes(nodes)
+    page_index_md.write_node_id(structure)
+    if add_summary:
+        # Summaries need node text; it is dropped again below
+        structure = page_index_md.format_structure(structure, order=_NODE_FIELDS_WITH_TEXT)
+        structure = await page_index_md.generate_summaries_for_structure_md(
+            structure,
+            summary_token_threshold=_summary_token_threshold(page_index_md),
+            model=model,
+        )
+    structure = page_index_md.format_structure(structure, order=_NODE_FIELDS)
+    return {"doc_name": doc_name, "line_count": markdown_text.count("\n") + 1, "structure": structure}
+
+
+async def pageindex_trees(
+    markdown_texts: list[str],
+    add_summary: bool = False,
+    concurrency: int = 4,
+) -> list[dict | BaseException]:
+    """Trees for many documents, at most concurrency at a time; a failed document's entry is its exception."""
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def build(markdown_text: str) -> dict:
+        async with semaphore:
+            return await pageindex_tree(markdown_text, add_summary)
+
+    return await asyncio.gather(*(build(text) for text in markdown_texts), return_exceptions=True)
+
+
+def run_pageindex_from_markdown(markdown_text: str, add_summary: bool = False) -> dict:
+    """Build PageIndex tree from markdown string; runs on the worker event loop."""
+    return run_sync(pageindex_tree(markdown_text, add_summary))
+
+
+def run_pageindex_batch(
+    markdown_texts: list[str],
+    add_summary: bool = False,
+    concurrency: int = 4,
+) -> list[dict | BaseException]:
+    """pageindex_trees on the worker event loop (stages.build_trees, for re-runs)."""
+    return run_sync(pageindex_trees(list(markdown_texts), add_summary, concurrency))
+
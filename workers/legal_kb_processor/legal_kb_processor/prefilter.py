@@ -0,0 +1,235 @@
+"""
+Lexical prefilter for reasoning search.
+A local SQLite FTS5 index (BM25) holds one row per PageIndex node (title, summary) and one per
+entry (title, summary, keywords, legal principles), tagged with the entry's organization. Each
+job replaces its entry's rows; scripts/prefilter_index.py rebuilds the index from
+legal_knowledge_base. search() returns the top-K entries for a query, with their best matching
+nodes, so LLM tree search only walks a shortlist. The file is shared by the worker processes
+on a host (WAL mode) but not across hosts: it is single-host only, off unless
+LEGAL_KB_PREFILTER_INDEX=yes, and useless to a search service running elsewhere.
+"""
+import logging
+import os
+import re
+import sqlite3
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Iterable
+
+from .config import ENABLE_PREFILTER_INDEX, PREFILTER_INDEX_PATH
+
+logger = logging.getLogger(__name__)
+
+_prefilter_index: Any = None
+_prefilter_index_pid: int | None = None
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS prefilter_rows (
+    rowid INTEGER PRIMARY KEY,
+    entry_id TEXT NOT NULL,
+    organization_id TEXT NOT NULL,
+    node_id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS prefilter_rows_entry ON prefilter_rows (entry_id);
+CREATE INDEX IF NOT EXISTS prefilter_rows_organization ON prefilter_rows (organization_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS prefilter_fts USING fts5(
+    title, summary, terms, tokenize = 'porter unicode61 remove_diacritics 2'
+);
+"""
+# bm25() column weights: title, summary, terms (keywords / legal principles)
+_WEIGHTS = (3.0, 1.0, 2.0)
+# Shared entries (no organization) are stored under this id
+_SHARED = ""
+# An entry's score sums its best rows, so one stray node match does not outrank a focused document
+_SCORE_ROWS = 3
+_CANDIDATE_ROWS_PER_HIT = 20
+_TERM_RE = re.compile(r"\w+")
+
+
+@dataclass
+class PrefilterHit:
+    """An entry on the shortlist: BM25 score (higher is better) and its best matching node ids."""
+
+    entry_id: str
+    score: float
+    node_ids: list[str] = field(default_factory=list)
+
+
+def _nodes(structure: Any) -> Iterable[dict]:
+    stack = list(reversed(structure if isinstance(structure, list) else [structure]))
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            yield node
+            stack.extend(reversed(node.get("nodes") or []))
+
+
+def _text(values: Any) -> str:
+    if isinstance(values, (list, tuple)):
+        return "\n".join(str(v) for v in values if v)
+    return str(values or "")
+
+
+def entry_rows(entry: dict[str, Any], tree: Any) -> list[tuple[str, str, str, str]]:
+    """(node_id, title, summary, terms) rows for an entry: its own row (node_id "") and one per tree node."""
+    rows = [(
+        "",
+        _text(entry.get("title")),
+        _text(entry.get("summary")),
+        "\n".join(_text(entry.get(f)) for f in ("keywords", "legal_principles")).strip(),
+    )]
+    structure = tree.get("structure", tree) if isinstance(tree, dict) else tree
+    for node in _nodes(structure or []):
+        if node.get("node_id") is None:
+            continue
+        summary = node.get("summary") or node.get("prefix_summary")
+        rows.append((str(node["node_id"]), _text(node.get("title")), _text(summary), ""))
+    return rows
+
+
+def match_query(query: str) -> str:
+    """FTS5 query matching any of the query's words (quoted, so user input is never FTS syntax)."""
+    terms = dict.fromkeys(t.casefold() for t in _TERM_RE.findall(query or ""))
+    return " OR ".join(f'"{t}"' for t in terms)
+
+
+class PrefilterIndex:
+    """SQLite FTS5 index of entries and their nodes. Methods are thread-safe."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(path), timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def _delete_locked(self, entry_id: str) -> None:
+        rowids = [(r[0],) for r in self._conn.execute(
+            "SELECT rowid FROM prefilter_rows WHERE entry_id = ?", (entry_id,)
+        )]
+        self._conn.executemany("DELETE FROM prefilter_fts WHERE rowid = ?", rowids)
+        self._conn.execute("DELETE FROM prefilter_rows WHERE entry_id = ?", (entry_id,))
+
+    def update_entry(self, entry_id: str, organization_id: str | None, entry: dict[str, Any], tree: Any) -> int:
+        """Replace an entry's rows (entry: title, summary, keywords, legal_principles); returns the row count."""
+        rows = entry_rows(entry, tree)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._delete_locked(str(entry_id))
+                for node_id, title, summary, terms in rows:
+                    rowid = self._conn.execute(
+                        "INSERT INTO prefilter_rows (entry_id, organization_id, node_id) VALUES (?, ?, ?)",
+                        (str(entry_id), str(organization_id or _SHARED), node_id),
+                    ).lastrowid
+                    self._conn.execute(
+                        "INSERT INTO prefilter_fts (rowid, title, summary, terms) VALUES (?, ?, ?, ?)",
+                        (rowid, title, summary, terms),
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return len(rows)
+
+    def remove_entry(self, entry_id: str) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._delete_locked(str(entry_id))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def clear(self, organization_id: str | None = None) -> None:
+        """Drop every row, or only one organization's."""
+        with self._lock:
+            if organization_id is None:
+                self._conn.execute("DELETE FROM prefilter_fts")
+                self._conn.execute("DELETE FROM prefilter_rows")
+                return
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "DELETE FROM prefilter_fts WHERE rowid IN "
+                    "(SELECT rowid FROM prefilter_rows WHERE organization_id = ?)",
+                    (str(organization_id),),
+                )
+                self._conn.execute("DELETE FROM prefilter_rows WHERE organization_id = ?", (str(organization_id),))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def search(
+        self,
+        query: str,
+        organization_id: str | None = None,
+        top_k: int = 20,
+        nodes_per_entry: int = 5,
+    ) -> list[PrefilterHit]:
+        """
+        Top-K entries of organization_id (and shared entries; without it, shared entries only)
+        for query, best first, each with up to nodes_per_entry matching node ids.
+        """
+        match = match_query(query)
+        if not match or top_k <= 0:
+            return []
+        scope = (_SHARED,) if not organization_id else (_SHARED, str(organization_id))
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT r.entry_id, r.node_id, bm25(prefilter_fts, ?, ?, ?) AS rank "
+                "FROM prefilter_fts JOIN prefilter_rows r ON r.rowid = prefilter_fts.rowid "
+                f"WHERE prefilter_fts MATCH ? AND r.organization_id IN ({', '.join('?' * len(scope))}) "
+                "ORDER BY rank LIMIT ?",
+                (*_WEIGHTS, match, *scope, top_k * _CANDIDATE_ROWS_PER_HIT),
+            ).fetchall()
+        hits: dict[str, PrefilterHit] = {}
+        counted: dict[str, int] = {}
+        for entry_id, node_id, rank in rows:
+            hit = hits.setdefault(entry_id, PrefilterHit(entry_id, 0.0))
+            if counted.get(entry_id, 0) < _SCORE_ROWS:
+                # bm25() is lower for better matches
+                hit.score -= rank
+                counted[entry_id] = counted.get(entry_id, 0) + 1
+            if node_id and len(hit.node_ids) < nodes_per_entry:
+                hit.node_ids.append(node_id)
+        return sorted(hits.values(), key=lambda h: h.score, reverse=True)[:top_k]
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            entries, rows = self._conn.execute(
+                "SELECT COUNT(DISTINCT entry_id), COUNT(*) FROM prefilter_rows"
+            ).fetchone()
+            return {"entries": entries, "rows": rows}
+
+    def optimize(self) -> None:
+        """Merge the FTS index segments (after a rebuild or many updates)."""
+        with self._lock:
+            self._conn.execute("INSERT INTO prefilter_fts (prefilter_fts) VALUES ('optimize')")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def get_prefilter_index() -> PrefilterIndex | None:
+    """Lazy-init the process-wide prefilter index (reopened after fork). Returns None if disabled or unusable."""
+    global _prefilter_index, _prefilter_index_pid
+    if not ENABLE_PREFILTER_INDEX:
+        return None
+    if _prefilter_index is not None and _prefilter_index_pid == os.getpid():
+        return _prefilter_index
+    try:
+        _prefilter_index = PrefilterIndex(Path(PREFILTER_INDEX_PATH))
+    except (OSError, sqlite3.Error) as e:
+        # sqlite3.OperationalError "no such module: fts5" when SQLite was built without FTS5
+        logger.warning("Prefilter index init failed: %s", e)
+        _prefilter_index = None
+        return None
+    _prefilter_index_pid = os.getpid()
+    return _prefilter_index
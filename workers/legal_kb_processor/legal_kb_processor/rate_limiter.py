@@ -0,0 +1,277 @@
+"""
+Host-wide rate limiting for OpenAI calls.
+A token bucket per model (requests/min and tokens/min) lives in a small SQLite file, so every
+worker process on the host draws from the same quota. A 429 halves the model's effective rate
+and blocks it until Retry-After has passed; each success then restores 5% of the rate
+(AIMD), so throughput settles just under the quota instead of oscillating through failures.
+"""
+import asyncio
+import email.utils
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable, TypeVar
+
+from .config import (
+    ENABLE_RATE_LIMITER,
+    RATE_LIMIT_DEFAULT_RPM,
+    RATE_LIMIT_DEFAULT_TPM,
+    RATE_LIMIT_MAX_429_RETRIES,
+    RATE_LIMIT_PATH,
+    RATE_LIMITS,
+)
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_MIN_SCALE = 0.1
+_RECOVERY_STEP = 0.05
+_MAX_SLEEP = 5.0
+_limiter: Any = None
+_limiter_pid: int | None = None
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rate_buckets (
+    model TEXT PRIMARY KEY,
+    requests REAL NOT NULL,
+    tokens REAL NOT NULL,
+    scale REAL NOT NULL,
+    blocked_until REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+def limits_for(model: str) -> tuple[int, int]:
+    """(requests/min, tokens/min) for model: LEGAL_KB_RATE_LIMITS entry or the defaults."""
+    return RATE_LIMITS.get(model, (RATE_LIMIT_DEFAULT_RPM, RATE_LIMIT_DEFAULT_TPM))
+
+
+class RateLimiter:
+    """
+    Token buckets in SQLite (WAL, BEGIN IMMEDIATE per update) shared by processes on the host.
+    reserve() either takes capacity or says how long to wait; callers sleep outside the lock.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(path), timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+    def _update(self, model: str, fn: Callable[[dict, float, int, int], float]) -> float:
+        """Run fn(bucket, now, rpm, tpm) on the refilled bucket in one write transaction; return its result."""
+        rpm, tpm = limits_for(model)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = self._conn.execute(
+                    "SELECT requests, tokens, scale, blocked_until, updated_at FROM rate_buckets WHERE model = ?",
+                    (model,),
+                ).fetchone()
+                if row is None:
+                    bucket = {"requests": float(rpm), "tokens": float(tpm), "scale": 1.0, "blocked_until": 0.0}
+                else:
+                    requests, tokens, scale, blocked_until, updated_at = row
+                    elapsed = max(0.0, now - updated_at)
+                    bucket = {
+                        "requests": min(rpm, requests + elapsed * rpm * scale / 60),
+                        "tokens": min(tpm, tokens + elapsed * tpm * scale / 60),
+                        "scale": scale,
+                        "blocked_until": blocked_until,
+                    }
+                result = fn(bucket, now, rpm, tpm)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO rate_buckets (model, requests, tokens, scale, blocked_until, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (model, bucket["requests"], bucket["tokens"], bucket["scale"], bucket["blocked_until"], now),
+                )
+                self._conn.execute("COMMIT")
+                return result
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def reserve(self, model: str, tokens: int) -> float:
+        """Take one request and `tokens` from model's bucket; return 0, or the seconds to wait before asking again."""
+
+        def take(bucket: dict, now: float, rpm: int, tpm: int) -> float:
+            if bucket["blocked_until"] > now:
+                return bucket["blocked_until"] - now
+            need = min(tokens, tpm)  # a request larger than the whole quota waits for a full bucket
+            if bucket["requests"] >= 1 and bucket["tokens"] >= need:
+                bucket["requests"] -= 1
+                bucket["tokens"] -= need
+                return 0.0
+            rate = bucket["scale"] / 60
+            wait_requests = (1 - bucket["requests"]) / (rpm * rate) if bucket["requests"] < 1 else 0.0
+            wait_tokens = (need - bucket["tokens"]) / (tpm * rate) if bucket["tokens"] < need else 0.0
+            return max(wait_requests, wait_tokens, 0.01)
+
+        return self._update(model, take)
+
+    def settle(self, model: str, estimated: int, actual: int) -> None:
+        """Correct the bucket with the real token usage and count a success towards full rate."""
+
+        def fix(bucket: dict, now: float, rpm: int, tpm: int) -> float:
+            bucket["tokens"] = min(tpm, bucket["tokens"] + estimated - actual)
+            bucket["scale"] = min(1.0, bucket["scale"] + _RECOVERY_STEP)
+            return 0.0
+
+        self._update(model, fix)
+
+    def throttled(self, model: str, retry_after: float | None) -> float:
+        """Record a 429: halve the rate and block the model until Retry-After (or a backoff); return the wait."""
+
+        def back_off(bucket: dict, now: float, rpm: int, tpm: int) -> float:
+            bucket["scale"] = max(_MIN_SCALE, bucket["scale"] / 2)
+            wait = retry_after if retry_after is not None else 60 / (rpm * bucket["scale"]) + random.uniform(0, 1)
+            bucket["blocked_until"] = max(bucket["blocked_until"], now + wait)
+            bucket["requests"] = min(bucket["requests"], 0.0)
+            return bucket["blocked_until"] - now
+
+        wait = self._update(model, back_off)
+        logger.warning("Rate limited on %s; backing off %.1fs", model, wait)
+        return wait
+
+
+def get_rate_limiter() -> RateLimiter | None:
+    """Lazy-init the process-wide limiter (reopened after fork). Returns None if disabled or unusable."""
+    global _limiter, _limiter_pid
+    if not ENABLE_RATE_LIMITER:
+        return None
+    if _limiter is not None and _limiter_pid == os.getpid():
+        return _limiter
+    try:
+        _limiter = RateLimiter(Path(RATE_LIMIT_PATH))
+    except (OSError, sqlite3.Error) as e:
+        logger.warning("Rate limiter init failed: %s", e)
+        _limiter = None
+        return None
+    _limiter_pid = os.getpid()
+    return _limiter
+
+
+def _sleep_time(wait: float) -> float:
+    # Wake a little early and spread processes apart; the bucket is re-checked anyway
+    return min(wait, _MAX_SLEEP) * random.uniform(0.8, 1.0)
+
+
+def acquire(model: str, tokens: int) -> None:
+    """Block until model's bucket grants one request of about `tokens` tokens."""
+    limiter = get_rate_limiter()
+    if limiter is None:
+        return
+    while (wait := limiter.reserve(model, tokens)) > 0:
+        time.sleep(_sleep_time(wait))
+
+
+async def acquire_async(model: str, tokens: int) -> None:
+    """
+    acquire() for coroutines on the worker event loop: the SQLite reservation (which can wait on
+    other processes' locks) runs on a thread and waits use asyncio.sleep, so the loop never blocks.
+    """
+    limiter = get_rate_limiter()
+    if limiter is None:
+        return
+    while (wait := await asyncio.to_thread(limiter.reserve, model, tokens)) > 0:
+        await asyncio.sleep(_sleep_time(wait))
+
+
+def retry_after(error: Exception) -> float | None:
+    """Seconds from a 429's Retry-After / retry-after-ms headers, if present."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                parsed = email.utils.parsedate_to_datetime(value)
+                return max(0.0, parsed.timestamp() - time.time())
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def _is_rate_limit(error: Exception) -> bool:
+    return getattr(error, "status_code", None) == 429 or type(error).__name__ == "RateLimitError"
+
+
+def _is_transient(error: Exception) -> bool:
+    status = getattr(error, "status_code", None)
+    return (status is not None and status >= 500) or type(error).__name__ in ("APIConnectionError", "APITimeoutError")
+
+
+def rate_limited_call(model: str, tokens: int, fn: Callable[[], T], usage_tokens: Callable[[T], int] | None = None) -> T:
+    """
+    Call fn() once the shared bucket allows it. A 429 backs the model off for every process
+    (honouring Retry-After) and fn is retried, as are connection errors and 5xx responses (the
+    OpenAI client's own retries are off while the limiter is on), up to RATE_LIMIT_MAX_429_RETRIES
+    times; other errors propagate. usage_tokens(result) reports real usage to correct the estimate.
+    """
+    limiter = get_rate_limiter()
+    if limiter is None:
+        return fn()
+    attempt = 0
+    while True:
+        acquire(model, tokens)
+        try:
+            result = fn()
+        except Exception as e:
+            if attempt >= RATE_LIMIT_MAX_429_RETRIES or not (_is_rate_limit(e) or _is_transient(e)):
+                raise
+            attempt += 1
+            if _is_rate_limit(e):
+                time.sleep(limiter.throttled(model, retry_after(e)))
+            else:
+                logger.warning("Transient OpenAI error on %s (%s); retrying", model, e)
+                time.sleep(min(2 ** attempt, 30) * random.uniform(0.5, 1.0))
+            continue
+        actual = tokens
+        if usage_tokens is not None:
+            try:
+                actual = usage_tokens(result) or tokens
+            except Exception:
+                pass
+        limiter.settle(model, tokens, actual)
+        return result
+
+
+async def rate_limited_call_async(model: str, tokens: int, fn: Callable[[], Awaitable[T]]) -> T:
+    """
+    rate_limited_call() for coroutines on the worker event loop: await fn() once the bucket allows
+    it, backing the model off on a 429 and retrying 429s and transient errors the same way; limiter
+    updates run on a thread and waits use asyncio.sleep.
+    """
+    limiter = get_rate_limiter()
+    if limiter is None:
+        return await fn()
+    attempt = 0
+    while True:
+        await acquire_async(model, tokens)
+        try:
+            result = await fn()
+        except Exception as e:
+            if attempt >= RATE_LIMIT_MAX_429_RETRIES or not (_is_rate_limit(e) or _is_transient(e)):
+                raise
+            attempt += 1
+            if _is_rate_limit(e):
+                await asyncio.sleep(await asyncio.to_thread(limiter.throttled, model, retry_after(e)))
+            else:
+                logger.warning("Transient OpenAI error on %s (%s); retrying", model, e)
+                await asyncio.sleep(min(2 ** attempt, 30) * random.uniform(0.5, 1.0))
+            continue
+        await asyncio.to_thread(limiter.settle, model, tokens, tokens)
+        return result
@@ -0,0 +1,179 @@
+"""
+Re-run chosen stages over existing Legal KB entries (e.g. re-extract metadata for every statute
+with another model). Inputs come from the row: Docling output, the PageIndex tree and citations
+from their columns, extraction output from its checkpoint (or, for entries processed before
+checkpoints, the metadata columns). Re-run stages bypass the result cache and are recorded as
+checkpoints; stages downstream of them keep their previous output unless re-run as well. Re-running
+extraction or citations refreshes the entry's citation index rows, and re-running the tree or
+extraction its prefilter index rows. rerun_entries builds the trees of a group of entries together.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Iterable, Iterator
+
+from .checkpoints import STAGE_INPUTS, STAGES, StageCheckpoints, load_checkpoints
+from .citations import parse_citations
+from .extraction import merge_extracted
+from .stages import (
+    add_entry_episode,
+    build_tree,
+    build_trees,
+    embed_entry,
+    embed_sections,
+    extract_metadata,
+    extracted_fields,
+    get_existing_entry,
+    index_entry_citations,
+    index_entry_nodes,
+    save_section_chunks,
+    user_fields,
+)
+
+logger = logging.getLogger(__name__)
+
+# Docling needs the original file: requeue the entry's job to redo it
+RERUN_STAGES = tuple(stage for stage in STAGES if stage != "docling")
+
+
+def select_entry_ids(
+    supabase,
+    filters: dict[str, str],
+    entry_ids: Iterable[str] = (),
+    limit: int = 0,
+    page_size: int = 500,
+) -> Iterator[str]:
+    """Ids of entries with Docling output matching filters (column -> value) and, if given, entry_ids."""
+    entry_ids = list(entry_ids)
+    start = 0
+    returned = 0
+    while True:
+        query = supabase.table("legal_knowledge_base").select("id").not_.is_("docling_markdown", "null")
+        for column, value in filters.items():
+            query = query.eq(column, value)
+        if entry_ids:
+            query = query.in_("id", entry_ids)
+        rows = query.order("id").range(start, start + page_size - 1).execute().data or []
+        for row in rows:
+            yield str(row["id"])
+            returned += 1
+            if limit and returned >= limit:
+                return
+        if len(rows) < page_size:
+            return
+        start += page_size
+
+
+def load_entry(supabase, entry_id: str, stages: Iterable[str]) -> tuple[StageCheckpoints, str, Any]:
+    """(checkpoints, docling markdown, docling JSON) of an entry, with the inputs of stages loaded."""
+    stages = set(stages)
+    inputs = {"docling"} | {dep for stage in stages for dep in STAGE_INPUTS.get(stage, ())}
+    checkpoints = load_checkpoints(supabase, "legal_knowledge_base", entry_id, redo=stages, restore=inputs)
+    if checkpoints is None:
+        raise RuntimeError("could not read the entry's checkpoints")
+    markdown_text, docling_json = checkpoints.restore("docling")
+    if not markdown_text:
+        raise ValueError("no Docling output; requeue the entry's job instead")
+    return checkpoints, markdown_text, docling_json
+
+
+def rerun_entry(
+    supabase,
+    entry_id: str,
+    stages: Iterable[str],
+    loaded: tuple[StageCheckpoints, str, Any] | None = None,
+    tree: tuple[dict, dict] | None = None,
+) -> None:
+    """
+    Re-run stages (in pipeline order) for one entry from its stored inputs (loaded by load_entry,
+    if not given). A tree built beforehand (build_trees) is recorded instead of building one.
+    """
+    stages = set(stages)
+    checkpoints, markdown_text, docling_json = loaded or load_entry(supabase, entry_id, stages)
+    existing = get_existing_entry(supabase, entry_id) or {}
+    update = {}
+
+    if "tree" in stages and tree is not None:
+        checkpoints.record("tree", tree)
+        tree_result = tree[0]
+    elif "tree" in stages:
+        tree_result, _ = checkpoints.run("tree", lambda: build_tree(markdown_text, docling_json=docling_json))
+    else:
+        tree_result, _ = checkpoints.restore("tree")
+
+    if "extraction" in stages:
+        # Merged against user-provided fields only: the previous extraction's values are replaced
+        extracted = extract_metadata(markdown_text, docling_json, user_fields(existing), checkpoints=checkpoints)
+        update.update(extracted_fields(existing, extracted))
+    else:
+        data = checkpoints.restore("extraction")
+        extracted = merge_extracted(data, existing) if data is not None else existing
+
+    if "citations" in stages:
+        cited_cases, cited_statutes = checkpoints.run("citations", lambda: parse_citations(markdown_text))
+    else:
+        cited_cases, cited_statutes = checkpoints.restore("citations")
+
+    if stages & {"tree", "extraction", "citations"}:
+        r = supabase.table("legal_knowledge_base").select("organization_id").eq("id", entry_id).limit(1).execute()
+        organization_id = (r.data or [{}])[0].get("organization_id")
+        if stages & {"extraction", "citations"}:
+            index_entry_citations(supabase, entry_id, organization_id, existing, extracted, cited_cases, cited_statutes)
+        if stages & {"tree", "extraction"}:
+            index_entry_nodes(entry_id, organization_id, existing, extracted, tree_result)
+
+    if "embedding" in stages:
+        checkpoints.run("embedding", lambda: embed_entry(markdown_text, extracted), lambda v: v is not None)
+    if "sections" in stages:
+        checkpoints.run(
+            "sections", lambda: save_section_chunks(supabase, entry_id, embed_sections(markdown_text), tree_result)
+        )
+    if "graphiti" in stages:
+        checkpoints.run(
+            "graphiti", lambda: add_entry_episode(entry_id, existing, extracted, cited_cases + cited_statutes), bool
+        )
+
+    if update:
+        update["updated_at"] = datetime.now(tz=timezone.utc).isoformat()
+        supabase.table("legal_knowledge_base").update(update).eq("id", entry_id).execute()
+    logger.info("Entry %s: re-ran %s", entry_id, ", ".join(s for s in RERUN_STAGES if s in stages))
+
+
+def rerun_entries(
+    supabase,
+    entry_ids: Iterable[str],
+    stages: Iterable[str],
+    workers: int = 4,
+) -> Iterator[tuple[str, Exception | None]]:
+    """
+    Re-run stages for entries, `workers` at a time; yields (entry_id, error or None) as each
+    group finishes. When the tree is re-run, a group's trees are built together (build_trees).
+    """
+    stages = set(stages)
+    entry_ids = list(entry_ids)
+    workers = max(1, workers)
+
+    def attempt(fn, *args) -> Any:
+        try:
+            return fn(*args)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for start in range(0, len(entry_ids), workers):
+            group = entry_ids[start:start + workers]
+            loaded = list(pool.map(lambda entry_id: attempt(load_entry, supabase, entry_id, stages), group))
+            trees: list[Any] = [None] * len(group)
+            if "tree" in stages:
+                ready = [i for i, item in enumerate(loaded) if not isinstance(item, Exception)]
+                built = build_trees([loaded[i][1] for i in ready], [loaded[i][2] for i in ready], workers)
+                for i, tree in zip(ready, built):
+                    trees[i] = tree
+
+            def finish(i: int) -> Exception | None:
+                for prepared in (loaded[i], trees[i]):
+                    if isinstance(prepared, BaseException):
+                        return prepared if isinstance(prepared, Exception) else RuntimeError(str(prepared))
+                return attempt(rerun_entry, supabase, group[i], stages, loaded[i], trees[i])
+
+            yield from zip(group, pool.map(finish, range(len(group))))
@@ -0,0 +1,108 @@
+"""
+Section boundaries of Docling markdown.
+Docling emits section headers as ATX headings ("## ..."), which is also what PageIndex
+md_to_tree builds its nodes from, so splitting here lines up with the tree's nodes.
+"""
+import re
+from dataclasses import dataclass
+
+_HEADING_RE = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$")
+_FENCE_RE = re.compile(r"^\s*(```|~~~)")
+_PARAGRAPH_BREAK_RE = re.compile(r"\n\s*\n")
+
+
+@dataclass
+class Section:
+    """A heading and its body: markdown[start:end]. level 0 is text before the first heading."""
+
+    title: str
+    level: int
+    start: int
+    end: int
+    line_num: int  # 1-based line of the heading (as in PageIndex nodes)
+
+
+def split_sections(markdown: str) -> list[Section]:
+    """Split markdown at ATX headings (ignoring fenced code); sections cover the whole text in order."""
+    sections: list[Section] = []
+    in_fence = False
+    offset = 0
+    current = Section("", 0, 0, 0, 1)
+    for line_num, line in enumerate(markdown.splitlines(keepends=True), 1):
+        stripped = line.rstrip("\r\n")
+        if _FENCE_RE.match(stripped):
+            in_fence = not in_fence
+        elif not in_fence:
+            m = _HEADING_RE.match(stripped)
+            if m:
+                current.end = offset
+                if current.end > current.start:
+                    sections.append(current)
+                current = Section(m.group(2).strip(), len(m.group(1)), offset, offset, line_num)
+        offset += len(line)
+    current.end = len(markdown)
+    if current.end > current.start or not sections:
+        sections.append(current)
+    return sections
+
+
+def _split_long(text: str, max_chars: int) -> list[str]:
+    """Split one oversized section at paragraph breaks (hard cut only for a single huge paragraph)."""
+    pieces: list[str] = []
+    buf = ""
+    for para in _PARAGRAPH_BREAK_RE.split(text):
+        while len(para) > max_chars:
+            if buf:
+                pieces.append(buf)
+                buf = ""
+            pieces.append(para[:max_chars])
+            para = para[max_chars:]
+        if buf and len(buf) + len(para) + 2 > max_chars:
+            pieces.append(buf)
+            buf = ""
+        buf = f"{buf}\n\n{para}" if buf else para
+    if buf.strip():
+        pieces.append(buf)
+    return pieces
+
+
+def chunk_markdown(markdown: str, max_chars: int) -> list[str]:
+    """
+    Pack consecutive sections into chunks of at most max_chars, cutting only at section
+    boundaries; a section longer than max_chars is split at paragraph breaks.
+    """
+    if len(markdown) <= max_chars:
+        return [markdown] if markdown.strip() else []
+    chunks: list[str] = []
+    buf = ""
+    for section in split_sections(markdown):
+        text = markdown[section.start:section.end]
+        if len(text) > max_chars:
+            if buf.strip():
+                chunks.append(buf)
+            buf = ""
+            chunks.extend(_split_long(text, max_chars))
+            continue
+        if len(buf) + len(text) > max_chars:
+            if buf.strip():
+                chunks.append(buf)
+            buf = ""
+        buf += text
+    if buf.strip():
+        chunks.append(buf)
+    return chunks
+
+
+def section_texts(markdown: str, max_chars: int) -> list[tuple[Section, str]]:
+    """
+    (section, text) per section in document order, skipping blank ones; a section longer than
+    max_chars yields several pieces (split at paragraph breaks) that share its Section.
+    """
+    out: list[tuple[Section, str]] = []
+    for section in split_sections(markdown):
+        text = markdown[section.start:section.end].strip()
+        if not text:
+            continue
+        pieces = [text] if len(text) <= max_chars else _split_long(text, max_chars)
+        out.extend((section, piece.strip()) for piece in pieces if piece.strip())
+    return out
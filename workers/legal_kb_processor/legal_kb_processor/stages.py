@@ -0,0 +1,551 @@
+"""
+Pipeline stages shared by the sequential worker (main.process_job) and the pipelined engine.
+Each stage is a plain function over the previous stage's output so it can run inline,
+in a thread, or in a process pool (convert_document, parse_citations).
+"""
+import asyncio
+import logging
+import tempfile
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any
+
+from .artifacts import store_artifacts
+from .cache import file_sha256, get_result_cache, text_sha256
+from .checkpoints import StageCheckpoints, needs_stage, run_stage
+from .citation_index import update_entry_index
+from .citations import parse_citations
+from .config import (
+    CASE_DOC_PIPELINE,
+    DOCLING_MAX_RETRIES,
+    ENABLE_GRAPHITI,
+    EMBED_SECTIONS,
+    EMBEDDING_CHUNK_CHARS,
+    EMBEDDING_CHUNK_TABLE,
+    ENABLE_VECTOR_FALLBACK,
+    ENRICH_WORKERS,
+    MAX_TEXT_FOR_EMBEDDING,
+    OPENAI_API_KEY,
+    PAGEINDEX_ADD_NODE_SUMMARY,
+    PIPELINE_NAME,
+    STREAM_DOWNLOADS,
+)
+from .embeddings import generate_embedding, generate_embeddings
+from .extraction import merge_extracted, request_legal_metadata
+from .flat_tree import FlatTree
+from .graphiti_client import add_case_document_episode_sync, add_citation_edges_sync, add_episode_sync
+from .node_spans import node_spans
+from .pipeline import pageindex_tree, run_docling, run_pageindex_batch, run_pageindex_from_markdown
+from .prefilter import get_prefilter_index
+from .sections import section_texts
+from .storage import stream_download
+
+logger = logging.getLogger(__name__)
+_enrich_pool: ThreadPoolExecutor | None = None
+
+# Extracted fields copied to the row only when the existing row has no value
+_FILL_IF_EMPTY_FIELDS = ("title", "document_type", "jurisdiction")
+# Extracted fields copied to the row whenever extraction produced a value
+_OVERWRITE_FIELDS = (
+    "summary",
+    "key_points",
+    "legal_principles",
+    "practice_areas",
+    "keywords",
+    "case_name",
+    "case_citation",
+    "court_name",
+    "decision_date",
+    "statute_name",
+    "statute_number",
+    "enactment_date",
+    "effective_date",
+)
+
+
+def download_file(supabase, bucket: str, path: str) -> bytes:
+    return supabase.storage.from_(bucket).download(path)
+
+
+def fetch_document(supabase, bucket: str, path: str) -> tuple[str, str]:
+    """Download a storage object to a temp file; return (path, sha256 of its bytes). Caller unlinks it."""
+    with tempfile.NamedTemporaryFile(delete=False, suffix=Path(path).suffix or ".pdf") as f:
+        file_path = f.name
+        try:
+            if STREAM_DOWNLOADS:
+                return file_path, stream_download(bucket, path, f)
+            f.write(download_file(supabase, bucket, path))
+        except BaseException:
+            f.close()
+            Path(file_path).unlink(missing_ok=True)
+            raise
+    return file_path, file_sha256(file_path)
+
+
+def _cached(stage: str, content_hash: str | None) -> Any | None:
+    cache = get_result_cache() if content_hash else None
+    return cache.get(content_hash, stage) if cache else None
+
+
+def _store(stage: str, content_hash: str | None, value: Any) -> None:
+    cache = get_result_cache() if content_hash else None
+    if cache:
+        cache.put(content_hash, stage, value)
+
+
+def convert_document(
+    file_path: str,
+    max_retries: int = DOCLING_MAX_RETRIES,
+    content_hash: str | None = None,
+) -> tuple[str, dict]:
+    """Run Docling with retries; return (markdown_text, docling_json). Safe to run in a worker process."""
+    cached = _cached("docling", content_hash)
+    if cached is not None:
+        return cached[0], cached[1]
+    last_error = None
+    for attempt in range(max_retries + 1):
+        try:
+            markdown_text, docling_json = run_docling(file_path)
+            _store("docling", content_hash, [markdown_text, docling_json])
+            return markdown_text, docling_json
+        except Exception as e:
+            last_error = e
+            logger.warning("Docling attempt %s failed: %s", attempt + 1, e)
+            if attempt < max_retries:
+                time.sleep(2)
+    raise RuntimeError(f"Docling failed after {max_retries + 1} attempts: {last_error}")
+
+
+def docling_fields(markdown_text: str, docling_json: Any) -> dict[str, Any]:
+    """Row columns holding Docling output (legal_knowledge_base and documents)."""
+    return {"docling_markdown": markdown_text, "docling_json": docling_json}
+
+
+def save_docling_checkpoint(supabase, table: str, row_id: str, markdown_text: str, docling_json: Any) -> None:
+    """Persist Docling output and mark the row docling_complete (legal_knowledge_base or documents)."""
+    supabase.table(table).update({
+        **store_artifacts(supabase, docling_fields(markdown_text, docling_json)),
+        "processing_status": "docling_complete",
+        "updated_at": datetime.now(tz=timezone.utc).isoformat(),
+    }).eq("id", row_id).execute()
+
+
+def finish_row(
+    supabase,
+    table: str,
+    row_id: str,
+    update_payload: dict[str, Any],
+    markdown_text: str,
+    docling_json: Any,
+    checkpointed: bool,
+    checkpoints: StageCheckpoints | None = None,
+) -> None:
+    """Final row update; carries the Docling output and stage outputs unless a checkpoint already wrote them."""
+    if not checkpointed:
+        update_payload = {**docling_fields(markdown_text, docling_json), **update_payload}
+    if checkpoints is not None:
+        update_payload = checkpoints.unsaved(update_payload)
+    supabase.table(table).update(store_artifacts(supabase, update_payload)).eq("id", row_id).execute()
+
+
+def _tree_metadata(markdown_text: str, tree_result: dict, docling_json: Any) -> dict:
+    spans = node_spans(markdown_text, tree_result, docling_json)
+    flat = FlatTree.from_tree(tree_result, spans)
+    return {
+        # Counts the leaves' empty child level, matching the tree_depth of existing rows
+        "tree_depth": flat.max_depth() + 1 if len(flat) else 0,
+        "node_count": len(flat),
+        "node_spans": spans,
+        "flat_tree": flat.flat,
+        "generated_at": datetime.now(tz=timezone.utc).isoformat(),
+    }
+
+
+def build_tree(markdown_text: str, content_hash: str | None = None, docling_json: Any = None) -> tuple[dict, dict]:
+    """
+    Build the PageIndex tree; return (tree, pageindex_metadata). The metadata maps each node to
+    its span of markdown_text (pages from docling_json, when given).
+    """
+    tree_result = _cached("tree", content_hash)
+    if tree_result is None:
+        add_summary = PAGEINDEX_ADD_NODE_SUMMARY and bool(OPENAI_API_KEY)
+        tree_result = run_pageindex_from_markdown(markdown_text, add_summary=add_summary)
+        _store("tree", content_hash, tree_result)
+    return tree_result, _tree_metadata(markdown_text, tree_result, docling_json)
+
+
+async def build_tree_async(
+    markdown_text: str,
+    content_hash: str | None = None,
+    docling_json: Any = None,
+) -> tuple[dict, dict]:
+    """build_tree on the caller's event loop (pipelined engine)."""
+    tree_result = await asyncio.to_thread(_cached, "tree", content_hash)
+    if tree_result is None:
+        add_summary = PAGEINDEX_ADD_NODE_SUMMARY and bool(OPENAI_API_KEY)
+        tree_result = await pageindex_tree(markdown_text, add_summary=add_summary)
+        await asyncio.to_thread(_store, "tree", content_hash, tree_result)
+    return tree_result, await asyncio.to_thread(_tree_metadata, markdown_text, tree_result, docling_json)
+
+
+def build_trees(
+    markdown_texts: list[str],
+    docling_jsons: list[Any] | None = None,
+    concurrency: int = 4,
+) -> list[tuple[dict, dict] | BaseException]:
+    """
+    build_tree for many documents (re-running the tree stage), at most concurrency PageIndex
+    builds at a time on the worker event loop; bypasses the result cache. A failed document's
+    entry is its exception.
+    """
+    add_summary = PAGEINDEX_ADD_NODE_SUMMARY and bool(OPENAI_API_KEY)
+    trees = run_pageindex_batch(markdown_texts, add_summary=add_summary, concurrency=concurrency)
+    docling_jsons = docling_jsons or [None] * len(markdown_texts)
+    results: list[tuple[dict, dict] | BaseException] = []
+    for markdown_text, docling_json, tree_result in zip(markdown_texts, docling_jsons, trees):
+        if isinstance(tree_result, BaseException):
+            results.append(tree_result)
+            continue
+        try:
+            results.append((tree_result, _tree_metadata(markdown_text, tree_result, docling_json)))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+def get_existing_entry(supabase, entry_id: str) -> dict | None:
+    r = supabase.table("legal_knowledge_base").select(
+        "title, summary, document_type, jurisdiction, case_name, case_citation, court_name, "
+        "decision_date, statute_name, statute_number, practice_areas, keywords, key_points, legal_principles"
+    ).eq("id", entry_id).single().execute()
+    if r.data:
+        return r.data
+    return None
+
+
+def docling_sections(docling_json: Any) -> list[dict] | None:
+    """Section items from Docling's structured export (hint for extraction), or None."""
+    if not isinstance(docling_json, dict):
+        return None
+    sections = docling_json.get("export_format", {}).get("items") or docling_json.get("items")
+    return sections if isinstance(sections, list) else None
+
+
+def extract_metadata(
+    markdown_text: str,
+    docling_json: Any,
+    existing: dict,
+    content_hash: str | None = None,
+    checkpoints: StageCheckpoints | None = None,
+) -> dict[str, Any]:
+    """LLM metadata extraction; only fills fields that are empty in existing. The raw output is checkpointed."""
+
+    def extract() -> dict[str, Any]:
+        data = _cached("extraction", content_hash)
+        if data is None:
+            data = request_legal_metadata(markdown_text, docling_sections_hint=docling_sections(docling_json))
+            _store("extraction", content_hash, data)
+        return data
+
+    return merge_extracted(run_stage(checkpoints, "extraction", extract), existing)
+
+
+def embed_entry(markdown_text: str, extracted: dict) -> list[float] | None:
+    """Optional pgvector embedding of the summary (or head of the document); cached by the embedded text."""
+    if not (ENABLE_VECTOR_FALLBACK and OPENAI_API_KEY):
+        return None
+    text_for_embedding = (extracted.get("summary") or markdown_text)[:MAX_TEXT_FOR_EMBEDDING]
+    text_hash = text_sha256(text_for_embedding)
+    ai_embedding = _cached("embedding", text_hash)
+    if ai_embedding is None:
+        ai_embedding = generate_embedding(text_for_embedding, max_chars=MAX_TEXT_FOR_EMBEDDING)
+        _store("embedding", text_hash, ai_embedding)
+    return ai_embedding
+
+
+def embed_sections(markdown_text: str) -> list[dict[str, Any]]:
+    """
+    Section-level chunks of the document with embeddings (vector fallback only). Identical texts
+    are embedded once, and vectors are cached by text hash, so repeated boilerplate across the
+    corpus is only paid for once.
+    """
+    if not (ENABLE_VECTOR_FALLBACK and EMBED_SECTIONS and OPENAI_API_KEY):
+        return []
+    pieces = section_texts(markdown_text, EMBEDDING_CHUNK_CHARS)
+    hashes = [text_sha256(text) for _, text in pieces]
+    vectors: dict[str, Any] = {}
+    missing: dict[str, str] = {}
+    for h, (_, text) in zip(hashes, pieces):
+        if h in vectors or h in missing:
+            continue
+        cached = _cached("embedding", h)
+        if cached is not None:
+            vectors[h] = cached
+        else:
+            missing[h] = text
+    if missing:
+        for h, vec in zip(missing, generate_embeddings(list(missing.values()), max_chars=EMBEDDING_CHUNK_CHARS)):
+            if vec is not None:
+                vectors[h] = vec
+                _store("embedding", h, vec)
+    chunks = []
+    for i, (h, (section, text)) in enumerate(zip(hashes, pieces)):
+        if vectors.get(h) is None:
+            continue
+        chunks.append({
+            "chunk_index": i,
+            "title": section.title or None,
+            "line_num": section.line_num if section.level else None,
+            "content": text,
+            "content_hash": h,
+            "embedding": vectors[h],
+        })
+    logger.info("Embedded %d sections (%d new texts)", len(chunks), len(missing))
+    return chunks
+
+
+def _node_ids_by_line(tree_result: Any) -> dict[int, str]:
+    """PageIndex node_id for each heading line (md_to_tree nodes carry line_num)."""
+    structure = tree_result.get("structure", tree_result) if isinstance(tree_result, dict) else tree_result
+    out: dict[int, str] = {}
+    stack = list(structure) if isinstance(structure, list) else [structure]
+    while stack:
+        node = stack.pop()
+        if not isinstance(node, dict):
+            continue
+        if node.get("line_num") is not None and node.get("node_id") is not None:
+            out[node["line_num"]] = node["node_id"]
+        stack.extend(node.get("nodes") or [])
+    return out
+
+
+def save_section_chunks(supabase, entry_id: str, chunks: list[dict], tree_result: Any) -> None:
+    """Replace the entry's rows in the chunk table, linking each chunk to its PageIndex node."""
+    if not chunks:
+        return
+    node_ids = _node_ids_by_line(tree_result)
+    rows = [{**c, "entry_id": entry_id, "node_id": node_ids.get(c["line_num"])} for c in chunks]
+    supabase.table(EMBEDDING_CHUNK_TABLE).delete().eq("entry_id", entry_id).execute()
+    for i in range(0, len(rows), 500):
+        supabase.table(EMBEDDING_CHUNK_TABLE).insert(rows[i:i + 500]).execute()
+
+
+def add_entry_episode(entry_id: str, existing: dict, extracted: dict, citations: list[str]) -> bool:
+    """Optional Graphiti episode for a KB entry."""
+    return add_episode_sync(
+        entry_id=entry_id,
+        document_type=extracted.get("document_type") or existing.get("document_type") or "legal_article",
+        jurisdiction=extracted.get("jurisdiction") or existing.get("jurisdiction") or "",
+        summary=extracted.get("summary"),
+        case_name=extracted.get("case_name") or existing.get("case_name"),
+        citations=citations,
+        decision_date=extracted.get("decision_date") or (str(existing.get("decision_date")) if existing.get("decision_date") else None),
+    )
+
+
+def index_entry_citations(
+    supabase,
+    entry_id: str,
+    organization_id: str | None,
+    existing: dict,
+    extracted: dict,
+    cited_cases: list[str],
+    cited_statutes: list[str],
+) -> list[tuple[str, str]]:
+    """
+    Refresh the entry's citation index rows and add Graphiti CITES edges to the entries its
+    citations resolve to. Returns [(cited entry id, citation)]; failures are logged, not raised.
+    """
+    own = {field: extracted.get(field) or existing.get(field) for field in ("case_citation", "statute_number")}
+    try:
+        cited = update_entry_index(supabase, entry_id, organization_id, own, cited_cases, cited_statutes)
+    except Exception as e:
+        logger.warning("Citation index update failed for entry %s: %s", entry_id, e)
+        return []
+    if cited:
+        add_citation_edges_sync(entry_id, cited)
+    return cited
+
+
+def index_entry_nodes(
+    entry_id: str,
+    organization_id: str | None,
+    existing: dict,
+    extracted: dict,
+    tree_result: Any,
+) -> None:
+    """Refresh the entry's rows in the lexical prefilter index; failures are logged, not raised."""
+    index = get_prefilter_index()
+    if index is None:
+        return
+    entry = {f: extracted.get(f) or existing.get(f) for f in ("title", "summary", "keywords", "legal_principles")}
+    try:
+        index.update_entry(entry_id, organization_id, entry, tree_result)
+    except Exception as e:
+        logger.warning("Prefilter index update failed for entry %s: %s", entry_id, e)
+
+
+def user_fields(existing: dict) -> dict[str, Any]:
+    """The columns of an existing row that extraction never replaces (user-provided values)."""
+    return {key: existing[key] for key in _FILL_IF_EMPTY_FIELDS if key in existing}
+
+
+def extracted_fields(existing: dict, extracted: dict) -> dict[str, Any]:
+    """legal_knowledge_base columns set from extraction output."""
+    fields = {}
+    for key in _FILL_IF_EMPTY_FIELDS:
+        if extracted.get(key) and not (existing.get(key) or "").strip():
+            fields[key] = extracted[key]
+    for key in _OVERWRITE_FIELDS:
+        if extracted.get(key) is not None:
+            fields[key] = extracted[key]
+    return fields
+
+
+def build_entry_update(
+    markdown_text: str,
+    tree_result: dict,
+    pageindex_metadata: dict,
+    existing: dict,
+    extracted: dict,
+    cited_cases: list[str],
+    cited_statutes: list[str],
+    ai_embedding: list[float] | None,
+) -> dict[str, Any]:
+    """Final legal_knowledge_base update for a completed entry."""
+    update_payload = {
+        "pageindex_tree": tree_result,
+        "pageindex_metadata": pageindex_metadata,
+        "processing_status": "completed",
+        "processing_pipeline": PIPELINE_NAME,
+        "ai_processed": True,
+        "full_text": markdown_text[:50000],
+        "cited_cases": cited_cases if cited_cases else None,
+        "cited_statutes": cited_statutes if cited_statutes else None,
+        "updated_at": datetime.now(tz=timezone.utc).isoformat(),
+    }
+    update_payload.update(extracted_fields(existing, extracted))
+    if ai_embedding is not None:
+        update_payload["ai_embedding"] = ai_embedding
+    return update_payload
+
+
+def _get_enrich_pool() -> ThreadPoolExecutor:
+    """Threads for the post-Docling stages of one job (mostly waiting on OpenAI, Supabase, Graphiti)."""
+    global _enrich_pool
+    if _enrich_pool is None:
+        _enrich_pool = ThreadPoolExecutor(max_workers=max(1, ENRICH_WORKERS), thread_name_prefix="enrich")
+    return _enrich_pool
+
+
+def _cancel_pending(futures: list[Future]) -> None:
+    for f in futures:
+        f.cancel()
+
+
+def enrich_entry(
+    supabase,
+    job: dict,
+    entry_id: str,
+    markdown_text: str,
+    docling_json: Any,
+    content_hash: str | None = None,
+    checkpoints: StageCheckpoints | None = None,
+) -> dict[str, Any]:
+    """
+    Steps after Docling for a KB entry, run as a dependency graph: the PageIndex tree (and its
+    summary pass), eyecite parsing, section embeddings and LLM extraction overlap; the document
+    embedding starts once extraction is done, Graphiti and the citation index once extraction and
+    citations are, and section chunks and the prefilter index are updated once the tree has node
+    ids. With checkpoints, stages completed by an
+    earlier attempt are reused and each fresh one is recorded as it finishes. Returns the row update.
+    """
+    pool = _get_enrich_pool()
+    f_tree = pool.submit(run_stage, checkpoints, "tree", lambda: build_tree(markdown_text, content_hash, docling_json))
+    f_citations = pool.submit(run_stage, checkpoints, "citations", lambda: parse_citations(markdown_text))
+    started = [f_tree, f_citations]
+    f_sections = None
+    if needs_stage(checkpoints, "sections"):
+        f_sections = pool.submit(embed_sections, markdown_text)
+        started.append(f_sections)
+    try:
+        existing = get_existing_entry(supabase, entry_id) or {}
+        existing.update(job.get("payload") or {})
+        extracted = extract_metadata(markdown_text, docling_json, existing, content_hash, checkpoints)
+
+        f_embedding = pool.submit(
+            run_stage, checkpoints, "embedding", lambda: embed_entry(markdown_text, extracted), lambda v: v is not None
+        )
+        started.append(f_embedding)
+        cited_cases, cited_statutes = f_citations.result()
+        f_episode = pool.submit(
+            run_stage,
+            checkpoints,
+            "graphiti",
+            lambda: add_entry_episode(entry_id, existing, extracted, cited_cases + cited_statutes),
+            bool,
+        )
+        started.append(f_episode)
+        f_index = pool.submit(
+            index_entry_citations,
+            supabase,
+            entry_id,
+            job.get("organization_id"),
+            existing,
+            extracted,
+            cited_cases,
+            cited_statutes,
+        )
+        started.append(f_index)
+
+        tree_result, pageindex_metadata = f_tree.result()
+        index_entry_nodes(entry_id, job.get("organization_id"), existing, extracted, tree_result)
+        run_stage(
+            checkpoints, "sections", lambda: save_section_chunks(supabase, entry_id, f_sections.result(), tree_result)
+        )
+        ai_embedding = f_embedding.result()
+        f_episode.result()
+        f_index.result()
+    except BaseException:
+        _cancel_pending(started)
+        raise
+
+    return build_entry_update(
+        markdown_text, tree_result, pageindex_metadata, existing, extracted, cited_cases, cited_statutes, ai_embedding
+    )
+
+
+def enrich_case_document(
+    job: dict,
+    document_id: str,
+    markdown_text: str,
+    content_hash: str | None = None,
+    checkpoints: StageCheckpoints | None = None,
+    docling_json: Any = None,
+) -> dict[str, Any]:
+    """Steps after Docling for a case document: tree and optional Graphiti episode, concurrently. Returns the row update."""
+    case_id = job.get("case_id")
+    f_episode = None
+    if case_id and ENABLE_GRAPHITI:
+        f_episode = _get_enrich_pool().submit(
+            run_stage,
+            checkpoints,
+            "graphiti",
+            lambda: add_case_document_episode_sync(document_id, case_id, markdown_text),
+            bool,
+        )
+    tree_result, pageindex_metadata = run_stage(
+        checkpoints, "tree", lambda: build_tree(markdown_text, content_hash, docling_json)
+    )
+    if f_episode is not None:
+        f_episode.result()
+    return {
+        "pageindex_tree": tree_result,
+        "pageindex_metadata": pageindex_metadata,
+        "processing_status": "completed",
+        "processing_pipeline": CASE_DOC_PIPELINE,
+        "ai_processed": True,
+        "updated_at": datetime.now(tz=timezone.utc).isoformat(),
+    }
@@ -0,0 +1,71 @@
+"""
+Streaming Supabase Storage downloads.
+Objects are fetched in fixed-size chunks straight into a file (hashing as they arrive),
+so peak memory stays at one chunk regardless of file size. A dropped connection resumes
+from the bytes already written with an HTTP Range request.
+"""
+import hashlib
+import logging
+import time
+from urllib.parse import quote
+
+import httpx
+
+from .clients import get_http_client
+from .config import (
+    DOWNLOAD_CHUNK_BYTES,
+    DOWNLOAD_MAX_RESUMES,
+    SUPABASE_SERVICE_ROLE_KEY,
+    SUPABASE_URL,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def object_url(bucket: str, path: str) -> str:
+    return f"{SUPABASE_URL.rstrip('/')}/storage/v1/object/{quote(bucket)}/{quote(path.lstrip('/'))}"
+
+
+def stream_download(bucket: str, path: str, dest, max_resumes: int = DOWNLOAD_MAX_RESUMES) -> str:
+    """
+    Stream bucket/path into the open binary file dest; return sha256 of the bytes written.
+    On a transport error the download resumes from the current offset (Range request) up to
+    max_resumes times; if the server ignores the Range header the file is rewritten from the start.
+    """
+    url = object_url(bucket, path)
+    base_headers = {
+        "Authorization": f"Bearer {SUPABASE_SERVICE_ROLE_KEY}",
+        "apikey": SUPABASE_SERVICE_ROLE_KEY,
+    }
+    h = hashlib.sha256()
+    offset = 0
+    attempt = 0
+    client = get_http_client()
+    while True:
+        headers = dict(base_headers)
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+        try:
+            with client.stream("GET", url, headers=headers) as r:
+                r.raise_for_status()
+                if offset and r.status_code != 206:
+                    logger.warning("Range not honoured for %s/%s; restarting download", bucket, path)
+                    dest.seek(0)
+                    dest.truncate()
+                    h = hashlib.sha256()
+                    offset = 0
+                for chunk in r.iter_bytes(DOWNLOAD_CHUNK_BYTES):
+                    dest.write(chunk)
+                    h.update(chunk)
+                    offset += len(chunk)
+            dest.flush()
+            return h.hexdigest()
+        except httpx.TransportError as e:
+            attempt += 1
+            if attempt > max_resumes:
+                raise RuntimeError(f"Download of {bucket}/{path} failed after {attempt} attempts: {e}") from e
+            logger.warning(
+                "Download of %s/%s interrupted at %d bytes (%s); resuming (%d/%d)",
+                bucket, path, offset, e, attempt, max_resumes,
+            )
+            time.sleep(min(2 ** attempt, 30))
@@ -0,0 +1,96 @@
+"""
+Per-attempt LLM call telemetry.
+Each request attempt records latency, prompt/completion tokens and its outcome, so retries
+and repairs show up as what they cost. Calls are logged as one line each, and totals per
+operation accumulate per process (stats(); logged at exit).
+"""
+import atexit
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_totals: dict[str, dict[str, float]] = {}
+
+
+@dataclass
+class Attempt:
+    kind: str  # request | repair
+    outcome: str  # ok | repaired | parse_error | api_error | refused | ...
+    latency_ms: float
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+
+@dataclass
+class CallTrace:
+    """Attempts of one logical LLM call (e.g. one extraction prompt), committed with finish()."""
+
+    operation: str
+    model: str
+    attempts: list[Attempt] = field(default_factory=list)
+
+    def record(self, kind: str, outcome: str, started: float, usage=None) -> Attempt:
+        attempt = Attempt(
+            kind=kind,
+            outcome=outcome,
+            latency_ms=(time.perf_counter() - started) * 1000,
+            prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+            completion_tokens=getattr(usage, "completion_tokens", 0) or 0,
+        )
+        self.attempts.append(attempt)
+        logger.debug(
+            "%s %s attempt %d: %s in %.0f ms (%d+%d tokens)",
+            self.operation, kind, len(self.attempts), outcome, attempt.latency_ms,
+            attempt.prompt_tokens, attempt.completion_tokens,
+        )
+        return attempt
+
+    def finish(self, outcome: str) -> None:
+        latency = sum(a.latency_ms for a in self.attempts)
+        prompt_tokens = sum(a.prompt_tokens for a in self.attempts)
+        completion_tokens = sum(a.completion_tokens for a in self.attempts)
+        # Tokens spent on attempts whose output was not used
+        wasted = sum(a.prompt_tokens + a.completion_tokens for a in self.attempts if a.outcome not in ("ok", "repaired"))
+        retries = sum(1 for a in self.attempts if a.kind == "request") - 1
+        repairs = sum(1 for a in self.attempts if a.kind == "repair" or a.outcome == "repaired")
+        logger.info(
+            "%s (%s): %s after %d attempt(s) in %.0f ms; %d+%d tokens (%d wasted), %d retries, %d repairs",
+            self.operation, self.model, outcome, len(self.attempts), latency,
+            prompt_tokens, completion_tokens, wasted, max(retries, 0), repairs,
+        )
+        with _lock:
+            t = _totals.setdefault(self.operation, {
+                "calls": 0, "failed_calls": 0, "attempts": 0, "retries": 0, "repairs": 0,
+                "latency_ms": 0.0, "prompt_tokens": 0, "completion_tokens": 0, "wasted_tokens": 0,
+            })
+            t["calls"] += 1
+            t["failed_calls"] += outcome != "ok"
+            t["attempts"] += len(self.attempts)
+            t["retries"] += max(retries, 0)
+            t["repairs"] += repairs
+            t["latency_ms"] += latency
+            t["prompt_tokens"] += prompt_tokens
+            t["completion_tokens"] += completion_tokens
+            t["wasted_tokens"] += wasted
+
+
+def stats() -> dict[str, dict[str, float]]:
+    """Per-operation totals for this process."""
+    with _lock:
+        return {op: dict(t) for op, t in _totals.items()}
+
+
+def _log_totals() -> None:
+    for op, t in stats().items():
+        logger.info(
+            "LLM %s totals: %d calls (%d failed), %d attempts, %d retries, %d repairs, %.0f ms, %d+%d tokens (%d wasted)",
+            op, t["calls"], t["failed_calls"], t["attempts"], t["retries"], t["repairs"], t["latency_ms"],
+            t["prompt_tokens"], t["completion_tokens"], t["wasted_tokens"],
+        )
+
+
+atexit.register(_log_totals)
@@ -0,0 +1,109 @@
+"""
+Bulk LLM metadata extraction for converted Legal KB entries via the OpenAI Batch API.
+Run from repo root with PYTHONPATH=workers/legal_kb_processor, or from workers/legal_kb_processor:
+  python -m scripts.batch_extract run [--limit N] [--dry-run]   # submit, wait, apply
+  python -m scripts.batch_extract submit [--limit N]             # submit only; prints batch ids
+  python -m scripts.batch_extract collect BATCH_ID [BATCH_ID ...]  # wait for and apply submitted batches
+  python -m scripts.batch_extract requeue [--limit N]            # requeue jobs of extraction_complete entries
+
+Selects entries with docling_markdown and processing_status docling_complete (run the worker with
+--defer-extraction to get there); applied entries move to extraction_complete and their jobs are
+requeued so a worker finishes them. Set LEGAL_KB_BATCH_BASE_URL to use a local stand-in batch endpoint.
+Requires: SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY, OPENAI_API_KEY (unless using a stand-in).
+"""
+import argparse
+import logging
+import sys
+from pathlib import Path
+
+# Allow importing legal_kb_processor when run as script
+_worker_root = Path(__file__).resolve().parents[1]
+if str(_worker_root) not in sys.path:
+    sys.path.insert(0, str(_worker_root))
+
+from supabase import create_client
+
+from legal_kb_processor.batch_extraction import (
+    apply_results,
+    build_batch_inputs,
+    collect_batch,
+    requeue_extracted,
+    select_entries,
+    submit_batch,
+)
+from legal_kb_processor.config import (
+    BATCH_API_BASE_URL,
+    BATCH_POLL_INTERVAL,
+    OPENAI_API_KEY,
+    STAGE_CHECKPOINTS,
+    SUPABASE_SERVICE_ROLE_KEY,
+    SUPABASE_URL,
+)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    stream=sys.stderr,
+)
+logger = logging.getLogger(__name__)
+
+
+def submit(supabase, limit: int, dry_run: bool) -> list[str]:
+    batches, cached = build_batch_inputs(select_entries(supabase, limit=limit))
+    requests = sum(len(b.lines) for b in batches)
+    logger.info("%d batch file(s), %d requests; %d entries already in the LLM cache", len(batches), requests, len(cached))
+    if dry_run:
+        for i, b in enumerate(batches):
+            logger.info("Would submit batch %d: %d requests, %d bytes", i + 1, len(b.lines), b.size)
+        return []
+    if cached:
+        applied, failed = apply_results(supabase, cached)
+        logger.info("Applied %d cached entries (%d failed)", applied, failed)
+    return [submit_batch(b) for b in batches]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk Legal KB metadata extraction (OpenAI Batch API)")
+    parser.add_argument("command", choices=["run", "submit", "collect", "requeue"])
+    parser.add_argument("batch_ids", nargs="*", help="Batch ids for collect")
+    parser.add_argument("--limit", type=int, default=0, help="Max entries to select (0 = all)")
+    parser.add_argument("--dry-run", action="store_true", help="Build batch files without submitting")
+    parser.add_argument("--poll-interval", type=float, default=BATCH_POLL_INTERVAL, help="Seconds between status polls")
+    parser.add_argument("--timeout", type=float, default=0, help="Give up waiting after N seconds (0 = no limit)")
+    args = parser.parse_args()
+
+    if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
+        logger.error("SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY required")
+        sys.exit(1)
+    if not STAGE_CHECKPOINTS:
+        logger.warning("LEGAL_KB_STAGE_CHECKPOINTS is off: requeued jobs will run extraction again")
+    if args.command == "requeue":
+        requeued = requeue_extracted(create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY), args.limit)
+        logger.info("Requeued %d job(s)", requeued)
+        return
+    if not OPENAI_API_KEY and not BATCH_API_BASE_URL:
+        logger.error("OPENAI_API_KEY required (or LEGAL_KB_BATCH_BASE_URL for a stand-in endpoint)")
+        sys.exit(1)
+    if args.command == "collect" and not args.batch_ids:
+        parser.error("collect needs at least one batch id")
+
+    supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+
+    batch_ids = args.batch_ids
+    if args.command in ("run", "submit"):
+        batch_ids = submit(supabase, args.limit, args.dry_run)
+        for batch_id in batch_ids:
+            print(batch_id)
+        if args.command == "submit" or args.dry_run:
+            return
+
+    failed = 0
+    for batch_id in batch_ids:
+        _, batch_failed = collect_batch(supabase, batch_id, args.poll_interval, args.timeout)
+        failed += batch_failed
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Rebuild or query the normalized citation index (LEGAL_KB_CITATION_INDEX_TABLE).
+Run from repo root with PYTHONPATH=workers/legal_kb_processor, or from workers/legal_kb_processor:
+  python -m scripts.citation_index rebuild [--dry-run] [--graphiti]   # regenerate from legal_knowledge_base
+  python -m scripts.citation_index lookup "[2019] eKLR 123" [--organization-id ORG]
+
+rebuild replaces each entry's rows (page by page); --graphiti also adds CITES edges between
+entries for every citation that resolves. lookup prints the entries that are the citation and
+the entries that cite it.
+Requires: SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY (and Graphiti config for --graphiti).
+"""
+import argparse
+import json
+import logging
+import sys
+from collections import defaultdict
+from pathlib import Path
+
+# Allow importing legal_kb_processor when run as script
+_worker_root = Path(__file__).resolve().parents[1]
+if str(_worker_root) not in sys.path:
+    sys.path.insert(0, str(_worker_root))
+
+from supabase import create_client
+
+from legal_kb_processor.citation_index import citing_entries, normalize_citation, rebuild_index, resolve_citations
+from legal_kb_processor.config import (
+    CITATION_INDEX_TABLE,
+    ENABLE_GRAPHITI,
+    SUPABASE_SERVICE_ROLE_KEY,
+    SUPABASE_URL,
+)
+from legal_kb_processor.graphiti_client import add_citation_edges_sync
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    stream=sys.stderr,
+)
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Legal KB citation index")
+    parser.add_argument("command", choices=["rebuild", "lookup"])
+    parser.add_argument("citation", nargs="?", help="Citation for lookup")
+    parser.add_argument("--organization-id", help="lookup: only this organization's and shared entries")
+    parser.add_argument("--dry-run", action="store_true", help="rebuild: build in memory and report, write nothing")
+    parser.add_argument("--graphiti", action="store_true", help="rebuild: also add CITES edges to Graphiti")
+    args = parser.parse_args()
+
+    if not CITATION_INDEX_TABLE:
+        logger.error("LEGAL_KB_CITATION_INDEX_TABLE is empty (index disabled)")
+        sys.exit(1)
+    if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
+        logger.error("SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY required")
+        sys.exit(1)
+    if args.command == "lookup" and not args.citation:
+        parser.error("lookup needs a citation")
+    if args.graphiti and not ENABLE_GRAPHITI:
+        logger.error("Set LEGAL_KB_ENABLE_GRAPHITI=yes to add edges to Graphiti")
+        sys.exit(1)
+
+    supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+
+    if args.command == "lookup":
+        print(json.dumps({
+            "citation": normalize_citation(args.citation),
+            "entries": resolve_citations(supabase, [args.citation], args.organization_id).get(args.citation, []),
+            "cited_by": citing_entries(supabase, args.citation, args.organization_id),
+        }, indent=2))
+        return
+
+    index = rebuild_index(supabase, write=not args.dry_run)
+    edges: dict[str, set[tuple[str, str]]] = defaultdict(set)
+    for citing_id, cited_id, citation in index.edges():
+        edges[citing_id].add((cited_id, citation))
+    logger.info("%d resolved citation edges from %d entries", sum(len(e) for e in edges.values()), len(edges))
+    if args.graphiti and not args.dry_run:
+        added = sum(add_citation_edges_sync(entry_id, sorted(cited)) for entry_id, cited in edges.items())
+        logger.info("Added Graphiti edges for %d/%d entries", added, len(edges))
+
+
+if __name__ == "__main__":
+    main()
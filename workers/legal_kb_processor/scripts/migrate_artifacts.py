@@ -0,0 +1,76 @@
+"""
+Move inline artifact columns (LEGAL_KB_ARTIFACT_FIELDS) of existing rows into the artifact store.
+Run from repo root with PYTHONPATH=workers/legal_kb_processor, or from workers/legal_kb_processor:
+  python -m scripts.migrate_artifacts [--table legal_knowledge_base|documents] [--limit N] [--dry-run]
+
+Rows whose columns already hold references are left alone, so the script can be re-run.
+Requires: SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY and the LEGAL_KB_ARTIFACT_BUCKET bucket.
+"""
+import argparse
+import logging
+import sys
+from pathlib import Path
+
+# Allow importing legal_kb_processor when run as script
+_worker_root = Path(__file__).resolve().parents[1]
+if str(_worker_root) not in sys.path:
+    sys.path.insert(0, str(_worker_root))
+
+from supabase import create_client
+
+from legal_kb_processor.artifacts import ARTIFACT_COLUMNS, artifact_ref, store_artifacts
+from legal_kb_processor.config import ARTIFACT_FIELDS, SUPABASE_SERVICE_ROLE_KEY, SUPABASE_URL
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    stream=sys.stderr,
+)
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move inline artifact columns into the artifact store")
+    parser.add_argument("--table", choices=["legal_knowledge_base", "documents"], default="legal_knowledge_base")
+    parser.add_argument("--limit", type=int, default=0, help="Max rows to migrate (0 = all)")
+    parser.add_argument("--page-size", type=int, default=50, help="Rows fetched per request (default 50)")
+    parser.add_argument("--dry-run", action="store_true", help="Count rows to migrate without uploading")
+    args = parser.parse_args()
+
+    fields = [f for f in ARTIFACT_FIELDS if f in ARTIFACT_COLUMNS]
+    if not fields:
+        logger.error("LEGAL_KB_ARTIFACT_FIELDS names no artifact column (%s)", ", ".join(ARTIFACT_COLUMNS))
+        sys.exit(1)
+    if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
+        logger.error("SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY required")
+        sys.exit(1)
+
+    supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+    migrated = 0
+    start = 0
+    while not args.limit or migrated < args.limit:
+        rows = (
+            supabase.table(args.table)
+            .select(", ".join(["id", *fields]))
+            .order("id")
+            .range(start, start + args.page_size - 1)
+            .execute()
+        ).data or []
+        for row in rows:
+            inline = {f: row[f] for f in fields if row.get(f) is not None and artifact_ref(row[f]) is None}
+            if not inline:
+                continue
+            if not args.dry_run:
+                stored = store_artifacts(supabase, inline)
+                supabase.table(args.table).update(stored).eq("id", row["id"]).execute()
+            migrated += 1
+            if args.limit and migrated >= args.limit:
+                break
+        if len(rows) < args.page_size:
+            break
+        start += args.page_size
+    logger.info("%s %d %s rows", "Would migrate" if args.dry_run else "Migrated", migrated, args.table)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Rebuild or query the local lexical prefilter index (LEGAL_KB_PREFILTER_INDEX_PATH; single-host only,
+needs LEGAL_KB_PREFILTER_INDEX=yes).
+Run from repo root with PYTHONPATH=workers/legal_kb_processor, or from workers/legal_kb_processor:
+  python -m scripts.prefilter_index rebuild [--organization-id ORG]   # from legal_knowledge_base
+  python -m scripts.prefilter_index query "adverse possession limitation" --organization-id ORG [--top-k 20]
+  python -m scripts.prefilter_index stats
+
+rebuild clears the index (or one organization's rows) and indexes every entry with a PageIndex
+tree; query prints the shortlisted entries with their best matching node ids.
+Requires: SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY for rebuild.
+"""
+import argparse
+import json
+import logging
+import sys
+from pathlib import Path
+
+# Allow importing legal_kb_processor when run as script
+_worker_root = Path(__file__).resolve().parents[1]
+if str(_worker_root) not in sys.path:
+    sys.path.insert(0, str(_worker_root))
+
+from legal_kb_processor.artifacts import load_artifact
+from legal_kb_processor.config import PREFILTER_INDEX_PATH, SUPABASE_SERVICE_ROLE_KEY, SUPABASE_URL
+from legal_kb_processor.prefilter import get_prefilter_index
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    stream=sys.stderr,
+)
+logger = logging.getLogger(__name__)
+
+_COLUMNS = "id, organization_id, title, summary, keywords, legal_principles, pageindex_tree"
+
+
+def rebuild(index, organization_id: str | None, page_size: int) -> None:
+    from supabase import create_client
+
+    if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
+        logger.error("SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY required")
+        sys.exit(1)
+    supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+    # Entries deleted from the KB since the last build drop out too
+    index.clear(organization_id)
+    entries = 0
+    start = 0
+    while True:
+        query = supabase.table("legal_knowledge_base").select(_COLUMNS).not_.is_("pageindex_tree", "null")
+        if organization_id:
+            query = query.eq("organization_id", organization_id)
+        rows = query.order("id").range(start, start + page_size - 1).execute().data or []
+        for row in rows:
+            try:
+                tree = load_artifact(supabase, row.get("pageindex_tree"))
+                index.update_entry(row["id"], row.get("organization_id"), row, tree)
+                entries += 1
+            except Exception as e:
+                logger.warning("Entry %s skipped: %s", row.get("id"), e)
+        if len(rows) < page_size:
+            break
+        start += page_size
+    index.optimize()
+    logger.info("Indexed %d entries (%s)", entries, index.stats())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Legal KB lexical prefilter index")
+    parser.add_argument("command", choices=["rebuild", "query", "stats"])
+    parser.add_argument("query", nargs="?", help="Search text for query")
+    parser.add_argument("--organization-id", help="rebuild: only this organization; query: its and shared entries")
+    parser.add_argument("--top-k", type=int, default=20, help="query: entries to return (default 20)")
+    parser.add_argument("--page-size", type=int, default=200, help="rebuild: rows fetched per request")
+    args = parser.parse_args()
+
+    index = get_prefilter_index()
+    if index is None:
+        logger.error("Prefilter index unavailable (set LEGAL_KB_PREFILTER_INDEX=yes; needs SQLite with FTS5)")
+        sys.exit(1)
+
+    if args.command == "rebuild":
+        rebuild(index, args.organization_id, args.page_size)
+    elif args.command == "query":
+        if not args.query:
+            parser.error("query needs search text")
+        hits = index.search(args.query, args.organization_id, top_k=args.top_k)
+        print(json.dumps([hit.__dict__ for hit in hits], indent=2))
+    else:
+        print(json.dumps({"path": PREFILTER_INDEX_PATH, **index.stats()}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Re-run chosen pipeline stages over existing Legal KB entries, without re-running Docling.
+Run from repo root with PYTHONPATH=workers/legal_kb_processor, or from workers/legal_kb_processor:
+  python -m scripts.rerun_stages --stages extraction --document-type statute --model gpt-4.1
+  python -m scripts.rerun_stages --stages tree,sections --organization-id ORG [--limit N] [--dry-run]
+  python -m scripts.rerun_stages --stages citations,graphiti --entry-id ID [--entry-id ID ...]
+
+Stages: tree, extraction, citations, embedding, sections, graphiti. Stages that consume a re-run
+stage's output (embedding and graphiti after extraction, sections after tree) keep their
+previous output unless listed too. Redoing Docling needs the file: requeue the entry's job.
+Requires: SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY, the processing_checkpoints column, and
+OPENAI_API_KEY for tree summaries, extraction and embeddings.
+"""
+import argparse
+import logging
+import os
+import sys
+from pathlib import Path
+
+# Allow importing legal_kb_processor when run as script
+_worker_root = Path(__file__).resolve().parents[1]
+if str(_worker_root) not in sys.path:
+    sys.path.insert(0, str(_worker_root))
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    stream=sys.stderr,
+)
+logger = logging.getLogger(__name__)
+
+_STAGE_NAMES = ("tree", "extraction", "citations", "embedding", "sections", "graphiti")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-run pipeline stages for Legal KB entries")
+    parser.add_argument("--stages", required=True, help=f"Comma-separated stages: {', '.join(_STAGE_NAMES)}")
+    parser.add_argument("--entry-id", action="append", default=[], help="Only this entry (repeatable)")
+    parser.add_argument("--organization-id", help="Only entries of this organization")
+    parser.add_argument("--document-type", help="Only entries of this type (case_law, statute, ...)")
+    parser.add_argument("--jurisdiction", help="Only entries in this jurisdiction")
+    parser.add_argument("--status", help="Only entries with this processing_status")
+    parser.add_argument("--model", help="LLM model for tree summaries and extraction (overrides LEGAL_KB_LLM_MODEL)")
+    parser.add_argument("--limit", type=int, default=0, help="Max entries (0 = all)")
+    parser.add_argument(
+        "--workers", type=int, default=4, help="Entries processed concurrently, trees built together (default 4)"
+    )
+    parser.add_argument("--dry-run", action="store_true", help="List matching entries without re-running")
+    args = parser.parse_args()
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = [s for s in stages if s not in _STAGE_NAMES]
+    if unknown or not stages:
+        parser.error(f"unknown stage(s) {', '.join(unknown) or '(none)'}; choose from {', '.join(_STAGE_NAMES)}")
+    if args.model:
+        # Settings are read when legal_kb_processor is imported
+        os.environ["LEGAL_KB_LLM_MODEL"] = args.model
+
+    from supabase import create_client
+
+    from legal_kb_processor.config import SUPABASE_SERVICE_ROLE_KEY, SUPABASE_URL
+    from legal_kb_processor.rerun import rerun_entries, select_entry_ids
+
+    if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
+        logger.error("SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY required")
+        sys.exit(1)
+
+    supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+    filters = {
+        column: value
+        for column, value in (
+            ("organization_id", args.organization_id),
+            ("document_type", args.document_type),
+            ("jurisdiction", args.jurisdiction),
+            ("processing_status", args.status),
+        )
+        if value
+    }
+    entry_ids = list(select_entry_ids(supabase, filters, args.entry_id, limit=args.limit))
+    logger.info("%d entries match; stages: %s", len(entry_ids), ", ".join(stages))
+    if args.dry_run:
+        for entry_id in entry_ids:
+            print(entry_id)
+        return
+
+    failed = 0
+    for entry_id, error in rerun_entries(supabase, entry_ids, stages, workers=args.workers):
+        if error is not None:
+            failed += 1
+            logger.warning("Entry %s failed: %s", entry_id, error)
+    logger.info("Done: %d re-run, %d failed", len(entry_ids) - failed, failed)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
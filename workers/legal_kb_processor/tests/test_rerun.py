@@ -0,0 +1,91 @@
+"""Re-running extraction over an existing entry (legal_kb_processor.rerun)."""
+import copy
+
+from legal_kb_processor import rerun
+
+
+class _Result:
+    def __init__(self, data):
+        self.data = data
+
+
+class _Query:
+    """The slice of the supabase-py query builder rerun_entry uses, over an in-memory table."""
+
+    def __init__(self, rows: list[dict]):
+        self.rows = rows
+        self.columns: list[str] | None = None
+        self.payload: dict | None = None
+        self.filters: list[tuple[str, object]] = []
+        self.one = False
+
+    def select(self, columns: str = "*"):
+        self.columns = None if columns == "*" else [c.strip() for c in columns.split(",")]
+        return self
+
+    def update(self, payload: dict):
+        self.payload = payload
+        return self
+
+    def eq(self, column: str, value):
+        self.filters.append((column, value))
+        return self
+
+    def limit(self, n: int):
+        return self
+
+    def single(self):
+        self.one = True
+        return self
+
+    def execute(self):
+        matched = [r for r in self.rows if all(r.get(c) == v for c, v in self.filters)]
+        if self.payload is not None:
+            for row in matched:
+                row.update(copy.deepcopy(self.payload))
+            return _Result(matched)
+        data = [{c: copy.deepcopy(r.get(c)) for c in self.columns} if self.columns else copy.deepcopy(r) for r in matched]
+        return _Result((data[0] if data else None) if self.one else data)
+
+
+class _Supabase:
+    def __init__(self, rows: list[dict]):
+        self.rows = rows
+
+    def table(self, name: str):
+        assert name == "legal_knowledge_base"
+        return _Query(self.rows)
+
+
+def test_rerun_extraction_replaces_previous_summary(monkeypatch):
+    row = {
+        "id": "e1",
+        "title": "Limitation Act",
+        "document_type": "statute",
+        "summary": "Old summary",
+        "keywords": ["old"],
+        "statute_name": "Limitation Act",
+        "docling_markdown": "# Limitation Act\n\nSection 7: actions for land are barred after twelve years.",
+        "docling_json": {"items": []},
+        "processing_checkpoints": {"content_hash": "h1", "stages": {}},
+    }
+    supabase = _Supabase([row])
+    reply = {
+        "title": "A different title",
+        "document_type": "case_law",
+        "summary": "New summary",
+        "keywords": ["limitation", "land"],
+    }
+    monkeypatch.setattr(rerun, "index_entry_citations", lambda *args, **kwargs: None)
+    monkeypatch.setattr(rerun, "index_entry_nodes", lambda *args, **kwargs: None)
+    monkeypatch.setattr("legal_kb_processor.stages.request_legal_metadata", lambda *args, **kwargs: dict(reply))
+    monkeypatch.setattr("legal_kb_processor.stages._cached", lambda *args: None)
+
+    rerun.rerun_entry(supabase, "e1", ["extraction"])
+
+    assert row["summary"] == "New summary"
+    assert row["keywords"] == ["limitation", "land"]
+    # User-provided values are kept
+    assert row["title"] == "Limitation Act"
+    assert row["document_type"] == "statute"
+    assert row["processing_checkpoints"]["stages"]["extraction"]["output"]["summary"] == "New summary"